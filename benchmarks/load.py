@@ -0,0 +1,332 @@
+"""Load benchmark for the API.
+
+Seeds the database given by --database-url (or BENCH_DATABASE_URL), drives
+the real ASGI app with concurrent clients (in-process or through uvicorn)
+and writes the latency percentiles and throughput of each endpoint to a
+JSON file. Given a baseline file, exits with status 1 when an endpoint
+regressed more than the threshold.
+
+    export BENCH_DATABASE_URL=postgresql+psycopg://.../bench
+    python -m benchmarks --users 10000 --todos 1000000 --output bench.json
+    python -m benchmarks --skip-seed --baseline bench.json
+    python -m benchmarks --reset --users 1000 --todos 100000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime
+from itertools import count
+from random import Random
+from statistics import quantiles
+from time import perf_counter
+
+import httpx
+from sqlalchemy import func, select
+
+from benchmarks.seed import (
+    BENCH_PASSWORD,
+    add_database_argument,
+    migrate,
+    seed,
+    use_database,
+)
+from todo_fastapi.database import create_engine
+from todo_fastapi.main.app import app
+from todo_fastapi.models.models_db import Todo, User
+from todo_fastapi.settings import get_settings
+
+LOGIN_USERS = 50
+
+
+def login_request(emails: list[str], tokens: list[str]):
+    random = Random(0)
+
+    def request(client: httpx.AsyncClient):
+        return client.post(
+            '/auth/token/',
+            data={
+                'username': random.choice(emails),
+                'password': BENCH_PASSWORD,
+            },
+        )
+
+    return request
+
+
+def todos_request(emails: list[str], tokens: list[str]):
+    random = Random(1)
+
+    def request(client: httpx.AsyncClient):
+        return client.get(
+            '/todos/?limit=10',
+            headers={'Authorization': f'Bearer {random.choice(tokens)}'},
+        )
+
+    return request
+
+
+def users_request(emails: list[str], tokens: list[str]):
+    random = Random(2)
+
+    def request(client: httpx.AsyncClient):
+        return client.get(
+            '/users/?limit=10',
+            headers={'Authorization': f'Bearer {random.choice(tokens)}'},
+        )
+
+    return request
+
+
+SCENARIOS = {
+    '/auth/token/': login_request,
+    '/todos/': todos_request,
+    '/users/': users_request,
+}
+
+
+@asynccontextmanager
+async def in_process_client():
+    # roda o lifespan da app, o ASGITransport sozinho não faz isso
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url='http://bench'
+        ) as client:
+            yield client
+
+
+@asynccontextmanager
+async def uvicorn_client(port: int, workers: int, concurrency: int):
+    # mesmo perfil da produção: uvloop, httptools e keep-alive ajustado
+    server = subprocess.Popen([
+        sys.executable,
+        '-m',
+        'todo_fastapi.serve',
+        '--host',
+        '127.0.0.1',
+        '--port',
+        str(port),
+        '--workers',
+        str(workers),
+        '--log-level',
+        'warning',
+    ])
+    limits = httpx.Limits(max_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f'http://127.0.0.1:{port}', limits=limits
+        ) as client:
+            await _wait_until_up(client)
+            yield client
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def _wait_until_up(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        try:
+            await client.get('/docs')
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError('uvicorn did not start in time')
+
+
+async def measure(client, request, concurrency: int, total: int):
+    """_summary_
+
+    Args:
+        client (httpx.AsyncClient): client bound to the app under test
+        request: callable that sends one request with the given client
+        concurrency (int): amount of clients sending requests at once
+        total (int): amount of requests sent by all the clients together
+
+    Returns:
+        dict: latency percentiles in milliseconds, requests per second and
+        the amount of non 2xx responses
+    """
+    latencies = []
+    errors = 0
+    sent = count()
+
+    async def worker():
+        nonlocal errors
+        while next(sent) < total:
+            start = perf_counter()
+            response = await request(client)
+            latencies.append((perf_counter() - start) * 1000)
+            if not response.is_success:
+                errors += 1
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = perf_counter() - start
+
+    p50, p95, p99 = (quantiles(latencies, n=100)[i] for i in (49, 94, 98))
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(p50, 3),
+        'p95_ms': round(p95, 3),
+        'p99_ms': round(p99, 3),
+    }
+
+
+async def login_tokens(client, emails: list[str]):
+    tokens = []
+    for email in emails[:LOGIN_USERS]:
+        response = await client.post(
+            '/auth/token/',
+            data={'username': email, 'password': BENCH_PASSWORD},
+        )
+        response.raise_for_status()
+        tokens.append(response.json()['access_token'])
+    return tokens
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """Lists the endpoints slower than the baseline by more than threshold.
+
+    A regression is a p95 latency above baseline * (1 + threshold) or a
+    throughput below baseline * (1 - threshold).
+    """
+    regressions = []
+    for endpoint, result in current['endpoints'].items():
+        base = baseline['endpoints'].get(endpoint)
+        if base is None:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(
+                f'{endpoint}: p95 {base["p95_ms"]}ms -> {result["p95_ms"]}ms'
+            )
+        if result['rps'] < base['rps'] * (1 - threshold):
+            regressions.append(
+                f'{endpoint}: {base["rps"]} req/s -> {result["rps"]} req/s'
+            )
+    return regressions
+
+
+def git_commit():
+    result = subprocess.run(
+        ['git', 'rev-parse', '--short', 'HEAD'],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return result.stdout.strip() or None
+
+
+async def run(args):
+    engine = create_engine(get_settings())
+    try:
+        if args.skip_seed:
+            emails, todos = await _existing_dataset(engine)
+        else:
+            emails = await seed(engine, args.users, args.todos)
+            todos = args.todos
+    finally:
+        await engine.dispose()
+
+    if args.mode == 'uvicorn':
+        client_context = uvicorn_client(
+            args.port, args.workers, args.concurrency
+        )
+    else:
+        client_context = in_process_client()
+
+    endpoints = {}
+    async with client_context as client:
+        tokens = await login_tokens(client, emails)
+        for endpoint in args.endpoints:
+            request = SCENARIOS[endpoint](emails, tokens)
+            # aquece conexões e caches antes de medir
+            await measure(client, request, args.concurrency, args.concurrency)
+            endpoints[endpoint] = await measure(
+                client, request, args.concurrency, args.requests
+            )
+
+    return {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'mode': args.mode,
+        'workers': args.workers if args.mode == 'uvicorn' else 1,
+        'concurrency': args.concurrency,
+        'dataset': {'users': len(emails), 'todos': todos},
+        'endpoints': endpoints,
+    }
+
+
+async def _existing_dataset(engine):
+    async with engine.connect() as conn:
+        emails = (await conn.scalars(select(User.email))).all()
+        todos = await conn.scalar(select(func.count(Todo.id)))
+    return emails, todos
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--todos', type=int, default=1_000_000)
+    parser.add_argument('--skip-seed', action='store_true')
+    # apaga os dados de uma execução anterior antes do seed
+    parser.add_argument('--reset', action='store_true')
+    add_database_argument(parser)
+    parser.add_argument(
+        '--mode', choices=['inprocess', 'uvicorn'], default='inprocess'
+    )
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2_000)
+    parser.add_argument(
+        '--endpoints',
+        nargs='+',
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+    )
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args(argv)
+    # um baseline que não existe passaria sempre no gate de regressão
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f'baseline file not found: {args.baseline}')
+    use_database(parser, args.database_url)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        # lido antes, --output pode ser o mesmo arquivo
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+    if not args.skip_seed:
+        migrate(args.database_url, reset=args.reset)
+    result = asyncio.run(run(args))
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(result, file, indent=2)
+
+    for endpoint, numbers in result['endpoints'].items():
+        print(
+            f'{endpoint:<14} {numbers["rps"]:>10} req/s  '
+            f'p50 {numbers["p50_ms"]}ms  p95 {numbers["p95_ms"]}ms  '
+            f'p99 {numbers["p99_ms"]}ms  errors {numbers["errors"]}'
+        )
+
+    if baseline is not None:
+        regressions = compare(baseline, result, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,189 @@
+"""Throughput scaling of the production server from 1 to N workers.
+
+Starts python -m todo_fastapi.serve once per worker count against the
+dataset already seeded by python -m benchmarks, and drives it from
+several client processes, so a single client event loop is not what
+limits the measured throughput.
+
+    export BENCH_DATABASE_URL=postgresql+psycopg://.../bench
+    python -m benchmarks --users 10000 --todos 1000000 --output bench.json
+    python -m benchmarks.scaling --workers 1 2 4 --clients 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import httpx
+
+from benchmarks.load import (
+    SCENARIOS,
+    _existing_dataset,
+    git_commit,
+    login_tokens,
+    measure,
+    uvicorn_client,
+)
+from benchmarks.seed import add_database_argument, use_database
+from todo_fastapi.database import create_engine
+from todo_fastapi.settings import get_settings
+
+
+def default_workers() -> list[int]:
+    # potências de 2 até os CPUs disponíveis, sempre incluindo o máximo
+    cpus = os.process_cpu_count() or 1
+    workers = [1]
+    while workers[-1] * 2 < cpus:
+        workers.append(workers[-1] * 2)
+    if cpus > 1:
+        workers.append(cpus)
+    return workers
+
+
+async def _drive(port: int, endpoint: str, dataset: tuple, load: tuple):
+    emails, tokens = dataset
+    concurrency, total = load
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=f'http://127.0.0.1:{port}', limits=limits
+    ) as client:
+        request = SCENARIOS[endpoint](emails, tokens)
+        return await measure(client, request, concurrency, total)
+
+
+def client_process(port: int, endpoint: str, dataset: tuple, load: tuple):
+    # roda em outro processo, com o próprio event loop
+    return asyncio.run(_drive(port, endpoint, dataset, load))
+
+
+async def measure_clients(pool, args, endpoint, emails, tokens):
+    """_summary_
+
+    Args:
+        pool (ProcessPoolExecutor): one process per client
+        args: parsed command line, with the port, clients, concurrency
+        and requests
+        endpoint (str): key of the scenario in SCENARIOS
+        emails (list[str]): emails of the seeded users
+        tokens (list[str]): access tokens of some of them
+
+    Returns:
+        dict: summed throughput and errors of the clients, with the worst
+        p95 and p99 among them
+    """
+    loop = asyncio.get_running_loop()
+    concurrency = max(args.concurrency // args.clients, 1)
+    total = max(args.requests // args.clients, 1)
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                pool,
+                client_process,
+                args.port,
+                endpoint,
+                (emails, tokens),
+                (concurrency, total),
+            )
+            for _ in range(args.clients)
+        )
+    )
+
+    return {
+        'requests': sum(result['requests'] for result in results),
+        'errors': sum(result['errors'] for result in results),
+        'rps': round(sum(result['rps'] for result in results), 2),
+        'p95_ms': max(result['p95_ms'] for result in results),
+        'p99_ms': max(result['p99_ms'] for result in results),
+    }
+
+
+async def run(args):
+    engine = create_engine(get_settings())
+    try:
+        emails, todos = await _existing_dataset(engine)
+    finally:
+        await engine.dispose()
+    if not emails:
+        raise SystemExit('empty database, seed it with python -m benchmarks')
+
+    results = {}
+    with ProcessPoolExecutor(args.clients) as pool:
+        for workers in args.workers:
+            async with uvicorn_client(
+                args.port, workers, args.concurrency
+            ) as client:
+                tokens = await login_tokens(client, emails)
+                results[workers] = {}
+                for endpoint in args.endpoints:
+                    # aquece os workers e os pools de conexões
+                    await measure(
+                        client,
+                        SCENARIOS[endpoint](emails, tokens),
+                        args.concurrency,
+                        args.concurrency * workers,
+                    )
+                    results[workers][endpoint] = await measure_clients(
+                        pool, args, endpoint, emails, tokens
+                    )
+
+    baseline = results[args.workers[0]]
+    for numbers in results.values():
+        for endpoint, result in numbers.items():
+            result['speedup'] = round(
+                result['rps'] / baseline[endpoint]['rps'], 2
+            )
+
+    return {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'cpus': os.process_cpu_count(),
+        'clients': args.clients,
+        'concurrency': args.concurrency,
+        'dataset': {'users': len(emails), 'todos': todos},
+        'workers': results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--workers', type=int, nargs='+', default=default_workers()
+    )
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=4_000)
+    parser.add_argument(
+        '--endpoints',
+        nargs='+',
+        choices=list(SCENARIOS),
+        default=['/todos/', '/users/'],
+    )
+    parser.add_argument('--output', default='bench_scaling.json')
+    add_database_argument(parser)
+    args = parser.parse_args(argv)
+    use_database(parser, args.database_url)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(result, file, indent=2)
+
+    for workers, endpoints in result['workers'].items():
+        for endpoint, numbers in endpoints.items():
+            print(
+                f'{workers:>3} workers  {endpoint:<10} '
+                f'{numbers["rps"]:>10} req/s  {numbers["speedup"]:>5}x  '
+                f'p95 {numbers["p95_ms"]}ms  errors {numbers["errors"]}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Seeds a realistic dataset for the benchmarks.
+
+The benchmarks only run against the database given by --database-url or
+BENCH_DATABASE_URL, never the DATABASE_URL of the app. The schema comes
+from `alembic upgrade head`, with the partitions, counters and full text
+search objects the routes use, and an existing dataset is only dropped
+with --reset.
+
+Rows are built with the test factories and inserted in batches with
+executemany, a 1M todos dataset never lives in memory at once.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+from itertools import cycle
+from pathlib import Path
+
+from sqlalchemy import insert, make_url, select, text
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+
+from todo_fastapi.counters import rebuild_counters
+from todo_fastapi.models.models_db import Todo, User
+from todo_fastapi.security import get_pwd_hash
+from todo_fastapi.settings import get_settings
+from todo_fastapi.tests.conftest import RandomTodo, RandomUser
+
+BENCH_PASSWORD = 'bench_password'
+BATCH_SIZE = 5_000
+
+
+def add_database_argument(parser):
+    parser.add_argument(
+        '--database-url',
+        default=os.environ.get('BENCH_DATABASE_URL'),
+        help='database of the benchmark (default: $BENCH_DATABASE_URL)',
+    )
+
+
+def use_database(parser, url: str | None):
+    """_summary_
+
+    Args:
+        parser (argparse.ArgumentParser): exits through it without a url
+        url (str | None): --database-url of the command line
+    """
+    if not url:
+        parser.error(
+            'pass --database-url or set BENCH_DATABASE_URL, the benchmark '
+            'never runs against the DATABASE_URL of the app'
+        )
+    # a app em processo, o alembic e os workers do uvicorn leem o
+    # DATABASE_URL do ambiente
+    os.environ['DATABASE_URL'] = url
+    get_settings.cache_clear()
+
+
+async def _drop_schema(url: str):
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.execute(text('DROP SCHEMA public CASCADE'))
+        await conn.execute(text('CREATE SCHEMA public'))
+    await engine.dispose()
+
+
+def migrate(url: str, reset: bool = False):
+    """_summary_
+
+    Args:
+        url (str): database of the benchmark
+        reset (bool): drop everything in it before migrating
+    """
+    if reset:
+        # recria o banco do zero, o downgrade base não remove tudo (o tipo
+        # todostate continua no postgres)
+        database = make_url(url)
+        if database.get_backend_name() != 'sqlite':
+            asyncio.run(_drop_schema(url))
+        elif database.database:
+            Path(database.database).unlink(missing_ok=True)
+
+    # o mesmo schema da produção, com o que o create_all não cria
+    subprocess.run(
+        [sys.executable, '-m', 'alembic', 'upgrade', 'head'], check=True
+    )
+
+
+def _user_row(user: User):
+    return {
+        'username': user.username,
+        'email': user.email,
+        'password': user.password,
+    }
+
+
+def _todo_row(todo: Todo):
+    return {
+        'title': todo.title,
+        'description': todo.description,
+        'state': todo.state,
+        'user_id': todo.user_id,
+    }
+
+
+async def seed(engine: AsyncEngine, users: int, todos: int):
+    """_summary_
+
+    Args:
+        engine (AsyncEngine): engine of the benchmark database
+        users (int): amount of users to create
+        todos (int): amount of todos, spread evenly between the users
+
+    Returns:
+        list[str]: emails of the created users, all of them use
+        BENCH_PASSWORD as password
+    """
+    async with engine.connect() as conn:
+        if await conn.scalar(select(User.id).limit(1)) is not None:
+            raise SystemExit(
+                'the benchmark database already has users, pass --reset to '
+                'drop them or --skip-seed to reuse them'
+            )
+
+    # um único hash argon2 para todos, senão o seed levaria horas
+    password = get_pwd_hash(BENCH_PASSWORD)
+
+    for start in range(0, users, BATCH_SIZE):
+        amount = min(BATCH_SIZE, users - start)
+        batch = RandomUser.build_batch(amount, password=password)
+        async with engine.begin() as conn:
+            await conn.execute(insert(User), [_user_row(u) for u in batch])
+
+    async with engine.connect() as conn:
+        user_ids = (await conn.scalars(select(User.id))).all()
+        emails = (await conn.scalars(select(User.email))).all()
+
+    owners = cycle(user_ids)
+    for start in range(0, todos, BATCH_SIZE):
+        amount = min(BATCH_SIZE, todos - start)
+        batch = [RandomTodo.build(user_id=next(owners)) for _ in range(amount)]
+        async with engine.begin() as conn:
+            await conn.execute(insert(Todo), [_todo_row(t) for t in batch])
+
+    # os inserts em lote não passam pelos contadores das rotas
+    async with AsyncSession(engine) as session:
+        await rebuild_counters(session)
+
+    return emails
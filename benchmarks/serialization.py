@@ -0,0 +1,88 @@
+"""Micro-benchmark of the todo list serialization paths.
+
+Compares the response_model path (ORM objects validated into TodosList
+with from_attributes, dumped to python and then to JSON, as FastAPI does)
+with the direct path (column rows dumped by a pre-built TypeAdapter).
+
+    python -m benchmarks.serialization --sizes 10 100 --repeat 200
+"""
+
+import argparse
+import json
+from datetime import datetime
+from timeit import repeat
+
+from pydantic import TypeAdapter
+
+from todo_fastapi.models.models_db import Todo, TodoState
+from todo_fastapi.schema.schemas import TodosList
+from todo_fastapi.serialization import TODO_COLUMNS, todos_page_adapter
+
+todos_list_adapter = TypeAdapter(TodosList)
+COLUMN_NAMES = tuple(column.key for column in TODO_COLUMNS)
+
+
+def build_page(size: int):
+    now = datetime(2026, 1, 1)
+    values = [
+        (index, f'title {index}', 'description', TodoState.todo, now, now)
+        for index in range(size)
+    ]
+    orm_rows = [
+        Todo(**dict(zip(COLUMN_NAMES, row)), user_id=1) for row in values
+    ]
+    return orm_rows, values
+
+
+def response_model_path(orm_rows) -> bytes:
+    content = {'todos': orm_rows, 'next_cursor': None}
+    validated = todos_list_adapter.validate_python(
+        content, from_attributes=True
+    )
+    python = todos_list_adapter.dump_python(validated, mode='json')
+    return json.dumps(
+        python, ensure_ascii=False, separators=(',', ':')
+    ).encode()
+
+
+def direct_path(values) -> bytes:
+    # Row._asdict() nas rotas, aqui as tuplas já vêm prontas
+    todos = [dict(zip(COLUMN_NAMES, row)) for row in values]
+    return todos_page_adapter.dump_json({'todos': todos, 'next_cursor': None})
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--repeat', type=int, default=200)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    for size in args.sizes:
+        orm_rows, values = build_page(size)
+        # os dois caminhos precisam gerar o mesmo corpo
+        assert json.loads(response_model_path(orm_rows)) == json.loads(
+            direct_path(values)
+        )
+
+        results = {}
+        for name, call in (
+            ('response_model', lambda: response_model_path(orm_rows)),
+            ('type_adapter', lambda: direct_path(values)),
+        ):
+            best = min(repeat(call, number=args.repeat, repeat=5))
+            results[name] = best / args.repeat * 1_000_000
+
+        speedup = results['response_model'] / results['type_adapter']
+        print(
+            f'{size:>5} rows  response_model '
+            f'{results["response_model"]:>9.1f}us  type_adapter '
+            f'{results["type_adapter"]:>9.1f}us  {speedup:.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -2,4 +2,6 @@
 
 uv run alembic upgrade head
 
-uv run uvicorn --host 0.0.0.0 --port 8000 todo_fastapi.main.app:app
+# exec: o SIGTERM do container chega direto no servidor, que drena as
+# conexões antes de sair
+exec uv run python -m todo_fastapi.serve
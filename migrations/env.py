@@ -10,7 +10,8 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from todo_fastapi.models.models_db import Base
+from todo_fastapi.models.models_db import Base, TODO_SEARCH_OBJECTS
+from todo_fastapi.partitioning import PARTITION_NAME
 from todo_fastapi.settings import Settings
 
 
@@ -30,6 +31,20 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    # a busca textual é criada por DDL própria e não existe no metadata,
+    # sem isso o autogenerate tentaria removê-la
+    if reflected and compare_to is None and name in TODO_SEARCH_OBJECTS:
+        return False
+    # as partições de todos (postgres) são criadas pela migration que
+    # particiona a tabela, o metadata só conhece a tabela pai
+    if type_ == 'table' and reflected and PARTITION_NAME.fullmatch(name):
+        return False
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -55,6 +70,7 @@ def run_migrations_offline() -> None:
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
         render_as_batch=True,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -63,7 +79,8 @@ def run_migrations_offline() -> None:
 
 def do_run_migrations(connection):
     context.configure(connection=connection,
-                      target_metadata=target_metadata, render_as_batch=True)
+                      target_metadata=target_metadata, render_as_batch=True,
+                      include_object=include_object)
     with context.begin_transaction():
         context.run_migrations()
 
@@ -0,0 +1,67 @@
+"""partition todos by user_id
+
+Revision ID: 3f9b2d6c1a47
+Revises: 0a145a8d5fe6
+Create Date: 2026-10-18 23:12:41.208316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from todo_fastapi.partitioning import (
+    TodosTable,
+    partition_todos,
+    unpartition_todos,
+)
+from todo_fastapi.settings import Settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9b2d6c1a47'
+down_revision: Union[str, Sequence[str], None] = '0a145a8d5fe6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# todos nesta revisão, migrations seguintes que mudarem a tabela não
+# alteram o que esta cria ou copia
+TODOS = TodosTable(
+    columns=(
+        'id',
+        'title',
+        'description',
+        'state',
+        'created_at',
+        'updated_at',
+        'user_id',
+    ),
+    indexes=(
+        ('ix_todos_user_id_id', ('user_id', 'id')),
+        ('ix_todos_user_id_state_id', ('user_id', 'state', 'id')),
+        ('ix_todos_user_id_updated_at_id', ('user_id', 'updated_at', 'id')),
+    ),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # só o postgres tem partições, no sqlite a tabela continua a mesma
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    # em bancos grandes rode antes python -m todo_fastapi.partitioning,
+    # que copia em lotes sem travar a tabela; aqui ela já estará
+    # particionada e nada é feito
+    partition_todos(
+        bind, Settings().TODO_PARTITIONS, batch_size=10_000, todos=TODOS
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    unpartition_todos(bind, TODOS)
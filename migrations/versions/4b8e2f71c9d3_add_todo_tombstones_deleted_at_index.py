@@ -0,0 +1,30 @@
+"""add todo tombstones deleted_at index
+
+Revision ID: 4b8e2f71c9d3
+Revises: e6b1c4d93f20
+Create Date: 2026-10-19 02:17:45.903114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b8e2f71c9d3'
+down_revision: Union[str, Sequence[str], None] = 'e6b1c4d93f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a limpeza dos tombstones roda com a aplicação no ar
+    with op.get_context().autocommit_block():
+        op.create_index('ix_todo_tombstones_deleted_at', 'todo_tombstones', ['deleted_at'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_todo_tombstones_deleted_at', table_name='todo_tombstones', postgresql_concurrently=True)
@@ -0,0 +1,41 @@
+"""add todo tombstones and changes index
+
+Revision ID: a7c3e91f4d28
+Revises: d8a3f5c1e9b2
+Create Date: 2026-10-18 13:25:08.771930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e91f4d28'
+down_revision: Union[str, Sequence[str], None] = 'd8a3f5c1e9b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('todo_tombstones',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('todo_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_todo_tombstones_user_id_deleted_at', 'todo_tombstones', ['user_id', 'deleted_at'], unique=False)
+    # mesmo motivo de c41d9e2b7a15, sem travar as escritas em todos
+    with op.get_context().autocommit_block():
+        op.create_index('ix_todos_user_id_updated_at_id', 'todos', ['user_id', 'updated_at', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_todos_user_id_updated_at_id', table_name='todos', postgresql_concurrently=True)
+    op.drop_index('ix_todo_tombstones_user_id_deleted_at', table_name='todo_tombstones')
+    op.drop_table('todo_tombstones')
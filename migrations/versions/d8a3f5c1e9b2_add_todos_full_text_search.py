@@ -0,0 +1,73 @@
+"""add todos full text search
+
+Revision ID: d8a3f5c1e9b2
+Revises: c41d9e2b7a15
+Create Date: 2026-10-18 11:02:17.540913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8a3f5c1e9b2'
+down_revision: Union[str, Sequence[str], None] = 'c41d9e2b7a15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # mesma DDL registrada nos eventos de models_db.Todo
+    if op.get_bind().dialect.name == 'postgresql':
+        # a coluna gerada reescreve a tabela, rode em janela de manutenção
+        op.execute(
+            "ALTER TABLE todos ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', "
+            "title || ' ' || description)) STORED"
+        )
+        with op.get_context().autocommit_block():
+            op.execute(
+                'CREATE INDEX CONCURRENTLY ix_todos_search_vector ON todos '
+                'USING gin (search_vector)'
+            )
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE todos_fts USING fts5(title, description, "
+        "content='todos', content_rowid='id')"
+    )
+    op.execute(
+        'CREATE TRIGGER todos_fts_insert AFTER INSERT ON todos BEGIN '
+        'INSERT INTO todos_fts(rowid, title, description) '
+        'VALUES (new.id, new.title, new.description); END'
+    )
+    op.execute(
+        'CREATE TRIGGER todos_fts_delete AFTER DELETE ON todos BEGIN '
+        'INSERT INTO todos_fts(todos_fts, rowid, title, description) '
+        "VALUES ('delete', old.id, old.title, old.description); END"
+    )
+    op.execute(
+        'CREATE TRIGGER todos_fts_update AFTER UPDATE ON todos BEGIN '
+        'INSERT INTO todos_fts(todos_fts, rowid, title, description) '
+        "VALUES ('delete', old.id, old.title, old.description); "
+        'INSERT INTO todos_fts(rowid, title, description) '
+        'VALUES (new.id, new.title, new.description); END'
+    )
+    # indexa os todos que já existem
+    op.execute("INSERT INTO todos_fts(todos_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_todos_search_vector')
+        op.execute('ALTER TABLE todos DROP COLUMN search_vector')
+        return
+
+    op.execute('DROP TRIGGER IF EXISTS todos_fts_update')
+    op.execute('DROP TRIGGER IF EXISTS todos_fts_delete')
+    op.execute('DROP TRIGGER IF EXISTS todos_fts_insert')
+    op.execute('DROP TABLE IF EXISTS todos_fts')
@@ -0,0 +1,123 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from time import time
+
+from fastapi import Request
+
+from todo_fastapi.schema.schemas import UserPrincipal
+from todo_fastapi.settings import Settings
+
+
+class PrincipalCache(ABC):
+    """Cache of authenticated principals keyed by the token subject.
+
+    Entries never outlive the `exp` claim of the token that resolved them.
+    """
+
+    @abstractmethod
+    async def get(self, subject: str) -> UserPrincipal | None: ...
+
+    @abstractmethod
+    async def set(
+        self, subject: str, principal: UserPrincipal, expires_at: float
+    ) -> None: ...
+
+    @abstractmethod
+    async def invalidate(self, subject: str) -> None: ...
+
+
+class MemoryPrincipalCache(PrincipalCache):
+    """In-process LRU cache, the default backend.
+
+    Each worker keeps its own entries, so with several workers a change is
+    only seen by the others when their entry expires (at most `ttl`).
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, UserPrincipal]] = (
+            OrderedDict()
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, subject):
+        entry = self._entries.get(subject)
+        if entry is None:
+            return None
+
+        expires_at, principal = entry
+        if expires_at <= time():
+            del self._entries[subject]
+            return None
+
+        self._entries.move_to_end(subject)
+        return principal
+
+    async def set(self, subject, principal, expires_at):
+        self._entries[subject] = (
+            min(expires_at, time() + self.ttl),
+            principal,
+        )
+        self._entries.move_to_end(subject)
+
+        # remove os registros usados há mais tempo
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, subject):
+        self._entries.pop(subject, None)
+
+
+class RedisPrincipalCache(PrincipalCache):
+    """Backend shared by every worker.
+
+    `client` is any asyncio client speaking the redis `GET`, `SET ... EX`
+    and `DEL` commands (redis.asyncio, valkey or a local stand-in).
+    """
+
+    def __init__(self, client, ttl: int, prefix: str = 'principal:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, subject):
+        data = await self.client.get(self.prefix + subject)
+        if data is None:
+            return None
+
+        return UserPrincipal.model_validate_json(data)
+
+    async def set(self, subject, principal, expires_at):
+        seconds = int(min(expires_at - time(), self.ttl))
+        if seconds > 0:
+            await self.client.set(
+                self.prefix + subject, principal.model_dump_json(), ex=seconds
+            )
+
+    async def invalidate(self, subject):
+        await self.client.delete(self.prefix + subject)
+
+
+def create_principal_cache(settings: Settings) -> PrincipalCache:
+    if not settings.PRINCIPAL_CACHE_URL:
+        return MemoryPrincipalCache(
+            settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL
+        )
+
+    try:
+        from redis.asyncio import from_url  # noqa: PLC0415
+    except ImportError as error:
+        raise RuntimeError(
+            'PRINCIPAL_CACHE_URL requires the "redis" package'
+        ) from error
+
+    return RedisPrincipalCache(
+        from_url(settings.PRINCIPAL_CACHE_URL), settings.PRINCIPAL_CACHE_TTL
+    )
+
+
+def get_principal_cache(request: Request) -> PrincipalCache:
+    return request.app.state.principal_cache
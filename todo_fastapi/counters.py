@@ -0,0 +1,149 @@
+"""Per-user todo counters by state.
+
+The counters are bumped in the same transaction as every write to todos,
+so GET /todos/stats reads at most one row per state. The same writes bump
+the version of the user's todos, the ETag of GET /todos/ reads only that
+row. To reconcile drift
+(e.g. rows changed straight in the database) rebuild them from todos:
+
+    python -m todo_fastapi.counters
+    python -m todo_fastapi.counters --user-id 42
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from todo_fastapi.database import create_engine
+from todo_fastapi.models.models_db import (
+    Todo,
+    TodoCounter,
+    TodoState,
+    TodoVersion,
+)
+from todo_fastapi.settings import get_settings
+
+
+def _dialect_insert(session: AsyncSession, table):
+    # mesmo ON CONFLICT nos dois bancos
+    dialect = (
+        postgresql if session.bind.dialect.name == 'postgresql' else sqlite
+    )
+    return dialect.insert(table)
+
+
+async def bump_counters(session: AsyncSession, user_id: int, deltas):
+    """_summary_
+
+    Args:
+        session (AsyncSession): session of the write that changed todos,
+        called even when no state changed so the version goes up
+        user_id (int): owner of the changed todos
+        deltas: mapping of TodoState to how much its count changed
+    """
+    statement = _dialect_insert(session, TodoVersion).values(
+        user_id=user_id, version=1
+    )
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[TodoVersion.user_id],
+            set_={'version': TodoVersion.version + 1},
+        )
+    )
+
+    deltas = {state: delta for state, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    # um único comando para todos os states alterados
+    statement = _dialect_insert(session, TodoCounter).values([
+        {'user_id': user_id, 'state': state, 'count': delta}
+        for state, delta in deltas.items()
+    ])
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[TodoCounter.user_id, TodoCounter.state],
+            set_={'count': TodoCounter.count + statement.excluded.count},
+        )
+    )
+
+
+async def read_version(session: AsyncSession, user_id: int) -> int:
+    # sem linha enquanto o usuário não escreveu nenhum todo
+    version = await session.scalar(
+        select(TodoVersion.version).where(TodoVersion.user_id == user_id)
+    )
+    return version or 0
+
+
+def count_states(states) -> Counter:
+    return Counter(TodoState(state) for state in states)
+
+
+async def read_counters(session: AsyncSession, user_id: int) -> dict:
+    counters = await session.execute(
+        select(TodoCounter.state, TodoCounter.count).where(
+            TodoCounter.user_id == user_id
+        )
+    )
+    stats = dict.fromkeys(TodoState, 0)
+    stats.update(counters.tuples().all())
+    return {
+        **{state.value: count for state, count in stats.items()},
+        'total': sum(stats.values()),
+    }
+
+
+async def rebuild_counters(session: AsyncSession, user_id: int | None = None):
+    """_summary_
+
+    Args:
+        session (AsyncSession): session used for the rebuild, committed here
+        user_id (int | None): rebuild a single user, None rebuilds all
+    """
+    if session.bind.dialect.name == 'postgresql':
+        # escritas que já atualizaram todos esperam o rebuild terminar para
+        # somar nos contadores, e as que terminaram antes entram na contagem
+        await session.execute(
+            text('LOCK TABLE todo_counters IN EXCLUSIVE MODE')
+        )
+
+    clear = delete(TodoCounter)
+    totals = select(Todo.user_id, Todo.state, func.count()).group_by(
+        Todo.user_id, Todo.state
+    )
+    if user_id is not None:
+        clear = clear.where(TodoCounter.user_id == user_id)
+        totals = totals.where(Todo.user_id == user_id)
+
+    await session.execute(clear)
+    await session.execute(
+        insert(TodoCounter).from_select(
+            [TodoCounter.user_id, TodoCounter.state, TodoCounter.count],
+            totals,
+        )
+    )
+    await session.commit()
+
+
+async def run(user_id: int | None):
+    engine = create_engine(get_settings())
+    async with AsyncSession(engine) as session:
+        await rebuild_counters(session, user_id)
+    await engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--user-id', type=int)
+    args = parser.parse_args(argv)
+
+    asyncio.run(run(args.user_id))
+
+
+if __name__ == '__main__':
+    main()
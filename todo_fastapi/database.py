@@ -1,8 +1,13 @@
+import os
 from http import HTTPStatus
 
-from fastapi import HTTPException
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from fastapi import HTTPException, Request
+from sqlalchemy import event, exc, make_url, select
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
 from sqlalchemy.orm import Session
 
 from todo_fastapi.models.models_db import User
@@ -10,15 +15,81 @@ from todo_fastapi.schema.schemas import UserSchema
 from todo_fastapi.settings import Settings
 
 
-async def get_session():  # pragma: no cover
+def create_engine(settings: Settings) -> AsyncEngine:
     """_summary_
 
+    Args:
+        settings (Settings): application settings with the database url
+        and the connection pool options
+
+    Returns:
+        AsyncEngine: pooled engine shared by every request of the process
+    """
+    url = make_url(settings.DATABASE_URL)
+    options = {
+        'pool_pre_ping': settings.DATABASE_POOL_PRE_PING,
+        'pool_recycle': settings.DATABASE_POOL_RECYCLE,
+    }
+
+    # sqlite não tem servidor, então tamanho de pool e timeout não se aplicam
+    if url.get_backend_name() == 'postgresql':
+        options['pool_size'] = settings.DATABASE_POOL_SIZE
+        options['max_overflow'] = settings.DATABASE_MAX_OVERFLOW
+
+        if settings.DATABASE_STATEMENT_TIMEOUT:
+            timeout = str(settings.DATABASE_STATEMENT_TIMEOUT)
+            if url.get_driver_name() == 'asyncpg':
+                options['connect_args'] = {
+                    'server_settings': {'statement_timeout': timeout}
+                }
+            else:
+                options['connect_args'] = {
+                    'options': f'-c statement_timeout={timeout}'
+                }
+
+    engine = create_async_engine(url, **options)
+    guard_fork(engine)
+    return engine
+
+
+def guard_fork(engine: AsyncEngine):
+    """_summary_
+
+    Args:
+        engine (AsyncEngine): engine whose pool must not hand a connection
+        opened by the parent to a forked process (gunicorn --preload,
+        multiprocessing with fork)
+    """
+
+    # receita da documentação do SQLAlchemy: a conexão guarda o pid de
+    # quem abriu, e outro processo descarta ela no checkout
+    @event.listens_for(engine.sync_engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine.sync_engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info['pid'] != os.getpid():
+            connection_record.dbapi_connection = None
+            connection_proxy.dbapi_connection = None
+            raise exc.DisconnectionError(
+                'connection opened by another process'
+            )
+
+
+async def get_session(request: Request):  # pragma: no cover
+    """_summary_
+
+    Args:
+        request (Request): current request, gives access to the engine
+        created by the app lifespan
+
     Yields:
         Session: give an session object used for making database oporations
     """
-    engine = create_async_engine(Settings().DATABASE_URL)
-
-    async with AsyncSession(engine) as session:
+    async with AsyncSession(
+        request.app.state.engine, expire_on_commit=False
+    ) as session:
         yield session
 
 
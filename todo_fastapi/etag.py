@@ -0,0 +1,46 @@
+from hashlib import blake2b
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    # fraco: mesmo conteúdo, não necessariamente os mesmos bytes
+    digest = blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+
+    # If-None-Match usa comparação fraca, o prefixo W/ é ignorado
+    opaque = etag.removeprefix('W/')
+    return any(
+        tag.strip().removeprefix('W/') == opaque
+        for tag in if_none_match.split(',')
+    )
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag})
+
+
+def collection_etag(version: int, request: Request, extra=None) -> str:
+    """_summary_
+
+    Args:
+        version (int): version of the user's todos, bumped on every write
+        request (Request): its query string is part of the tag, so each
+        page and filter has its own
+        extra: state outside the database that changes the response, like
+        writes not flushed yet
+
+    Returns:
+        str: weak ETag of the filtered page, the same cost for every page
+    """
+    return make_etag(
+        version, sorted(request.query_params.multi_items()), extra
+    )
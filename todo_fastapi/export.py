@@ -0,0 +1,63 @@
+import csv
+from io import StringIO
+
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from todo_fastapi.serialization import TODO_COLUMNS, todo_row_adapter
+
+# linhas por lote lido do cursor do banco, cada lote vira um chunk enviado
+EXPORT_YIELD_PER = 1000
+
+EXPORT_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _ndjson_chunk(rows) -> str:
+    return ''.join(
+        todo_row_adapter.dump_json(row._asdict()).decode() + '\n'
+        for row in rows
+    )
+
+
+def _csv_chunk(rows) -> str:
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow((
+            row.id,
+            row.title,
+            row.description,
+            row.state.value,
+            row.created_at.isoformat(),
+            row.updated_at.isoformat(),
+        ))
+    return buffer.getvalue()
+
+
+async def export_todos(session: AsyncSession, query: Select, format: str):
+    """_summary_
+
+    Args:
+        session (AsyncSession): session kept open while the response streams
+        query (Select): filtered and ordered todos query
+        format (str): 'ndjson' or 'csv'
+
+    Yields:
+        str: one chunk per batch read from the server side cursor, so the
+        memory used does not grow with the amount of todos
+    """
+    if format == 'csv':
+        yield ','.join(column.key for column in TODO_COLUMNS) + '\r\n'
+        to_chunk = _csv_chunk
+    else:
+        to_chunk = _ndjson_chunk
+
+    # só as colunas exportadas, sem objetos do ORM no identity map
+    result = await session.stream(
+        query.with_only_columns(*TODO_COLUMNS).execution_options(
+            yield_per=EXPORT_YIELD_PER
+        )
+    )
+    # cada yield espera o envio do chunk anterior, o ritmo é o do cliente
+    async for rows in result.partitions():
+        yield to_chunk(rows)
@@ -0,0 +1,241 @@
+import csv
+import json
+import logging
+import shutil
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from pydantic import ValidationError
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from starlette.concurrency import iterate_in_threadpool
+
+from todo_fastapi.counters import bump_counters, count_states
+from todo_fastapi.models.models_db import (
+    ImportJobStatus,
+    Todo,
+    TodoImportJob,
+)
+from todo_fastapi.schema.schemas import TodoSchema
+
+logger = logging.getLogger('todo_fastapi.importer')
+
+IMPORT_COLUMNS = ('title', 'description', 'state', 'user_id')
+
+
+def _decode_lines(file, invalid: set):
+    # decodifica linha a linha; os bytes inválidos de uma linha viram erro
+    # dela no relatório, em vez de abortar a importação no meio
+    encoding = 'utf-8-sig'
+    for number, raw in enumerate(file, start=1):
+        try:
+            yield raw.decode(encoding)
+        except UnicodeDecodeError:
+            invalid.add(number)
+            yield raw.decode(encoding, errors='replace')
+        encoding = 'utf-8'
+
+
+def _parse_lines(file, format: str):
+    # gera (linha, dados, erro), lendo o arquivo aos poucos
+    invalid = set()
+    text = _decode_lines(file, invalid)
+
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        # lê o cabeçalho antes dos registros, None com o arquivo vazio
+        if reader.fieldnames is None:
+            return
+        if invalid:
+            yield reader.line_num, None, 'invalid utf-8'
+            return
+
+        previous = reader.line_num
+        for row in reader:
+            # um registro pode ocupar várias linhas do arquivo
+            lines = range(previous + 1, reader.line_num + 1)
+            previous = reader.line_num
+            if not invalid.isdisjoint(lines):
+                yield reader.line_num, None, 'invalid utf-8'
+                continue
+            # células vazias valem como ausentes, state cai no padrão
+            yield (
+                reader.line_num,
+                {k: v for k, v in row.items() if k is not None and v},
+                None,
+            )
+        return
+
+    for number, line in enumerate(text, start=1):
+        if number in invalid:
+            yield number, None, 'invalid utf-8'
+            continue
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            yield number, None, 'invalid json'
+            continue
+        if not isinstance(data, dict):
+            yield number, None, 'expected a json object'
+            continue
+        yield number, data, None
+
+
+def _validation_detail(exc: ValidationError) -> str:
+    return '; '.join(
+        f'{".".join(map(str, error["loc"]))}: {error["msg"]}'
+        for error in exc.errors()
+    )
+
+
+def read_batches(file, format: str, batch_size: int):
+    """_summary_
+
+    Args:
+        file: binary file object of the upload, read incrementally
+        format (str): 'ndjson' or 'csv'
+        batch_size (int): rows, valid or not, handled per batch
+
+    Yields:
+        tuple: valid rows as dicts of TodoSchema fields and the errors of
+        the batch as dicts with line and detail
+    """
+    rows, errors = [], []
+
+    for line, data, parse_error in _parse_lines(file, format):
+        detail = parse_error
+        if detail is None:
+            try:
+                rows.append(TodoSchema.model_validate(data).model_dump())
+            except ValidationError as exc:
+                detail = _validation_detail(exc)
+        if detail is not None:
+            errors.append({'line': line, 'detail': detail})
+
+        if len(rows) + len(errors) >= batch_size:
+            yield rows, errors
+            rows, errors = [], []
+
+    if rows or errors:
+        yield rows, errors
+
+
+async def write_todos(session: AsyncSession, user_id: int, rows: list):
+    if not rows:
+        return
+
+    await bump_counters(
+        session, user_id, count_states(row['state'] for row in rows)
+    )
+
+    connection = await session.connection()
+    if connection.dialect.name != 'postgresql':
+        await session.execute(
+            insert(Todo), [{**row, 'user_id': user_id} for row in rows]
+        )
+        return
+
+    # COPY direto no driver, dentro da transação da sessão
+    records = [
+        (row['title'], row['description'], row['state'].value, user_id)
+        for row in rows
+    ]
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+
+    if connection.dialect.driver == 'asyncpg':
+        await driver_connection.copy_records_to_table(
+            'todos', records=records, columns=IMPORT_COLUMNS
+        )
+        return
+
+    copy_sql = f'COPY todos ({", ".join(IMPORT_COLUMNS)}) FROM STDIN'
+    async with driver_connection.cursor().copy(copy_sql) as copy:
+        for record in records:
+            await copy.write_row(record)
+
+
+def spool_upload(file) -> Path:
+    # o upload é fechado ao fim da requisição, o job lê uma cópia
+    with NamedTemporaryFile(prefix='todo_import_', delete=False) as copy:
+        shutil.copyfileobj(file, copy)
+    return Path(copy.name)
+
+
+def read_file_batches(path, format: str, batch_size: int):
+    # usado pelos jobs, o arquivo só é aberto na thread que faz o parse
+    with path.open('rb') as file:
+        yield from read_batches(file, format, batch_size)
+
+
+async def import_todos(
+    session: AsyncSession,
+    user_id: int,
+    batches,
+    max_errors: int,
+    job_id: str | None = None,
+) -> dict:
+    """_summary_
+
+    Args:
+        session (AsyncSession): session used for the writes
+        user_id (int): owner of the imported todos
+        batches: iterator from read_batches, consumed in a thread pool
+        max_errors (int): errors kept in the report, the count has all
+        job_id (str | None): import job updated with the progress
+
+    Returns:
+        dict: imported rows, error count and the detailed errors
+    """
+    report = {'imported': 0, 'error_count': 0, 'errors': []}
+
+    # parse e validação rodam em threads, o event loop só faz o I/O
+    async for rows, errors in iterate_in_threadpool(batches):
+        await write_todos(session, user_id, rows)
+
+        report['imported'] += len(rows)
+        report['error_count'] += len(errors)
+        free = max_errors - len(report['errors'])
+        report['errors'].extend(errors[:free])
+
+        if job_id is not None:
+            await session.execute(
+                update(TodoImportJob)
+                .where(TodoImportJob.id == job_id)
+                .values(
+                    imported=report['imported'],
+                    error_count=report['error_count'],
+                )
+            )
+        # cada lote é uma transação, uma falha mantém os lotes anteriores
+        await session.commit()
+
+    return report
+
+
+async def run_import_job(
+    engine: AsyncEngine, job_id: str, user_id: int, batches, max_errors: int
+):
+    # roda depois da resposta, com uma sessão própria
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        job = await session.get(TodoImportJob, job_id)
+        job.status = ImportJobStatus.running
+        await session.commit()
+
+        try:
+            report = await import_todos(
+                session, user_id, batches, max_errors, job_id=job_id
+            )
+        except Exception:
+            # o texto da exceção fica no log, não na resposta do job
+            logger.exception('import job %s failed', job_id)
+            await session.rollback()
+            job.status = ImportJobStatus.failed
+            job.errors = [{'line': 0, 'detail': 'import failed'}]
+        else:
+            job.status = ImportJobStatus.done
+            job.errors = report['errors']
+
+        await session.commit()
@@ -0,0 +1,125 @@
+import json
+import logging
+from contextvars import ContextVar
+from time import perf_counter
+
+from sqlalchemy import Engine, event
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger('todo_fastapi.sql')
+
+
+class QueryStats:
+    """SQL statements executed while handling one request."""
+
+    __slots__ = ('count', 'slowest', 'slowest_statement', 'total')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.total * 1000:.2f};desc="{self.count} queries", '
+            f'db-slowest;dur={self.slowest * 1000:.2f}'
+        )
+
+
+# preenchido pelo middleware, None fora de uma requisição instrumentada
+current_stats: ContextVar[QueryStats | None] = ContextVar(
+    'current_stats', default=None
+)
+
+
+class EngineInstrumentation:
+    """Cursor execute hooks that feed the QueryStats of the request.
+
+    Only attached when QUERY_INSTRUMENTATION is on, so a disabled app pays
+    nothing per statement.
+    """
+
+    def __init__(self, slow_query_threshold_ms: float):
+        self.slow_query_threshold = slow_query_threshold_ms / 1000
+
+    @staticmethod
+    def before_cursor_execute(conn, *_):
+        conn.info.setdefault('query_start', []).append(perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, *_):
+        elapsed = perf_counter() - conn.info['query_start'].pop()
+
+        stats = current_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
+
+        if elapsed >= self.slow_query_threshold:
+            logger.warning(
+                'slow query (%.2fms): %s', elapsed * 1000, statement
+            )
+
+    def attach(self, engine: Engine):
+        event.listen(
+            engine, 'before_cursor_execute', self.before_cursor_execute
+        )
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def detach(self, engine: Engine):
+        event.remove(
+            engine, 'before_cursor_execute', self.before_cursor_execute
+        )
+        event.remove(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+
+class QueryTimingMiddleware:
+    """Adds the SQL count and time of each request as Server-Timing.
+
+    With `log_requests` it also writes one JSON log line per request.
+    """
+
+    def __init__(self, app, log_requests: bool = False):
+        self.app = app
+        self.log_requests = log_requests
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', stats.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_stats.reset(token)
+
+            if self.log_requests:
+                logger.info(
+                    json.dumps({
+                        'method': scope['method'],
+                        'path': scope['path'],
+                        'status': status,
+                        'queries': stats.count,
+                        'db_ms': round(stats.total * 1000, 3),
+                        'slowest_ms': round(stats.slowest * 1000, 3),
+                        'slowest_statement': stats.slowest_statement,
+                    })
+                )
@@ -1,8 +1,114 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from datetime import timedelta
+
 from fastapi import FastAPI
 
-from todo_fastapi.routers import auth, todo, users
+from todo_fastapi.cache import create_principal_cache
+from todo_fastapi.database import create_engine
+from todo_fastapi.instrumentation import (
+    EngineInstrumentation,
+    QueryTimingMiddleware,
+)
+from todo_fastapi.metrics import (
+    MetricsMiddleware,
+    flush_periodically,
+    registry,
+    watch_engine_pool,
+)
+from todo_fastapi.replicas import (
+    ReadYourWritesMiddleware,
+    create_read_replicas,
+)
+from todo_fastapi.routers import auth, metrics, todo, users
+from todo_fastapi.security import pwd_hash_pool
+from todo_fastapi.settings import get_settings
+from todo_fastapi.sync import prune_tombstones_periodically
+from todo_fastapi.token_versions import create_token_versions
+from todo_fastapi.write_behind import open_write_behind
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # um único engine (e pool de conexões) por processo
+    settings = get_settings()
+    app.state.engine = create_engine(settings)
+    app.state.principal_cache = create_principal_cache(settings)
+    # None sem DATABASE_READ_URLS, as leituras usam o primário
+    app.state.replicas = create_read_replicas(settings)
+    # None sem STATELESS_AUTH, as rotas de todos buscam o usuário
+    app.state.token_versions = create_token_versions(
+        app.state.engine, settings
+    )
+
+    if settings.QUERY_INSTRUMENTATION:
+        instrumentation = EngineInstrumentation(
+            settings.SLOW_QUERY_THRESHOLD_MS
+        )
+        instrumentation.attach(app.state.engine.sync_engine)
+        for replica in getattr(app.state.replicas, 'engines', ()):
+            instrumentation.attach(replica.sync_engine)
+
+    pool_collector = watch_engine_pool(app.state.engine)
+    flush_task = None
+    if settings.METRICS_MULTIPROC_DIR:
+        registry.multiprocess_dir = settings.METRICS_MULTIPROC_DIR
+        # algumas escritas perdidas antes de considerar o worker encerrado
+        registry.stale_after = 3 * settings.METRICS_FLUSH_INTERVAL
+        flush_task = asyncio.create_task(
+            flush_periodically(settings.METRICS_FLUSH_INTERVAL)
+        )
+
+    prune_task = asyncio.create_task(
+        prune_tombstones_periodically(
+            app.state.engine,
+            timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS),
+            settings.SYNC_TOMBSTONE_PRUNE_INTERVAL,
+        )
+    )
+
+    app.state.write_behind = None
+    if settings.WRITE_BEHIND_DIR:
+        # logs de workers que caíram vão para o banco antes de servir
+        app.state.write_behind = await open_write_behind(
+            app.state.engine, settings
+        )
+
+    yield
+
+    if app.state.write_behind is not None:
+        await app.state.write_behind.close()
+    if app.state.token_versions is not None:
+        await app.state.token_versions.close()
+    prune_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await prune_task
+    if flush_task is not None:
+        flush_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await flush_task
+        # contadores continuam valendo após o worker sair, o pool não
+        registry.dump(gauges=False)
+    registry.remove_collector(pool_collector)
+
+    if app.state.replicas is not None:
+        await app.state.replicas.dispose()
+    await app.state.engine.dispose()
+    pwd_hash_pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(MetricsMiddleware)
+# sem réplicas só repassa a requisição
+app.add_middleware(ReadYourWritesMiddleware)
+# desligado não adiciona middleware nem eventos no engine
+if get_settings().QUERY_INSTRUMENTATION:
+    app.add_middleware(
+        QueryTimingMiddleware, log_requests=get_settings().QUERY_LOG_REQUESTS
+    )
 
-app = FastAPI()
 app.include_router(users.router)
 app.include_router(auth.router)
 app.include_router(todo.router)
+app.include_router(metrics.router)
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+from time import perf_counter, time
+
+from sqlalchemy.pool import QueuePool
+
+# buckets em segundos, os mesmos padrões do cliente oficial do Prometheus
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0,
+    7.5, 10.0,
+)  # fmt: skip
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    labels = ','.join(
+        f'{name}="{str(value).replace('"', r"\"")}"' for name, value in pairs
+    )
+    return f'{{{labels}}}'
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # uma entrada por combinação de labels
+        self.values = {}
+
+    def snapshot(self) -> dict:
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labels': self.labels,
+            'samples': [
+                [list(labels), value] for labels, value in self.values.items()
+            ],
+        }
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=None):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets or DEFAULT_BUCKETS)
+
+    def observe(self, value: float, *labels):
+        # [contagem por bucket (não cumulativa)..., +Inf, soma]
+        sample = self.values.get(labels)
+        if sample is None:
+            sample = self.values[labels] = [0] * (len(self.buckets) + 2)
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                sample[index] += 1
+                break
+        else:
+            sample[-2] += 1
+        sample[-1] += value
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), 'buckets': self.buckets}
+
+
+class Registry:
+    """Metrics of one worker process.
+
+    Recording happens on the event loop thread only, so plain dicts are
+    enough and no lock is taken on the request path. With several uvicorn
+    workers each one dumps its snapshot to `multiprocess_dir` and the
+    scrape merges every file. A file not rewritten for `stale_after`
+    seconds is from a worker that is gone, as with prometheus_client
+    mark_process_dead its counters still count but its gauges do not.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.multiprocess_dir = None
+        self.stale_after = None
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=None):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def collect(self, func):
+        """Registers a callback that updates gauges right before a read."""
+        self.collectors.append(func)
+        return func
+
+    def remove_collector(self, func):
+        self.collectors.remove(func)
+
+    def snapshot(self, gauges: bool = True) -> dict:
+        for collector in self.collectors:
+            collector()
+
+        return {
+            name: metric.snapshot()
+            for name, metric in self.metrics.items()
+            if gauges or metric.type != 'gauge'
+        }
+
+    def _worker_file(self, pid: int) -> Path:
+        return Path(self.multiprocess_dir) / f'metrics_{pid}.json'
+
+    def dump(self, gauges: bool = True):
+        """Writes this worker snapshot, atomically, to multiprocess_dir.
+
+        A worker that is shutting down dumps without gauges, its counters
+        keep being reported but its pool state does not.
+        """
+        path = self._worker_file(os.getpid())
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.snapshot(gauges=gauges)))
+        tmp_path.replace(path)
+
+    def _worker_snapshots(self):
+        yield self.snapshot()
+
+        if self.multiprocess_dir is None:
+            return
+
+        own_file = self._worker_file(os.getpid())
+        for path in Path(self.multiprocess_dir).glob('metrics_*.json'):
+            if path == own_file:
+                continue
+            # worker removido ou reescrevendo durante a leitura
+            try:
+                modified = path.stat().st_mtime
+                content = path.read_text()
+            except OSError:
+                continue
+            try:
+                snapshot = json.loads(content)
+            except json.JSONDecodeError:
+                continue
+
+            # pelo tempo do arquivo e não pelo pid, que pode ser reusado
+            if self.stale_after and time() - modified > self.stale_after:
+                snapshot = {
+                    name: metric
+                    for name, metric in snapshot.items()
+                    if metric['type'] != 'gauge'
+                }
+            yield snapshot
+
+    def render(self) -> str:
+        """Prometheus text exposition of every worker, summed."""
+        merged = {}
+        for snapshot in self._worker_snapshots():
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {**metric, 'values': {}})
+                for labels, value in metric['samples']:
+                    key = tuple(labels)
+                    current = target['values'].get(key)
+                    if current is None:
+                        target['values'][key] = value
+                    elif isinstance(value, list):
+                        target['values'][key] = [
+                            a + b for a, b in zip(current, value)
+                        ]
+                    else:
+                        target['values'][key] = current + value
+
+        lines = []
+        for name, metric in merged.items():
+            lines.extend((
+                f'# HELP {name} {metric["help"]}',
+                f'# TYPE {name} {metric["type"]}',
+            ))
+            for labels, value in sorted(metric['values'].items()):
+                if metric['type'] == 'histogram':
+                    lines.extend(
+                        _render_histogram(name, metric, labels, value)
+                    )
+                else:
+                    label_text = _format_labels(metric['labels'], labels)
+                    lines.append(f'{name}{label_text} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _render_histogram(name, metric, labels, value):
+    cumulative = 0
+    for bound, count in zip(metric['buckets'], value):
+        cumulative += count
+        label_text = _format_labels(metric['labels'], labels, [('le', bound)])
+        yield f'{name}_bucket{label_text} {cumulative}'
+
+    count = cumulative + value[-2]
+    label_text = _format_labels(metric['labels'], labels, [('le', '+Inf')])
+    yield f'{name}_bucket{label_text} {count}'
+    label_text = _format_labels(metric['labels'], labels)
+    yield f'{name}_sum{label_text} {value[-1]}'
+    yield f'{name}_count{label_text} {count}'
+
+
+def clear_multiprocess_dir(directory: str):
+    # arquivos de uma execução anterior, chamado antes de subir os workers
+    for path in Path(directory).glob('metrics_*'):
+        path.unlink(missing_ok=True)
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'http_requests_total',
+    'HTTP requests by route, method and status.',
+    ('method', 'route', 'status'),
+)
+http_request_duration = registry.histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency by route and method.',
+    ('method', 'route'),
+)
+db_pool_checked_out = registry.gauge(
+    'db_pool_checked_out', 'Connections currently checked out of the pool.'
+)
+db_pool_overflow = registry.gauge(
+    'db_pool_overflow', 'Connections open beyond the pool size.'
+)
+jwt_decode_failures = registry.counter(
+    'jwt_decode_failures_total',
+    'Bearer tokens rejected while decoding.',
+    ('reason',),
+)
+pwd_hash_wait = registry.histogram(
+    'pwd_hash_queue_seconds',
+    'Time password hash calls waited for a free worker.',
+)
+
+
+def watch_engine_pool(engine):
+    """Reads the engine pool gauges at every snapshot.
+
+    Returns the collector, to be removed when the engine is disposed.
+    """
+
+    @registry.collect
+    def collect_pool():
+        pool = engine.pool
+        # pools sem fila (ex: SQLite em memória) não têm esses números
+        if isinstance(pool, QueuePool):
+            db_pool_checked_out.set(pool.checkedout())
+            db_pool_overflow.set(max(pool.overflow(), 0))
+
+    return collect_pool
+
+
+async def flush_periodically(interval: float):
+    # mantém o arquivo deste worker atualizado para os outros lerem
+    while True:
+        await asyncio.sleep(interval)
+        registry.dump()
+
+
+class MetricsMiddleware:
+    """Counts requests and their latency per route template.
+
+    The route is read from the scope after routing, so `/todos/{todo_id}`
+    is a single series no matter the id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            # rotas inexistentes ficam juntas para não criar séries sem fim
+            route = route.path if route is not None else 'unmatched'
+            method = scope['method']
+
+            http_requests.inc(method, route, str(status))
+            http_request_duration.observe(
+                perf_counter() - start, method, route
+            )
@@ -1,7 +1,16 @@
 from datetime import datetime
 from enum import Enum
 
-from sqlalchemy import ForeignKey, func
+from sqlalchemy import (
+    DDL,
+    JSON,
+    ForeignKey,
+    Index,
+    delete,
+    event,
+    func,
+    insert,
+)
 from sqlalchemy.orm import (
     Mapped,
     declarative_base,
@@ -14,18 +23,23 @@ Base = declarative_base()
 
 class User(Base):
     __tablename__ = 'users'
+    # created_at/updated_at voltam no RETURNING do INSERT/UPDATE, sem refresh
+    __mapper_args__ = {'eager_defaults': True}
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     username: Mapped[str] = mapped_column(unique=True)
     email: Mapped[str] = mapped_column(unique=True)
     password: Mapped[str]
+    # vai no token (claim ver), incrementar revoga os tokens já emitidos
+    token_version: Mapped[int] = mapped_column(server_default='1')
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(
         server_default=func.now(), onupdate=func.now()
     )
 
+    # nunca carregado implicitamente, use selectinload() quando precisar
     todos: Mapped[list['Todo']] = relationship(
-        cascade='all, delete-orphan', lazy='selectin'
+        cascade='all, delete-orphan', lazy='raise'
     )
 
 
@@ -39,6 +53,14 @@ class TodoState(str, Enum):
 
 class Todo(Base):
     __tablename__ = 'todos'
+    # cobrem a listagem paginada por id, com e sem filtro de state, e o
+    # feed de alterações por updated_at
+    __table_args__ = (
+        Index('ix_todos_user_id_id', 'user_id', 'id'),
+        Index('ix_todos_user_id_state_id', 'user_id', 'state', 'id'),
+        Index('ix_todos_user_id_updated_at_id', 'user_id', 'updated_at', 'id'),
+    )
+    __mapper_args__ = {'eager_defaults': True}
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     title: Mapped[str]
@@ -50,3 +72,143 @@ class Todo(Base):
     )
 
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
+
+
+class TodoTombstone(Base):
+    __tablename__ = 'todo_tombstones'
+    __table_args__ = (
+        Index(
+            'ix_todo_tombstones_user_id_deleted_at', 'user_id', 'deleted_at'
+        ),
+        # limpeza dos tombstones fora da retenção, ver todo_fastapi.sync
+        Index('ix_todo_tombstones_deleted_at', 'deleted_at'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    todo_id: Mapped[int]
+    # sem FK, o registro da remoção sobrevive ao todo e ao usuário
+    user_id: Mapped[int]
+    deleted_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
+class TodoCounter(Base):
+    __tablename__ = 'todo_counters'
+
+    # atualizado junto com cada escrita em todos, ver todo_fastapi.counters
+    user_id: Mapped[int] = mapped_column(primary_key=True)
+    state: Mapped[TodoState] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
+
+
+class TodoVersion(Base):
+    __tablename__ = 'todo_versions'
+
+    # sobe a cada escrita em todos do usuário, base do ETag das listagens
+    user_id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(default=0)
+
+
+class ImportJobStatus(str, Enum):
+    pending = 'pending'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+
+
+class TodoImportJob(Base):
+    __tablename__ = 'todo_import_jobs'
+    __mapper_args__ = {'eager_defaults': True}
+
+    # uuid gerado pela aplicação, o cliente consulta o status por ele
+    id: Mapped[str] = mapped_column(primary_key=True)
+    # sem FK, como em TodoTombstone
+    user_id: Mapped[int]
+    status: Mapped[ImportJobStatus]
+    imported: Mapped[int] = mapped_column(default=0)
+    error_count: Mapped[int] = mapped_column(default=0)
+    errors: Mapped[list] = mapped_column(JSON, default=list)
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(
+        server_default=func.now(), onupdate=func.now()
+    )
+
+
+# os todos do usuário já saíram pelo cascade, os contadores saem junto
+@event.listens_for(User, 'after_delete')
+def delete_user_counters(mapper, connection, target):
+    connection.execute(
+        delete(TodoCounter).where(TodoCounter.user_id == target.id)
+    )
+    connection.execute(
+        delete(TodoVersion).where(TodoVersion.user_id == target.id)
+    )
+
+
+# remoções pelo ORM, como o cascade delete-orphan de User.todos; os DELETE
+# diretos das rotas gravam os tombstones explicitamente
+@event.listens_for(Todo, 'after_delete')
+def record_todo_tombstone(mapper, connection, target):
+    connection.execute(
+        insert(TodoTombstone).values(todo_id=target.id, user_id=target.user_id)
+    )
+
+
+# ----------------------------- busca textual ---------------------------------
+# a busca fica fora do mapeamento do ORM: no postgres é uma coluna gerada
+# com índice GIN e no sqlite uma tabela FTS5 mantida por triggers
+
+TODO_SEARCH_OBJECTS = {
+    'search_vector',
+    'ix_todos_search_vector',
+    'todos_fts',
+    # tabelas internas criadas pelo FTS5
+    'todos_fts_config',
+    'todos_fts_data',
+    'todos_fts_docsize',
+    'todos_fts_idx',
+}
+
+event.listen(
+    Todo.__table__,
+    'after_create',
+    DDL(
+        'ALTER TABLE todos ADD COLUMN search_vector tsvector '
+        "GENERATED ALWAYS AS (to_tsvector('simple', "
+        "title || ' ' || description)) STORED"
+    ).execute_if(dialect='postgresql'),
+)
+event.listen(
+    Todo.__table__,
+    'after_create',
+    DDL(
+        'CREATE INDEX ix_todos_search_vector ON todos '
+        'USING gin (search_vector)'
+    ).execute_if(dialect='postgresql'),
+)
+
+for statement in (
+    'CREATE VIRTUAL TABLE todos_fts USING fts5(title, description, '
+    "content='todos', content_rowid='id')",
+    'CREATE TRIGGER todos_fts_insert AFTER INSERT ON todos BEGIN '
+    'INSERT INTO todos_fts(rowid, title, description) '
+    'VALUES (new.id, new.title, new.description); END',
+    'CREATE TRIGGER todos_fts_delete AFTER DELETE ON todos BEGIN '
+    'INSERT INTO todos_fts(todos_fts, rowid, title, description) '
+    "VALUES ('delete', old.id, old.title, old.description); END",
+    'CREATE TRIGGER todos_fts_update AFTER UPDATE ON todos BEGIN '
+    'INSERT INTO todos_fts(todos_fts, rowid, title, description) '
+    "VALUES ('delete', old.id, old.title, old.description); "
+    'INSERT INTO todos_fts(rowid, title, description) '
+    'VALUES (new.id, new.title, new.description); END',
+):
+    event.listen(
+        Todo.__table__,
+        'after_create',
+        DDL(statement).execute_if(dialect='sqlite'),
+    )
+
+event.listen(
+    Todo.__table__,
+    'before_drop',
+    DDL('DROP TABLE IF EXISTS todos_fts').execute_if(dialect='sqlite'),
+)
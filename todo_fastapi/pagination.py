@@ -0,0 +1,68 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from http import HTTPStatus
+
+from fastapi import HTTPException
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from todo_fastapi.schema.schemas import FilterPage
+
+
+def encode_cursor(last_id: int) -> str:
+    # cursor opaco para o cliente, só guarda o último id da página
+    return urlsafe_b64encode(f'id:{last_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        key, value = urlsafe_b64decode(cursor + padding).decode().split(':')
+        if key != 'id':
+            raise ValueError(key)
+        return int(value)
+    # erros de base64 e de decode também são ValueError
+    except ValueError:
+        raise HTTPException(
+            detail='invalid cursor', status_code=HTTPStatus.BAD_REQUEST
+        )
+
+
+def page_query(query: Select, id_column, filter_page: FilterPage) -> Select:
+    query = query.order_by(id_column)
+
+    # com cursor a busca começa direto no índice, sem descartar linhas
+    if filter_page.cursor:
+        query = query.where(id_column > decode_cursor(filter_page.cursor))
+    else:
+        query = query.offset(filter_page.offset)
+
+    # uma linha a mais indica se existe próxima página
+    return query.limit(filter_page.limit + 1)
+
+
+async def paginate(
+    session: AsyncSession, query: Select, id_column, filter_page: FilterPage
+):
+    """_summary_
+
+    Args:
+        session (AsyncSession): session used to run the query
+        query (Select): filtered query of columns, without order, offset
+        or limit
+        id_column: unique and increasing column used as the page key
+        filter_page (FilterPage): limit plus a cursor or a legacy offset
+
+    Returns:
+        tuple: rows of the page and the cursor of the next one, None when
+        there are no more rows
+    """
+    rows = await session.execute(page_query(query, id_column, filter_page))
+    rows = rows.all()
+
+    next_cursor = None
+    if len(rows) > filter_page.limit:
+        rows = rows[: filter_page.limit]
+        if rows:
+            next_cursor = encode_cursor(rows[-1].id)
+
+    return rows, next_cursor
@@ -0,0 +1,303 @@
+"""Hash partitioning of todos by user_id (postgres only).
+
+Every todo query is scoped by user_id, so with the table partitioned by
+HASH (user_id) a list query reads a single partition and vacuum works on
+partitions a fraction of the size. The conversion runs online:
+
+1. creates todos_partitioned, with the same columns, indexes and
+   constraints plus TODO_PARTITIONS partitions, and a trigger that
+   mirrors every write on todos into it
+2. copies the rows already in todos in batches of --batch-size ids, each
+   batch in its own transaction
+3. swaps the tables in one short transaction and drops the old one
+
+    python -m todo_fastapi.partitioning --partitions 16
+    python -m todo_fastapi.partitioning --batch-size 5000
+
+Run it before `alembic upgrade head` on large databases; the migration
+that partitions todos skips a table already partitioned and otherwise
+runs the same steps in its own transaction, with the columns and indexes
+todos had at its revision.
+"""
+
+import argparse
+import asyncio
+import re
+from dataclasses import dataclass
+
+from sqlalchemy import Connection, text
+
+from todo_fastapi.database import create_engine
+from todo_fastapi.models.models_db import Todo
+from todo_fastapi.settings import get_settings
+
+SHADOW = 'todos_partitioned'
+# partições criadas aqui, fora do metadata (ver include_object do alembic)
+PARTITION_NAME = re.compile(r'todos_p\d+')
+
+
+@dataclass(frozen=True, slots=True)
+class TodosTable:
+    """Columns and indexes of todos copied by the conversion.
+
+    The search_vector column is generated by the database in each table
+    and its GIN index is always created, so neither is listed here.
+    """
+
+    columns: tuple[str, ...]
+    # nome do índice -> colunas
+    indexes: tuple[tuple[str, tuple[str, ...]], ...]
+
+    @classmethod
+    def from_model(cls) -> 'TodosTable':
+        # o comando segue o modelo atual, a migration passa os da revisão
+        return cls(
+            columns=tuple(column.name for column in Todo.__table__.columns),
+            indexes=tuple(
+                (index.name, tuple(column.name for column in index.columns))
+                for index in Todo.__table__.indexes
+            ),
+        )
+
+    def column_list(self, prefix: str = '') -> str:
+        return ', '.join(f'{prefix}{column}' for column in self.columns)
+
+
+def partition_name(remainder: int) -> str:
+    return f'todos_p{remainder}'
+
+
+def _index_statements(
+    todos: TodosTable, table: str, suffix: str = ''
+) -> list[str]:
+    statements = [
+        f'CREATE INDEX {name}{suffix} ON {table} ({", ".join(columns)})'
+        for name, columns in todos.indexes
+    ]
+    statements.append(
+        f'CREATE INDEX ix_todos_search_vector{suffix} ON {table} '
+        'USING gin (search_vector)'
+    )
+    return statements
+
+
+def _rename_statements(
+    todos: TodosTable, table: str, suffix: str
+) -> list[str]:
+    # devolve aos objetos os nomes que o metadata e o alembic conhecem
+    names = [name for name, _columns in todos.indexes]
+    names.append('ix_todos_search_vector')
+    return [
+        f'ALTER TABLE {table} RENAME CONSTRAINT todos{suffix}_pkey '
+        'TO todos_pkey',
+        f'ALTER TABLE {table} RENAME CONSTRAINT todos{suffix}_user_id_fkey '
+        'TO todos_user_id_fkey',
+        *(f'ALTER INDEX {name}{suffix} RENAME TO {name}' for name in names),
+    ]
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return connection.scalar(
+        text(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table '
+            "WHERE partrelid = 'todos'::regclass)"
+        )
+    )
+
+
+def create_shadow_table(
+    connection: Connection, todos: TodosTable, partitions: int
+):
+    """_summary_
+
+    Args:
+        connection (Connection): connection in the transaction that
+        creates the table, the trigger and the partitions together
+        todos (TodosTable): columns and indexes of the copy
+        partitions (int): amount of hash partitions of user_id
+    """
+    columns = todos.column_list()
+    statements = [
+        # mesmas colunas, defaults (a mesma sequence de id) e a coluna
+        # gerada da busca
+        f'CREATE TABLE {SHADOW} (LIKE todos INCLUDING DEFAULTS '
+        'INCLUDING GENERATED) PARTITION BY HASH (user_id)',
+        # a chave de partição precisa fazer parte da chave primária
+        f'ALTER TABLE {SHADOW} ADD CONSTRAINT todos_partitioned_pkey '
+        'PRIMARY KEY (id, user_id)',
+        f'ALTER TABLE {SHADOW} ADD CONSTRAINT todos_partitioned_user_id_fkey '
+        'FOREIGN KEY (user_id) REFERENCES users (id)',
+        *(
+            f'CREATE TABLE {partition_name(remainder)} PARTITION OF {SHADOW} '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+            for remainder in range(partitions)
+        ),
+        *_index_statements(todos, SHADOW, '_partitioned'),
+        # toda escrita em todos a partir daqui chega também na cópia
+        'CREATE FUNCTION todos_mirror() RETURNS trigger AS $$ BEGIN '
+        "IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+        f'DELETE FROM {SHADOW} '
+        'WHERE id = OLD.id AND user_id = OLD.user_id; END IF; '
+        "IF TG_OP IN ('INSERT', 'UPDATE') THEN "
+        f'INSERT INTO {SHADOW} ({columns}) '
+        f'VALUES ({todos.column_list("NEW.")}); END IF; '
+        'RETURN NULL; END $$ LANGUAGE plpgsql',
+        'CREATE TRIGGER todos_mirror AFTER INSERT OR UPDATE OR DELETE '
+        'ON todos FOR EACH ROW EXECUTE FUNCTION todos_mirror()',
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def copy_batch(
+    connection: Connection, todos: TodosTable, after: int, batch_size: int
+):
+    """_summary_
+
+    Args:
+        connection (Connection): connection of the batch transaction
+        todos (TodosTable): columns copied
+        after (int): last id copied by the previous batch
+        batch_size (int): amount of todos read per batch
+
+    Returns:
+        int | None: last id of the batch, None when nothing is left
+    """
+    until = connection.scalar(
+        text(
+            'SELECT max(id) FROM (SELECT id FROM todos WHERE id > :after '
+            'ORDER BY id LIMIT :batch_size) AS batch'
+        ),
+        {'after': after, 'batch_size': batch_size},
+    )
+    if until is None:
+        return None
+
+    # FOR SHARE segura as escritas nessas linhas até o commit do lote, o
+    # trigger delas já encontra a cópia e não deixa uma versão antiga
+    columns = todos.column_list()
+    connection.execute(
+        text(
+            f'INSERT INTO {SHADOW} ({columns}) SELECT {columns} FROM todos '
+            'WHERE id > :after AND id <= :until FOR SHARE '
+            'ON CONFLICT DO NOTHING'
+        ),
+        {'after': after, 'until': until},
+    )
+    return until
+
+
+def swap_tables(connection: Connection, todos: TodosTable):
+    # a sequence de id é da coluna antiga e seria apagada junto com ela
+    statements = [
+        'LOCK TABLE todos IN ACCESS EXCLUSIVE MODE',
+        'DROP TRIGGER todos_mirror ON todos',
+        'DROP FUNCTION todos_mirror()',
+        f'ALTER SEQUENCE todos_id_seq OWNED BY {SHADOW}.id',
+        'DROP TABLE todos',
+        f'ALTER TABLE {SHADOW} RENAME TO todos',
+        *_rename_statements(todos, 'todos', '_partitioned'),
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def partition_todos(  # noqa: PLR0913, PLR0917
+    connection: Connection,
+    partitions: int,
+    batch_size: int,
+    commit: bool = False,
+    report=None,
+    todos: TodosTable | None = None,
+):
+    """_summary_
+
+    Args:
+        connection (Connection): connection to the postgres database
+        partitions (int): amount of hash partitions of user_id
+        batch_size (int): amount of todos copied per batch
+        commit (bool): commit after each step and batch, as the online
+        command does; the migration runs everything in its transaction
+        report: called with the last id of each batch copied
+        todos (TodosTable | None): columns and indexes to copy, the ones
+        of the model when None; migrations pass the ones of their revision
+    """
+    if is_partitioned(connection):
+        return
+    todos = todos or TodosTable.from_model()
+
+    resumed = connection.scalar(
+        text(f"SELECT to_regclass('{SHADOW}') IS NOT NULL")
+    )
+    # uma execução interrompida continua com a cópia e o trigger que
+    # já existem, os lotes repetidos não sobrescrevem nada
+    if not resumed:
+        create_shadow_table(connection, todos, partitions)
+    if commit:
+        connection.commit()
+
+    after = 0
+    while (
+        until := copy_batch(connection, todos, after, batch_size)
+    ) is not None:
+        if commit:
+            connection.commit()
+        if report is not None:
+            report(until)
+        after = until
+
+    swap_tables(connection, todos)
+    if commit:
+        connection.commit()
+
+
+def unpartition_todos(connection: Connection, todos: TodosTable):
+    # caminho de volta do downgrade, com a tabela travada durante a cópia
+    columns = todos.column_list()
+    statements = [
+        'LOCK TABLE todos IN ACCESS EXCLUSIVE MODE',
+        'CREATE TABLE todos_unpartitioned (LIKE todos INCLUDING DEFAULTS '
+        'INCLUDING GENERATED)',
+        f'INSERT INTO todos_unpartitioned ({columns}) '
+        f'SELECT {columns} FROM todos',
+        'ALTER TABLE todos_unpartitioned ADD CONSTRAINT '
+        'todos_unpartitioned_pkey PRIMARY KEY (id)',
+        'ALTER TABLE todos_unpartitioned ADD CONSTRAINT '
+        'todos_unpartitioned_user_id_fkey '
+        'FOREIGN KEY (user_id) REFERENCES users (id)',
+        *_index_statements(todos, 'todos_unpartitioned', '_unpartitioned'),
+        'ALTER SEQUENCE todos_id_seq OWNED BY todos_unpartitioned.id',
+        'DROP TABLE todos',
+        'ALTER TABLE todos_unpartitioned RENAME TO todos',
+        *_rename_statements(todos, 'todos', '_unpartitioned'),
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+async def run(partitions: int, batch_size: int):
+    engine = create_engine(get_settings())
+    async with engine.connect() as connection:
+        await connection.run_sync(
+            partition_todos,
+            partitions,
+            batch_size,
+            commit=True,
+            report=lambda until: print(f'copied todos up to id {until}'),
+        )
+    await engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--partitions', type=int, default=get_settings().TODO_PARTITIONS
+    )
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    asyncio.run(run(args.partitions, args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
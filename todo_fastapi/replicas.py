@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from http import HTTPStatus
+from itertools import count
+from time import monotonic
+
+from fastapi import Depends, Request
+from jwt import PyJWTError, decode
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from todo_fastapi.database import create_engine, get_session
+from todo_fastapi.settings import Settings
+
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+# usuários na janela de leitura do primário, acima disso sai o mais antigo
+STICKY_MAX_SIZE = 10_000
+
+
+class ReadReplicas:
+    """Engines of the read replicas and the read-your-writes window.
+
+    After a write the reads of the same user go to the primary for
+    `sticky_window` seconds, longer than the expected replication lag.
+    The window is tracked per worker, for at most `max_size` users.
+    """
+
+    def __init__(
+        self,
+        engines: list[AsyncEngine],
+        balance: str = 'round_robin',
+        sticky_window: float = 5,
+        max_size: int = STICKY_MAX_SIZE,
+    ):
+        self.engines = engines
+        self.balance = balance
+        self.sticky_window = sticky_window
+        self.max_size = max_size
+        self._turn = count()
+        # em ordem de vencimento, todas as marcações têm a mesma janela
+        self._writes: OrderedDict[str, float] = OrderedDict()
+
+    def pick(self) -> AsyncEngine:
+        start = next(self._turn) % len(self.engines)
+        engines = self.engines[start:] + self.engines[:start]
+        if self.balance == 'least_connections':
+            # empates ficam com o próximo da vez, não sempre com o primeiro
+            return min(engines, key=lambda engine: engine.pool.checkedout())
+        return engines[0]
+
+    def mark_write(self, subject: str):
+        self._writes[subject] = monotonic() + self.sticky_window
+        self._writes.move_to_end(subject)
+
+        # o primeiro é o que vence antes, sair cedo só manda o usuário de
+        # volta para a réplica
+        while len(self._writes) > self.max_size:
+            self._writes.popitem(last=False)
+
+    def wrote_recently(self, subject: str) -> bool:
+        until = self._writes.get(subject)
+        return until is not None and until > monotonic()
+
+    async def dispose(self):
+        for engine in self.engines:
+            await engine.dispose()
+
+
+def create_read_replicas(settings: Settings) -> ReadReplicas | None:
+    """_summary_
+
+    Args:
+        settings (Settings): application settings with DATABASE_READ_URLS
+
+    Returns:
+        ReadReplicas | None: one pooled engine per replica, with the same
+        pool options as the primary, or None without replicas
+    """
+    if not settings.DATABASE_READ_URLS:
+        return None
+
+    return ReadReplicas(
+        [
+            create_engine(settings.model_copy(update={'DATABASE_URL': url}))
+            for url in settings.DATABASE_READ_URLS
+        ],
+        settings.DATABASE_READ_BALANCE,
+        settings.READ_YOUR_WRITES_WINDOW,
+    )
+
+
+def mark_authenticated(request: Request, subject: str):
+    # sub já verificado pelo get_current_user, usado pelo
+    # ReadYourWritesMiddleware se a requisição for uma escrita bem-sucedida
+    request.state.authenticated_subject = subject
+
+
+class ReadYourWritesMiddleware:
+    """Opens the read-your-writes window after authenticated writes.
+
+    Marks the subject verified during the request when a non-safe request
+    starts a response without an error status, before the client gets it.
+    Failed or unauthenticated requests never mark anyone.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_marking_write(message):
+            if (
+                message['type'] == 'http.response.start'
+                and message['status'] < HTTPStatus.BAD_REQUEST
+            ):
+                replicas = scope['app'].state.replicas
+                subject = scope.get('state', {}).get('authenticated_subject')
+                if replicas is not None and subject:
+                    replicas.mark_write(subject)
+            await send(message)
+
+        await self.app(scope, receive, send_marking_write)
+
+
+def token_subject(request: Request) -> str | None:
+    # só escolhe o banco da leitura, quem autentica é o get_current_user e
+    # a janela só é aberta pelo ReadYourWritesMiddleware
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    try:
+        payload = decode(token, options={'verify_signature': False})
+    except PyJWTError:
+        return None
+    return payload.get('sub')
+
+
+async def get_read_session(
+    request: Request, session: AsyncSession = Depends(get_session)
+):
+    """_summary_
+
+    Args:
+        request (Request): current request, gives access to the replicas
+        created by the app lifespan
+        session (AsyncSession): primary session of the request
+
+    Yields:
+        AsyncSession: a replica session for reads, or the primary one for
+        writes, for users inside the read-your-writes window and when no
+        replica is configured
+    """
+    replicas = request.app.state.replicas
+    if replicas is None or request.method not in SAFE_METHODS:
+        yield session
+        return
+
+    subject = token_subject(request)
+    if subject and replicas.wrote_recently(subject):
+        yield session
+        return
+
+    async with AsyncSession(
+        replicas.pick(), expire_on_commit=False
+    ) as replica_session:
+        yield replica_session
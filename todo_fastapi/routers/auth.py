@@ -10,24 +10,29 @@ from todo_fastapi.database import get_session
 from todo_fastapi.models.models_db import User
 from todo_fastapi.schema.schemas import (
     TokenSchema,
+    UserPrincipal,
 )
 from todo_fastapi.security import (
     create_access_token,
     get_current_user,
-    verify_pwd,
+    user_claims,
+    verify_pwd_async,
 )
+from todo_fastapi.settings import Settings, get_settings
 
 router = APIRouter(prefix='/auth', tags=['auth'])
 
 T_Session = Annotated[AsyncSession, Depends(get_session)]
 T_OAuthForm = Annotated[OAuth2PasswordRequestForm, Depends()]
-T_CurrentUser = Annotated[User, Depends(get_current_user)]
+T_CurrentUser = Annotated[UserPrincipal, Depends(get_current_user)]
+T_Settings = Annotated[Settings, Depends(get_settings)]
 
 
 @router.post('/token/', response_model=TokenSchema)
 async def login_for_access_token(
     form_data: T_OAuthForm,
     session: T_Session,
+    settings: T_Settings,
 ):
     user = await session.scalar(
         select(User).where(User.email == form_data.username)
@@ -40,18 +45,22 @@ async def login_for_access_token(
             status_code=HTTPStatus.UNAUTHORIZED,
         )
 
-    if not verify_pwd(form_data.password, user.password):
+    if not await verify_pwd_async(form_data.password, user.password):
         raise HTTPException(
             detail='incorrect email or password',
             status_code=HTTPStatus.UNAUTHORIZED,
         )
 
-    access_token = create_access_token(data={'sub': user.email})
+    access_token = create_access_token(
+        data=user_claims(user), settings=settings
+    )
     return {'access_token': access_token, 'token_type': 'Bearer'}
 
 
 @router.post('/refresh_token', response_model=TokenSchema)
-async def refresh_token(user: T_CurrentUser):
-    refresh_token = create_access_token(data={'sub': user.email})
+async def refresh_token(user: T_CurrentUser, settings: T_Settings):
+    refresh_token = create_access_token(
+        data=user_claims(user), settings=settings
+    )
 
     return {'access_token': refresh_token, 'token_type': 'Bearer'}
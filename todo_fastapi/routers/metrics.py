@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from todo_fastapi.metrics import registry
+
+router = APIRouter(tags=['metrics'])
+
+
+@router.get(
+    '/metrics', response_class=PlainTextResponse, include_in_schema=False
+)
+async def read_metrics():
+    # formato de texto do Prometheus, somando todos os workers
+    return PlainTextResponse(
+        registry.render(),
+        media_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -1,29 +1,110 @@
+from collections import Counter
+from datetime import timedelta
 from http import HTTPStatus
-from typing import Annotated
+from typing import Annotated, Literal
+from uuid import uuid4
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from todo_fastapi.counters import (
+    bump_counters,
+    count_states,
+    read_counters,
+    read_version,
+)
 from todo_fastapi.database import get_session
-from todo_fastapi.models.models_db import Todo, TodoState, User
+from todo_fastapi.etag import collection_etag, etag_matches, not_modified
+from todo_fastapi.export import EXPORT_MEDIA_TYPES, export_todos
+from todo_fastapi.importer import (
+    import_todos,
+    read_batches,
+    read_file_batches,
+    run_import_job,
+    spool_upload,
+)
+from todo_fastapi.models.models_db import (
+    ImportJobStatus,
+    Todo,
+    TodoImportJob,
+    TodoState,
+)
+from todo_fastapi.pagination import paginate
+from todo_fastapi.replicas import get_read_session
 from todo_fastapi.schema.schemas import (
     FilterPage,
     FilterTodo,
+    FilterTodoExport,
     Message,
+    TodoBulkCreate,
+    TodoBulkDelete,
+    TodoBulkItem,
+    TodoBulkResult,
+    TodoBulkUpdate,
+    TodoFilters,
+    TodoImportJobPublic,
+    TodoImportResult,
     TodoPublic,
     TodoSchema,
     TodosList,
+    TodoStats,
     TodoUpdate,
+    UserPrincipal,
 )
+from todo_fastapi.search import search_todos
 from todo_fastapi.security import (
+    credentials_exception,
     get_current_user,
+    get_current_user_id,
+)
+from todo_fastapi.serialization import (
+    TODO_COLUMNS,
+    json_response,
+    todo_row_adapter,
+    todos_page_adapter,
+)
+from todo_fastapi.settings import Settings, get_settings
+from todo_fastapi.sync import (
+    check_sync_token_age,
+    database_now,
+    decode_sync_token,
+    record_tombstones,
+    todo_changes,
+)
+from todo_fastapi.token_versions import TokenVersions, get_token_versions
+from todo_fastapi.write_behind import (
+    WriteAheadLogFull,
+    WriteBehindQueue,
+    get_write_behind,
+    prefers_async,
 )
 
 T_Session = Annotated[AsyncSession, Depends(get_session)]
-T_CurrentUser = Annotated[User, Depends(get_current_user)]
+T_ReadSession = Annotated[AsyncSession, Depends(get_read_session)]
+T_CurrentUser = Annotated[UserPrincipal, Depends(get_current_user)]
+# só o id, sem consultar users quando STATELESS_AUTH está ligado
+T_CurrentUserId = Annotated[int, Depends(get_current_user_id)]
 T_FilterPage = Annotated[FilterPage, Query()]
 T_FilterTodo = Annotated[FilterTodo, Query()]
+T_FilterTodoExport = Annotated[FilterTodoExport, Query()]
+T_ImportFormat = Annotated[Literal['ndjson', 'csv'], Query()]
+
+T_Settings = Annotated[Settings, Depends(get_settings)]
+T_WriteBehind = Annotated[WriteBehindQueue | None, Depends(get_write_behind)]
+T_TokenVersions = Annotated[TokenVersions | None, Depends(get_token_versions)]
 
 
 router = APIRouter(prefix='/todos', tags=['todos'])
@@ -31,25 +112,40 @@ router = APIRouter(prefix='/todos', tags=['todos'])
 
 @router.post('/', status_code=HTTPStatus.CREATED, response_model=TodoPublic)
 async def create_todo(
-    todo: TodoSchema, session: T_Session, current_user: T_CurrentUser
+    todo: TodoSchema,
+    session: T_Session,
+    user_id: T_CurrentUserId,
+    token_versions: T_TokenVersions,
 ):
     todo_db = Todo(
         title=todo.title, description=todo.description, state=todo.state
     )
-    todo_db.user_id = current_user.id
+    todo_db.user_id = user_id
 
     session.add(todo_db)
-    await session.commit()
-    await session.refresh(todo_db)
+    try:
+        await bump_counters(session, user_id, {todo.state: 1})
+        await session.commit()
+    except IntegrityError:
+        # a única FK é user_id, o usuário do token foi apagado e este
+        # worker ainda não sabia (versões de token ou principal em cache)
+        await session.rollback()
+        if token_versions is not None:
+            token_versions.set(user_id, None)
+        raise credentials_exception()
 
     return todo_db
 
 
-@router.get('/', status_code=HTTPStatus.OK, response_model=TodosList)
-async def read_todos(
-    session: T_Session, current_user: T_CurrentUser, filter_todo: T_FilterTodo
-):
-    query = select(Todo).where(Todo.user_id == current_user.id)
+@router.get('/stats', status_code=HTTPStatus.OK, response_model=TodoStats)
+async def read_todo_stats(session: T_Session, current_user: T_CurrentUser):
+    # lê os contadores, no máximo uma linha por state
+    return await read_counters(session, current_user.id)
+
+
+def filter_todos(user_id: int, filter_todo: TodoFilters):
+    # os filtros sempre partem de user_id, coberto pelos índices de todos
+    query = select(Todo).where(Todo.user_id == user_id)
 
     if filter_todo.title:
         query = query.filter(Todo.title.contains(filter_todo.title))
@@ -60,67 +156,508 @@ async def read_todos(
     if filter_todo.state:
         query = query.filter(Todo.state == filter_todo.state)
 
+    return query
+
+
+@router.get('/', status_code=HTTPStatus.OK, response_model=TodosList)
+async def read_todos(
+    session: T_ReadSession,
+    user_id: T_CurrentUserId,
+    filter_todo: T_FilterTodo,
+    request: Request,
+    write_behind: T_WriteBehind,
+):
+    query = filter_todos(user_id, filter_todo)
+    if filter_todo.q:
+        query = search_todos(query, filter_todo.q, session.bind.dialect.name)
+
+    # clientes que fazem polling recebem 304 lendo só a versão do usuário;
+    # lida antes da página, uma escrita entre as duas só gera outro 200
+    # escritas adiadas ainda fora do banco também mudam a resposta
+    pending = None
+    if write_behind is not None:
+        pending = write_behind.pending_version(user_id)
+    etag = collection_etag(
+        await read_version(session, user_id), request, pending
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    query = query.with_only_columns(*TODO_COLUMNS)
+    next_cursor = None
+    # resultados da busca seguem a relevância, então só paginam por offset
+    if filter_todo.q:
+        todos = await session.execute(
+            query.offset(filter_todo.offset).limit(filter_todo.limit)
+        )
+        todos = todos.all()
+    else:
+        todos, next_cursor = await paginate(
+            session, query, Todo.id, filter_todo
+        )
+
+    todos = [t._asdict() for t in todos]
+    if pending is not None:
+        # o overlay só cobre as linhas que o banco devolveu, um todo que
+        # passa a entrar no filtro aparece depois do flush
+        todos = [
+            todo
+            for todo in map(write_behind.overlay, todos)
+            if filter_todo.state in {None, todo['state']}
+        ]
+
+    return json_response(
+        todos_page_adapter,
+        {'todos': todos, 'next_cursor': next_cursor},
+        headers={'ETag': etag},
+    )
+
+
+def check_batch_size(amount: int, settings: Settings):
+    if amount > settings.TODO_BULK_MAX_ITEMS:
+        raise HTTPException(
+            detail=f'batch limited to {settings.TODO_BULK_MAX_ITEMS} todos',
+            status_code=HTTPStatus.BAD_REQUEST,
+        )
+
+
+async def flush_pending(write_behind: WriteBehindQueue | None, todo_ids):
+    # escritas adiadas desses todos vão antes, para não sobrescreverem
+    # a escrita síncrona quando o flush rodar
+    if write_behind is not None and write_behind.has_pending(todo_ids):
+        await write_behind.flush()
+
+
+async def bulk_results(
+    session: AsyncSession, ids: list[int], done: set[int], detail: str
+):
+    # só consulta de novo os ids que não foram alterados, para manter a
+    # mesma diferença entre 404 e 403 das rotas de um único todo
+    missing = [todo_id for todo_id in ids if todo_id not in done]
+    others = set()
+    if missing:
+        others = set(
+            await session.scalars(select(Todo.id).where(Todo.id.in_(missing)))
+        )
+
+    results = []
+    for todo_id in ids:
+        if todo_id in done:
+            results.append(TodoBulkItem(id=todo_id, detail=detail))
+        elif todo_id in others:
+            results.append(
+                TodoBulkItem(id=todo_id, detail='not enough permission')
+            )
+        else:
+            results.append(TodoBulkItem(id=todo_id, detail='todo not found'))
+
+    return {'results': results}
+
+
+@router.get('/export', status_code=HTTPStatus.OK)
+async def export_user_todos(
+    session: T_Session,
+    current_user: T_CurrentUser,
+    filter_export: T_FilterTodoExport,
+):
+    query = filter_todos(current_user.id, filter_export)
+    if filter_export.q:
+        query = search_todos(query, filter_export.q, session.bind.dialect.name)
+    else:
+        query = query.order_by(Todo.id)
+
+    return StreamingResponse(
+        export_todos(session, query, filter_export.format),
+        media_type=EXPORT_MEDIA_TYPES[filter_export.format],
+        headers={
+            'Content-Disposition': (
+                f'attachment; filename="todos.{filter_export.format}"'
+            )
+        },
+    )
+
+
+@router.post(
+    '/import', status_code=HTTPStatus.OK, response_model=TodoImportResult
+)
+async def import_user_todos(
+    file: UploadFile,
+    session: T_Session,
+    current_user: T_CurrentUser,
+    settings: T_Settings,
+    format: T_ImportFormat = 'ndjson',
+):
+    return await import_todos(
+        session,
+        current_user.id,
+        read_batches(file.file, format, settings.TODO_IMPORT_BATCH_SIZE),
+        settings.TODO_IMPORT_MAX_ERRORS,
+    )
+
+
+@router.post(
+    '/import/jobs',
+    status_code=HTTPStatus.ACCEPTED,
+    response_model=TodoImportJobPublic,
+)
+async def create_import_job(  # noqa: PLR0913, PLR0917
+    file: UploadFile,
+    session: T_Session,
+    current_user: T_CurrentUser,
+    settings: T_Settings,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    format: T_ImportFormat = 'ndjson',
+):
+    path = await run_in_threadpool(spool_upload, file.file)
+
+    job = TodoImportJob(
+        id=uuid4().hex,
+        user_id=current_user.id,
+        status=ImportJobStatus.pending,
+    )
+    session.add(job)
+    await session.commit()
+
+    # roda após a resposta, o cliente acompanha pela rota de status
+    background_tasks.add_task(
+        run_import_job,
+        session.bind,
+        job.id,
+        current_user.id,
+        read_file_batches(path, format, settings.TODO_IMPORT_BATCH_SIZE),
+        settings.TODO_IMPORT_MAX_ERRORS,
+    )
+    background_tasks.add_task(path.unlink, missing_ok=True)
+    response.headers['Location'] = f'/todos/import/jobs/{job.id}'
+
+    return job
+
+
+@router.get(
+    '/import/jobs/{job_id}',
+    status_code=HTTPStatus.OK,
+    response_model=TodoImportJobPublic,
+)
+async def read_import_job(
+    job_id: str, session: T_Session, current_user: T_CurrentUser
+):
+    job = await session.scalar(
+        select(TodoImportJob).where(
+            TodoImportJob.id == job_id,
+            TodoImportJob.user_id == current_user.id,
+        )
+    )
+    if job is None:
+        raise HTTPException(
+            detail='import job not found', status_code=HTTPStatus.NOT_FOUND
+        )
+
+    return job
+
+
+@router.get('/changes', status_code=HTTPStatus.OK)
+async def read_todo_changes(
+    session: T_Session,
+    current_user: T_CurrentUser,
+    settings: T_Settings,
+    since: str | None = None,
+):
+    # sem token o cliente recebe todos os todos, como numa primeira carga
+    since = decode_sync_token(since) if since else None
+    # pego antes das leituras, alterações feitas durante o stream voltam
+    # na próxima chamada
+    now = await database_now(session)
+    if since is not None:
+        # antes do stream, depois dele o status já foi enviado
+        check_sync_token_age(
+            since, now, timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        )
+
+    return StreamingResponse(
+        todo_changes(
+            session,
+            current_user.id,
+            since,
+            now - timedelta(seconds=settings.SYNC_TOKEN_SKEW),
+        ),
+        media_type='application/x-ndjson',
+    )
+
+
+@router.post('/bulk', status_code=HTTPStatus.CREATED, response_model=TodosList)
+async def create_todos_bulk(
+    payload: TodoBulkCreate,
+    session: T_Session,
+    current_user: T_CurrentUser,
+    settings: T_Settings,
+):
+    check_batch_size(len(payload.todos), settings)
+
+    # um único INSERT com várias linhas, os ids e datas voltam no RETURNING
     todos = await session.scalars(
-        query.offset(filter_todo.offset).limit(filter_todo.limit)
+        insert(Todo).returning(Todo, sort_by_parameter_order=True),
+        [
+            {**todo.model_dump(), 'user_id': current_user.id}
+            for todo in payload.todos
+        ],
     )
+    todos = todos.all()
+    await bump_counters(
+        session, current_user.id, count_states(t.state for t in todos)
+    )
+    await session.commit()
 
-    return {'todos': todos.all()}
+    return {'todos': todos}
 
 
 @router.patch(
-    '/{todo_id}', status_code=HTTPStatus.OK, response_model=TodoPublic
+    '/bulk', status_code=HTTPStatus.OK, response_model=TodoBulkResult
 )
-async def update_todo(
-    todo_id: int,
-    todo: TodoUpdate,
+async def update_todos_bulk(
+    payload: TodoBulkUpdate,
+    session: T_Session,
     current_user: T_CurrentUser,
+    settings: T_Settings,
+    write_behind: T_WriteBehind,
+):
+    check_batch_size(len(payload.ids), settings)
+    ids = list(dict.fromkeys(payload.ids))
+    await flush_pending(write_behind, ids)
+
+    # states antigos, com as linhas travadas até o commit dos contadores
+    previous = await session.execute(
+        select(Todo.id, Todo.state)
+        .where(Todo.id.in_(ids), Todo.user_id == current_user.id)
+        .with_for_update()
+    )
+    previous = previous.all()
+
+    updated = await session.scalars(
+        update(Todo)
+        .where(Todo.id.in_(ids), Todo.user_id == current_user.id)
+        .values(state=payload.state)
+        .returning(Todo.id)
+    )
+    deltas = count_states([payload.state] * len(previous))
+    deltas.subtract(count_states(row.state for row in previous))
+    await bump_counters(session, current_user.id, deltas)
+    results = await bulk_results(session, ids, set(updated), 'updated')
+    await session.commit()
+
+    return results
+
+
+@router.delete(
+    '/bulk', status_code=HTTPStatus.OK, response_model=TodoBulkResult
+)
+async def delete_todos_bulk(
+    payload: TodoBulkDelete,
     session: T_Session,
+    current_user: T_CurrentUser,
+    settings: T_Settings,
+    write_behind: T_WriteBehind,
 ):
-    todo_db = await session.scalar(select(Todo).where(Todo.id == todo_id))
+    check_batch_size(len(payload.ids), settings)
+    ids = list(dict.fromkeys(payload.ids))
+    await flush_pending(write_behind, ids)
 
-    if not todo_db:
+    deleted = await session.execute(
+        delete(Todo)
+        .where(Todo.id.in_(ids), Todo.user_id == current_user.id)
+        .returning(Todo.id, Todo.state)
+    )
+    deleted = deleted.all()
+    deleted_ids = [row.id for row in deleted]
+    await record_tombstones(session, current_user.id, deleted_ids)
+    deltas = Counter()
+    deltas.subtract(count_states(row.state for row in deleted))
+    await bump_counters(session, current_user.id, deltas)
+    results = await bulk_results(session, ids, set(deleted_ids), 'deleted')
+    await session.commit()
+
+    return results
+
+
+async def raise_todo_miss(session: AsyncSession, todo_id: int):
+    # só roda quando o UPDATE/DELETE não achou o todo do usuário, para
+    # diferenciar um todo inexistente de um todo de outro usuário
+    todo_exists = await session.scalar(
+        select(Todo.id).where(Todo.id == todo_id)
+    )
+
+    if not todo_exists:
         raise HTTPException(
             detail='todo not found', status_code=HTTPStatus.NOT_FOUND
         )
 
-    if todo_db.user_id == current_user.id:
-        for key, value in todo.model_dump(exclude_unset=True).items():
-            # valida se o valor de state recebido pela API é válido
-            if key == 'state' and value not in TodoState:
-                raise HTTPException(
-                    detail='invalid value for todo',
-                    status_code=HTTPStatus.BAD_REQUEST,
-                )
-            setattr(todo_db, key, value)
-
-        session.add(todo_db)
-        await session.commit()
-        await session.refresh(todo_db)
-
-        return todo_db
-
     raise HTTPException(
         detail='not enough permission', status_code=HTTPStatus.FORBIDDEN
     )
 
 
-@router.delete('/{todo_id}', status_code=HTTPStatus.OK, response_model=Message)
-async def delete_todo(
-    todo_id: int, current_user: T_CurrentUser, session: T_Session
+async def defer_todo_update(
+    session: AsyncSession,
+    write_behind: WriteBehindQueue,
+    todo_id: int,
+    user_id: int,
+    values: dict,
+) -> Response | None:
+    # o 202 promete a escrita, um NULL nas colunas NOT NULL só falharia no
+    # flush, depois da resposta; states inválidos já saíram com 400
+    if None in values.values():
+        raise HTTPException(
+            detail='invalid value for todo',
+            status_code=HTTPStatus.BAD_REQUEST,
+        )
+
+    # só a checagem de dono vai ao banco, a escrita fica no log local
+    todo_db = await session.execute(
+        select(*TODO_COLUMNS).where(
+            Todo.id == todo_id, Todo.user_id == user_id
+        )
+    )
+    todo_db = todo_db.first()
+
+    if not todo_db:
+        await raise_todo_miss(session, todo_id)
+
+    if values:
+        try:
+            await write_behind.submit(todo_id, user_id, values)
+        except WriteAheadLogFull:
+            # sem espaço no log nem depois do flush, a escrita segue síncrona
+            return None
+
+    return json_response(
+        todo_row_adapter,
+        write_behind.overlay(todo_db._asdict()),
+        headers={'Preference-Applied': 'respond-async'},
+        status_code=HTTPStatus.ACCEPTED,
+    )
+
+
+def update_state_query(todo_id: int, user_id: int, values: dict):
+    # o contador precisa do state antigo, que no postgres volta no mesmo
+    # UPDATE, lido da linha que a CTE trava
+    old = (
+        select(Todo.id, Todo.state)
+        .where(Todo.id == todo_id, Todo.user_id == user_id)
+        .with_for_update()
+        .cte('old')
+    )
+    # user_id também no UPDATE, a escrita só toca a partição do usuário
+    return (
+        update(Todo)
+        .where(Todo.id == old.c.id, Todo.user_id == user_id)
+        .values(**values)
+        .returning(old.c.state, Todo)
+    )
+
+
+async def update_todo_state(
+    session: AsyncSession, todo_id: int, user_id: int, values: dict
+) -> tuple[TodoState, Todo] | None:
+    if session.bind.dialect.name == 'postgresql':
+        updated = await session.execute(
+            update_state_query(todo_id, user_id, values)
+        )
+        return updated.first()
+
+    # o RETURNING do sqlite não enxerga a CTE, mas lá as escritas já são
+    # serializadas pelo lock do banco
+    where = (Todo.id == todo_id, Todo.user_id == user_id)
+    previous_state = await session.scalar(select(Todo.state).where(*where))
+    if previous_state is None:
+        return None
+    todo_db = await session.scalar(
+        update(Todo).where(*where).values(**values).returning(Todo)
+    )
+    return previous_state, todo_db
+
+
+@router.patch(
+    '/{todo_id}',
+    status_code=HTTPStatus.OK,
+    response_model=TodoPublic,
+    responses={HTTPStatus.ACCEPTED: {'model': TodoPublic}},
+)
+async def update_todo(  # noqa: PLR0913, PLR0917
+    todo_id: int,
+    todo: TodoUpdate,
+    user_id: T_CurrentUserId,
+    session: T_Session,
+    write_behind: T_WriteBehind,
+    request: Request,
 ):
-    todo = await session.scalar(select(Todo).where(Todo.id == todo_id))
+    values = todo.model_dump(exclude_unset=True)
 
-    if not todo:
+    # valida se o valor de state recebido pela API é válido
+    if 'state' in values and values['state'] not in TodoState:
         raise HTTPException(
-            detail='todo not found', status_code=HTTPStatus.NOT_FOUND
+            detail='invalid value for todo',
+            status_code=HTTPStatus.BAD_REQUEST,
         )
 
-    if todo.user_id == current_user.id:
-        await session.delete(todo)
-        await session.commit()
+    if write_behind is not None and prefers_async(request):
+        deferred = await defer_todo_update(
+            session, write_behind, todo_id, user_id, values
+        )
+        if deferred is not None:
+            return deferred
+    await flush_pending(write_behind, [todo_id])
 
-        return {'message': 'deleted'}
+    # a checagem de dono fica no WHERE, um único comando no caminho feliz
+    previous_state = None
+    if 'state' in values:
+        updated = await update_todo_state(session, todo_id, user_id, values)
+        if updated is None:
+            await raise_todo_miss(session, todo_id)
+        previous_state, todo_db = updated
+    else:
+        query = select(Todo)
+        if values:
+            query = update(Todo).values(**values).returning(Todo)
 
-    raise HTTPException(
-        detail='not enough permission', status_code=HTTPStatus.FORBIDDEN
+        todo_db = await session.scalar(
+            query.where(Todo.id == todo_id, Todo.user_id == user_id)
+        )
+
+        if not todo_db:
+            await raise_todo_miss(session, todo_id)
+
+    # sem state os contadores ficam, só a versão dos todos sobe
+    if values:
+        deltas = Counter()
+        if previous_state is not None:
+            deltas[previous_state] -= 1
+            deltas[todo_db.state] += 1
+        await bump_counters(session, user_id, deltas)
+    await session.commit()
+
+    return todo_db
+
+
+@router.delete('/{todo_id}', status_code=HTTPStatus.OK, response_model=Message)
+async def delete_todo(
+    todo_id: int,
+    user_id: T_CurrentUserId,
+    session: T_Session,
+    write_behind: T_WriteBehind,
+):
+    await flush_pending(write_behind, [todo_id])
+    deleted = await session.execute(
+        delete(Todo)
+        .where(Todo.id == todo_id, Todo.user_id == user_id)
+        .returning(Todo.id, Todo.state)
     )
+    deleted = deleted.first()
+
+    if not deleted:
+        await raise_todo_miss(session, todo_id)
+
+    await record_tombstones(session, user_id, [deleted.id])
+    await bump_counters(session, user_id, {deleted.state: -1})
+    await session.commit()
+
+    return {'message': 'deleted'}
@@ -1,56 +1,87 @@
 from http import HTTPStatus
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from todo_fastapi.cache import PrincipalCache, get_principal_cache
 from todo_fastapi.database import (
     get_session,
     raise_unique_fields_error,
-    search_id,
 )
+from todo_fastapi.etag import etag_matches, make_etag, not_modified
 from todo_fastapi.models.models_db import User
+from todo_fastapi.pagination import paginate
+from todo_fastapi.replicas import get_read_session
 from todo_fastapi.schema.schemas import (
     FilterPage,
     UserList,
+    UserPrincipal,
     UserPublic,
     UserSchema,
 )
 from todo_fastapi.security import (
+    credentials_exception,
     get_current_user,
-    get_pwd_hash,
+    get_pwd_hash_async,
 )
+from todo_fastapi.serialization import (
+    USER_COLUMNS,
+    json_response,
+    users_page_adapter,
+)
+from todo_fastapi.token_versions import TokenVersions, get_token_versions
 
 router = APIRouter(prefix='/users', tags=['users'])
 
 T_Session = Annotated[AsyncSession, Depends(get_session)]
-T_CurrentUser = Annotated[User, Depends(get_current_user)]
+T_ReadSession = Annotated[AsyncSession, Depends(get_read_session)]
+T_CurrentUser = Annotated[UserPrincipal, Depends(get_current_user)]
 T_FilterPage = Annotated[FilterPage, Query()]
+T_PrincipalCache = Annotated[PrincipalCache, Depends(get_principal_cache)]
+T_TokenVersions = Annotated[TokenVersions | None, Depends(get_token_versions)]
 
 
 @router.get('/', status_code=HTTPStatus.OK, response_model=UserList)
 async def read_users(
-    session: T_Session,
+    session: T_ReadSession,
     current_user: T_CurrentUser,
     filter_page: T_FilterPage,
 ):
-    users = await session.scalars(
-        select(User).offset(filter_page.offset).limit(filter_page.limit)
+    users, next_cursor = await paginate(
+        session, select(*USER_COLUMNS), User.id, filter_page
+    )
+    return json_response(
+        users_page_adapter,
+        {'users': [u._asdict() for u in users], 'next_cursor': next_cursor},
     )
-    return {'users': users}
 
 
 @router.get('/{user_id}', status_code=HTTPStatus.OK, response_model=UserPublic)
-async def read_user(user_id: int, session: T_Session):
-    user_db = await search_id(user_id, session)
+async def read_user(
+    user_id: int,
+    session: T_ReadSession,
+    request: Request,
+    response: Response,
+):
+    # só as colunas públicas, sem montar o objeto do ORM
+    user_db = await session.execute(
+        select(*USER_COLUMNS).where(User.id == user_id)
+    )
+    user_db = user_db.first()
 
     if user_db is None:
         raise HTTPException(
             detail='user not found', status_code=HTTPStatus.NOT_FOUND
         )
 
-    return user_db
+    etag = make_etag(user_db.id, user_db.updated_at)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers['ETag'] = etag
+
+    return user_db._mapping
 
 
 @router.post('/', status_code=HTTPStatus.CREATED, response_model=UserPublic)
@@ -66,20 +97,21 @@ async def create_user(user: UserSchema, session: T_Session):
     user_db = User(
         username=user.username,
         email=user.email,
-        password=get_pwd_hash(user.password),
+        password=await get_pwd_hash_async(user.password),
     )
     session.add(user_db)
     await session.commit()
-    await session.refresh(user_db)
     return user_db
 
 
 @router.put('/{user_id}', status_code=HTTPStatus.OK, response_model=UserPublic)
-async def update_user(
+async def update_user(  # noqa: PLR0913, PLR0917
     user_id: int,
     user: UserSchema,
     session: T_Session,
     current_user: T_CurrentUser,
+    cache: T_PrincipalCache,
+    token_versions: T_TokenVersions,
 ):
     if current_user.id != user_id:
         raise HTTPException(
@@ -95,16 +127,33 @@ async def update_user(
         raise_unique_fields_error(user, test_user)
 
     # Sobrescreve os dados originais do banco com os dados recebidos da API
-    current_user.username = user.username
-    current_user.email = user.email
-    current_user.password = get_pwd_hash(user.password)
-
-    session.add(current_user)
+    # em um único UPDATE ... RETURNING, sem carregar o usuário antes; a
+    # nova token_version revoga os tokens com o email e a senha antigos
+    user_db = await session.scalar(
+        update(User)
+        .where(User.id == current_user.id)
+        .values(
+            username=user.username,
+            email=user.email,
+            password=await get_pwd_hash_async(user.password),
+            token_version=User.token_version + 1,
+        )
+        .returning(User)
+    )
+    # apagado entre a autenticação e o UPDATE, o token não vale mais
+    if user_db is None:
+        await session.rollback()
+        raise credentials_exception()
 
     await session.commit()
-    await session.refresh(current_user)
+    # só limpa o cache deste worker; quem revoga o token antigo nos outros
+    # é a comparação da claim ver com a token_version, assim que eles leem
+    # a nova versão (TTL do cache, refresh do mapa ou um token mais novo)
+    await cache.invalidate(current_user.email)
+    if token_versions is not None:
+        token_versions.set(user_db.id, user_db.token_version)
 
-    return current_user
+    return user_db
 
 
 @router.delete(
@@ -114,13 +163,20 @@ async def delete_user(
     user_id: int,
     session: T_Session,
     current_user: T_CurrentUser,
+    cache: T_PrincipalCache,
+    token_versions: T_TokenVersions,
 ):
     if current_user.id != user_id:
         raise HTTPException(
             detail='not enough permission', status_code=HTTPStatus.FORBIDDEN
         )
 
-    await session.delete(current_user)
+    user_db = await session.get(User, current_user.id)
+
+    await session.delete(user_db)
     await session.commit()
+    await cache.invalidate(current_user.email)
+    if token_versions is not None:
+        token_versions.set(current_user.id, None)
 
-    return current_user
+    return user_db
@@ -1,8 +1,9 @@
 from datetime import datetime
+from typing import Literal
 
 from pydantic import BaseModel, ConfigDict, EmailStr, Field
 
-from todo_fastapi.models.models_db import TodoState
+from todo_fastapi.models.models_db import ImportJobStatus, TodoState
 
 
 class Message(BaseModel):
@@ -25,12 +26,22 @@ class UserPublic(BaseModel):
     updated_at: datetime
 
 
+class UserPrincipal(BaseModel):
+    # usuário autenticado, sem carregar o objeto User do ORM
+    model_config = ConfigDict(frozen=True)
+    id: int
+    username: str
+    email: str
+    token_version: int = 1
+
+
 class UserDB(UserSchema):
     id: int
 
 
 class UserList(BaseModel):
     users: list[UserPublic]
+    next_cursor: str | None = None
 
 
 # html do endpoint "/hello"
@@ -53,14 +64,27 @@ class TokenSchema(BaseModel):
 
 class FilterPage(BaseModel):
     # indica limite de registros por página e de onde começa
-    limit: int = 10
-    offset: int = 0
+    limit: int = Field(default=10, ge=0)
+    offset: int = Field(default=0, ge=0)
+    # paginação por cursor, quando informado o offset é ignorado
+    cursor: str | None = None
 
 
-class FilterTodo(FilterPage):
+class TodoFilters(BaseModel):
     title: str | None = Field(default=None, min_length=3, max_length=40)
     description: str | None = Field(default=None, min_length=5, max_length=250)
     state: TodoState | None = None
+    # busca textual em title e description, ordenada por relevância
+    q: str | None = Field(default=None, max_length=100, pattern=r'\S')
+
+
+class FilterTodo(FilterPage, TodoFilters):
+    pass
+
+
+class FilterTodoExport(TodoFilters):
+    # mesmos filtros da listagem, sem paginação
+    format: Literal['ndjson', 'csv'] = 'ndjson'
 
 
 class TodoSchema(BaseModel):
@@ -77,9 +101,61 @@ class TodoPublic(TodoSchema):
 
 class TodosList(BaseModel):
     todos: list[TodoPublic]
+    next_cursor: str | None = None
 
 
 class TodoUpdate(BaseModel):
     title: str | None = None
     description: str | None = None
     state: str | None = None
+
+
+class TodoStats(BaseModel):
+    draft: int
+    doing: int
+    done: int
+    todo: int
+    trash: int
+    total: int
+
+
+class TodoBulkCreate(BaseModel):
+    todos: list[TodoSchema] = Field(min_length=1)
+
+
+class TodoBulkUpdate(BaseModel):
+    ids: list[int] = Field(min_length=1)
+    state: TodoState
+
+
+class TodoBulkDelete(BaseModel):
+    ids: list[int] = Field(min_length=1)
+
+
+class TodoBulkItem(BaseModel):
+    id: int
+    # mesmo texto das rotas de um único todo em caso de erro
+    detail: str
+
+
+class TodoBulkResult(BaseModel):
+    results: list[TodoBulkItem]
+
+
+class TodoImportError(BaseModel):
+    # linha do arquivo enviado, a partir de 1
+    line: int
+    detail: str
+
+
+class TodoImportResult(BaseModel):
+    imported: int
+    error_count: int
+    # limitado a TODO_IMPORT_MAX_ERRORS, error_count tem o total
+    errors: list[TodoImportError]
+
+
+class TodoImportJobPublic(TodoImportResult):
+    model_config = ConfigDict(from_attributes=True)
+    id: str
+    status: ImportJobStatus
@@ -0,0 +1,40 @@
+from sqlalchemy import Select, column, func, literal_column, table
+
+from todo_fastapi.models.models_db import Todo
+
+# objetos criados pela DDL de busca em models_db, fora do ORM
+search_vector = literal_column('todos.search_vector')
+# mesma configuração da coluna gerada, como literal e não como parâmetro
+ts_config = literal_column("'simple'")
+todos_fts = table('todos_fts', column('rowid'), column('rank'))
+
+
+def _fts5_query(q: str) -> str:
+    # cada termo vira uma frase literal, sem a sintaxe de consulta do FTS5
+    terms = (term.replace('"', '""') for term in q.split())
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def search_todos(query: Select, q: str, dialect_name: str) -> Select:
+    """_summary_
+
+    Args:
+        query (Select): todos query, already filtered by user
+        q (str): terms typed by the user
+        dialect_name (str): name of the database dialect of the session
+
+    Returns:
+        Select: query restricted to the matching todos, best ranked first
+    """
+    if dialect_name == 'postgresql':
+        ts_query = func.websearch_to_tsquery(ts_config, q)
+        return query.where(search_vector.op('@@')(ts_query)).order_by(
+            func.ts_rank(search_vector, ts_query).desc(), Todo.id
+        )
+
+    # no FTS5 o rank é negativo, quanto menor mais relevante
+    return (
+        query.join(todos_fts, todos_fts.c.rowid == Todo.id)
+        .where(literal_column('todos_fts').op('MATCH')(_fts5_query(q)))
+        .order_by(todos_fts.c.rank, Todo.id)
+    )
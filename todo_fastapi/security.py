@@ -1,8 +1,13 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import lru_cache
 from http import HTTPStatus
+from time import perf_counter
 from zoneinfo import ZoneInfo
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
 from jwt import DecodeError, decode, encode
 from jwt.exceptions import ExpiredSignatureError
@@ -10,15 +15,33 @@ from pwdlib import PasswordHash
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from todo_fastapi.cache import PrincipalCache, get_principal_cache
 from todo_fastapi.database import get_session
+from todo_fastapi.metrics import jwt_decode_failures, pwd_hash_wait
 from todo_fastapi.models.models_db import User
-from todo_fastapi.settings import Settings
+from todo_fastapi.replicas import get_read_session, mark_authenticated
+from todo_fastapi.schema.schemas import UserPrincipal
+from todo_fastapi.settings import Settings, get_settings
+from todo_fastapi.token_versions import TokenVersions, get_token_versions
 
 pwd_context = PasswordHash.recommended()
 
-TOKEN_EXPIRE_TIME = Settings().TOKEN_EXPIRE_TIME
-SECRET_KEY = Settings().SECRET_KEY
-ALGORITHM = Settings().ALGORITHM
+
+@dataclass(frozen=True, slots=True)
+class JWTConfig:
+    secret_key: str
+    algorithm: str
+    expire_time: timedelta
+
+
+@lru_cache
+def get_jwt_config(settings: Settings) -> JWTConfig:
+    # resolvido uma vez por objeto de settings, não a cada token
+    return JWTConfig(
+        secret_key=settings.SECRET_KEY,
+        algorithm=settings.ALGORITHM,
+        expire_time=timedelta(minutes=settings.TOKEN_EXPIRE_TIME),
+    )
 
 
 def get_pwd_hash(pwd: str):
@@ -29,44 +52,221 @@ def verify_pwd(plain_pwd: str, hashed_pwd: str):
     return pwd_context.verify(plain_pwd, hashed_pwd)
 
 
-def create_access_token(data: dict):
+class PasswordHashPool:
+    """Runs the Argon2 calls on a size limited thread pool.
+
+    Argon2 releases the GIL while hashing, so the threads run in parallel
+    without blocking the event loop. `max_workers` caps how many CPUs the
+    hashing can take and `max_queue` caps how many calls can be waiting
+    for a worker, further calls are rejected with 503.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pending = 0
+        # tempo que as chamadas esperaram por um worker livre
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self._executor = None
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_workers + self.max_queue:
+            raise HTTPException(
+                detail='server busy, try again later',
+                status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            )
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix='pwd_hash'
+            )
+
+        queued_at = perf_counter()
+
+        def job():
+            started_at = perf_counter()
+            return started_at - queued_at, func(*args)
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            wait, result = await loop.run_in_executor(self._executor, job)
+        finally:
+            self.pending -= 1
+
+        # contabilizado no event loop, sem concorrência entre threads
+        self.wait_count += 1
+        self.wait_seconds += wait
+        pwd_hash_wait.observe(wait)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+pwd_hash_pool = PasswordHashPool(
+    get_settings().PWD_HASH_WORKERS, get_settings().PWD_HASH_MAX_QUEUE
+)
+
+
+async def get_pwd_hash_async(pwd: str):
+    return await pwd_hash_pool.run(get_pwd_hash, pwd)
+
+
+async def verify_pwd_async(plain_pwd: str, hashed_pwd: str):
+    return await pwd_hash_pool.run(verify_pwd, plain_pwd, hashed_pwd)
+
+
+def user_claims(user) -> dict:
+    # uid e ver dispensam a busca do usuário com STATELESS_AUTH
+    return {'sub': user.email, 'uid': user.id, 'ver': user.token_version}
+
+
+def create_access_token(data: dict, settings: Settings | None = None):
+    jwt_config = get_jwt_config(settings or get_settings())
     to_encode = data.copy()
-    # soma 30 minutos ao horario UTC atual, zero fuso-horário
-    expire_time = datetime.now(tz=ZoneInfo('UTC')) + timedelta(
-        minutes=TOKEN_EXPIRE_TIME
-    )
+    # soma TOKEN_EXPIRE_TIME ao horario UTC atual, zero fuso-horário
+    expire_time = datetime.now(tz=ZoneInfo('UTC')) + jwt_config.expire_time
     # inclui a claim de expire no token
     to_encode['exp'] = expire_time
     # cria o token com payload, chave/segredo e o algoritmo
-    encoded_jwt = encode(to_encode, SECRET_KEY, ALGORITHM)
+    encoded_jwt = encode(
+        to_encode, jwt_config.secret_key, jwt_config.algorithm
+    )
     return encoded_jwt
 
 
 oauth2 = OAuth2PasswordBearer(tokenUrl='/auth/token')
 
 
-async def get_current_user(
-    token: str = Depends(oauth2), session: AsyncSession = Depends(get_session)
-):
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         detail='could not validate credentials',
         status_code=HTTPStatus.UNAUTHORIZED,
         headers={'WWW-Authenticate': 'Bearer'},
     )
+
+
+def decode_token(token: str, settings: Settings) -> dict:
+    jwt_config = get_jwt_config(settings)
     try:
-        payload = decode(token, SECRET_KEY, ALGORITHM)
-        subject_email = payload.get('sub')
-        if not subject_email:
-            raise credentials_exception
+        payload = decode(token, jwt_config.secret_key, jwt_config.algorithm)
     except DecodeError:
-        raise credentials_exception
+        jwt_decode_failures.inc('invalid')
+        raise credentials_exception()
     except ExpiredSignatureError:
-        raise credentials_exception
+        jwt_decode_failures.inc('expired')
+        raise credentials_exception()
+
+    if not payload.get('sub'):
+        jwt_decode_failures.inc('missing_subject')
+        raise credentials_exception()
+    return payload
 
-    user = await session.scalar(
-        select(User).where(User.email == subject_email)
+
+async def read_principal(
+    session: AsyncSession, subject_email: str
+) -> UserPrincipal:
+    # busca só as colunas da identidade, sem montar o objeto do ORM
+    user = await session.execute(
+        select(User.id, User.username, User.email, User.token_version).where(
+            User.email == subject_email
+        )
     )
+    user = user.first()
     if not user:
-        raise credentials_exception
+        raise credentials_exception()
+
+    return UserPrincipal.model_validate(user._mapping)
+
+
+async def load_principal(
+    payload: dict, session: AsyncSession, cache: PrincipalCache
+) -> UserPrincipal:
+    subject_email = payload['sub']
+    version = payload.get('ver')
+    principal = await cache.get(subject_email)
+    if (
+        principal is not None
+        and version is not None
+        and version > principal.token_version
+    ):
+        # token emitido depois de um update feito em outro worker, o
+        # principal do cache deste worker ainda tem a versão anterior
+        await cache.invalidate(subject_email)
+        principal = None
+
+    if principal is None:
+        principal = await read_principal(session, subject_email)
+        await cache.set(subject_email, principal, payload['exp'])
+
+    # token emitido antes do último update do usuário, já revogado
+    if version is not None and version < principal.token_version:
+        jwt_decode_failures.inc('revoked')
+        raise credentials_exception()
+
+    if payload.get('uid', principal.id) != principal.id:
+        jwt_decode_failures.inc('invalid')
+        raise credentials_exception()
+
+    return principal
+
+
+async def get_current_user(
+    request: Request,
+    token: str = Depends(oauth2),
+    session: AsyncSession = Depends(get_read_session),
+    cache: PrincipalCache = Depends(get_principal_cache),
+    settings: Settings = Depends(get_settings),
+) -> UserPrincipal:
+    payload = decode_token(token, settings)
+    principal = await load_principal(payload, session, cache)
+    mark_authenticated(request, payload['sub'])
+    return principal
+
+
+async def get_current_user_id(  # noqa: PLR0913, PLR0917
+    request: Request,
+    token: str = Depends(oauth2),
+    session: AsyncSession = Depends(get_session),
+    read_session: AsyncSession = Depends(get_read_session),
+    cache: PrincipalCache = Depends(get_principal_cache),
+    token_versions: TokenVersions | None = Depends(get_token_versions),
+    settings: Settings = Depends(get_settings),
+) -> int:
+    """_summary_
+
+    Args:
+        request (Request): current request, keeps the verified subject for
+        the read-your-writes window
+        token (str): bearer token of the request
+        session (AsyncSession): primary session of the request, the same
+        the route uses, reads the versions missing from the map
+        read_session (AsyncSession): session of get_current_user
+        cache (PrincipalCache): principals of the tokens without claim uid
+        token_versions (TokenVersions | None): versions of STATELESS_AUTH
+        settings (Settings): JWT options
+
+    Raises:
+        HTTPException: 401 for invalid, expired or revoked tokens
+
+    Returns:
+        int: id of the authenticated user, from the token claims when
+        STATELESS_AUTH is on, without querying users
+    """
+    payload = decode_token(token, settings)
+
+    # tokens emitidos antes das claims uid/ver seguem o caminho do banco
+    user_id = payload.get('uid')
+    if token_versions is None or user_id is None:
+        principal = await load_principal(payload, read_session, cache)
+        user_id = principal.id
+    elif not await token_versions.check(session, user_id, payload.get('ver')):
+        jwt_decode_failures.inc('revoked')
+        raise credentials_exception()
 
-    return user
+    mark_authenticated(request, payload['sub'])
+    return user_id
@@ -0,0 +1,84 @@
+from datetime import datetime
+from http import HTTPStatus
+from typing import TypedDict
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from todo_fastapi.models.models_db import Todo, TodoState, User
+
+# colunas de TodoPublic e UserPublic, buscadas como tuplas e não como ORM
+TODO_COLUMNS = (
+    Todo.id,
+    Todo.title,
+    Todo.description,
+    Todo.state,
+    Todo.created_at,
+    Todo.updated_at,
+)
+USER_COLUMNS = (
+    User.id,
+    User.username,
+    User.email,
+    User.created_at,
+    User.updated_at,
+)
+
+
+class TodoRow(TypedDict):
+    id: int
+    title: str
+    description: str
+    state: TodoState
+    created_at: datetime
+    updated_at: datetime
+
+
+class UserRow(TypedDict):
+    id: int
+    username: str
+    email: str
+    created_at: datetime
+    updated_at: datetime
+
+
+class TodosPage(TypedDict):
+    todos: list[TodoRow]
+    next_cursor: str | None
+
+
+class UsersPage(TypedDict):
+    users: list[UserRow]
+    next_cursor: str | None
+
+
+# montados uma única vez, no import
+todo_row_adapter = TypeAdapter(TodoRow)
+todos_page_adapter = TypeAdapter(TodosPage)
+users_page_adapter = TypeAdapter(UsersPage)
+
+
+def json_response(
+    adapter: TypeAdapter,
+    content,
+    headers: dict | None = None,
+    status_code: int = HTTPStatus.OK,
+) -> Response:
+    """_summary_
+
+    Args:
+        adapter (TypeAdapter): adapter of the response shape
+        content: rows already read from the database, as dicts
+        headers (dict | None): extra response headers
+        status_code (int): response status
+
+    Returns:
+        Response: JSON body serialized straight from the rows, without
+        validating them again through the response_model
+    """
+    return Response(
+        adapter.dump_json(content),
+        status_code=status_code,
+        media_type='application/json',
+        headers=headers,
+    )
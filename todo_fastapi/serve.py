@@ -0,0 +1,118 @@
+"""Production launcher of the API.
+
+Runs uvicorn with one worker per available CPU, the uvloop event loop and
+the httptools parser. On SIGTERM each worker stops accepting connections,
+waits for the in-flight requests up to SERVER_GRACEFUL_TIMEOUT and then
+runs the app lifespan shutdown.
+
+Each worker opens its own connection pool, so SERVER_DATABASE_CONNECTIONS
+is split between the workers: when DATABASE_POOL_SIZE plus
+DATABASE_MAX_OVERFLOW times the workers goes over it, both are scaled
+down for every worker. Keep it below max_connections of postgres.
+
+    python -m todo_fastapi.serve
+    python -m todo_fastapi.serve --workers 4 --port 8000
+"""
+
+import argparse
+import os
+import sys
+from tempfile import mkdtemp
+
+import uvicorn
+
+from todo_fastapi.metrics import clear_multiprocess_dir
+from todo_fastapi.settings import Settings, get_settings
+
+APP = 'todo_fastapi.main.app:app'
+
+
+def worker_count(settings: Settings) -> int:
+    # CPUs que o processo pode usar, não os da máquina inteira
+    return settings.SERVER_WORKERS or os.process_cpu_count() or 1
+
+
+def pool_budget(settings: Settings, workers: int) -> tuple[int, int]:
+    """_summary_
+
+    Args:
+        settings (Settings): pool options and SERVER_DATABASE_CONNECTIONS
+        workers (int): amount of uvicorn workers
+
+    Raises:
+        ValueError: the budget does not give each worker one connection
+
+    Returns:
+        tuple[int, int]: pool size and max overflow of each worker, the
+        configured ones when they fit in the budget
+    """
+    pool_size = settings.DATABASE_POOL_SIZE
+    max_overflow = settings.DATABASE_MAX_OVERFLOW
+    per_worker = settings.SERVER_DATABASE_CONNECTIONS // workers
+    if per_worker < 1:
+        raise ValueError(
+            f'SERVER_DATABASE_CONNECTIONS '
+            f'({settings.SERVER_DATABASE_CONNECTIONS}) is lower than the '
+            f'{workers} workers'
+        )
+    if pool_size + max_overflow <= per_worker:
+        return pool_size, max_overflow
+
+    # mantém a proporção entre conexões fixas e de pico
+    scaled_pool = round(per_worker * pool_size / (pool_size + max_overflow))
+    scaled_pool = max(scaled_pool, 1)
+    return scaled_pool, per_worker - scaled_pool
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    # cada worker tem o próprio pool, ver SERVER_DATABASE_CONNECTIONS
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--log-level', default='info')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = get_settings()
+    workers = args.workers or worker_count(settings)
+    try:
+        pool_size, max_overflow = pool_budget(settings, workers)
+    except ValueError as error:
+        sys.exit(str(error))
+    # os workers leem as opções do ambiente, como METRICS_MULTIPROC_DIR;
+    # com um worker a app roda neste processo e relê as settings
+    os.environ['DATABASE_POOL_SIZE'] = str(pool_size)
+    os.environ['DATABASE_MAX_OVERFLOW'] = str(max_overflow)
+    get_settings.cache_clear()
+
+    if settings.METRICS_MULTIPROC_DIR:
+        # diretório do operador, os arquivos da execução anterior não somam
+        clear_multiprocess_dir(settings.METRICS_MULTIPROC_DIR)
+    elif workers > 1:
+        # os workers são processos novos e leem o diretório do ambiente,
+        # um diretório vazio por execução não soma arquivos antigos
+        os.environ['METRICS_MULTIPROC_DIR'] = mkdtemp(prefix='todo_metrics_')
+
+    # cada worker importa a app do zero (spawn) e cria o próprio engine
+    # no lifespan, nenhuma conexão do pool atravessa processos
+    uvicorn.run(
+        APP,
+        host=args.host or settings.SERVER_HOST,
+        port=args.port or settings.SERVER_PORT,
+        workers=workers,
+        loop='uvloop',
+        http='httptools',
+        backlog=settings.SERVER_BACKLOG,
+        timeout_keep_alive=settings.SERVER_KEEP_ALIVE,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.SERVER_FORWARDED_ALLOW_IPS,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,115 @@
+import sys
+from functools import lru_cache
+from typing import Literal
+
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
-        env_file='.env', env_file_encoding='utf-8'
+        env_file='.env', env_file_encoding='utf-8', frozen=True
     )
 
     DATABASE_URL: str
     TOKEN_EXPIRE_TIME: int
     ALGORITHM: str
     SECRET_KEY: str
+
+    # pool de conexões do engine criado no lifespan da aplicação
+    DATABASE_POOL_SIZE: int = 10
+    DATABASE_MAX_OVERFLOW: int = 20
+    DATABASE_POOL_PRE_PING: bool = True
+    DATABASE_POOL_RECYCLE: int = 1800
+    # em milissegundos, 0 desativa o timeout
+    DATABASE_STATEMENT_TIMEOUT: int = 0
+
+    # réplicas de leitura, em JSON: '["postgresql+psycopg://..."]'
+    DATABASE_READ_URLS: tuple[str, ...] = ()
+    DATABASE_READ_BALANCE: Literal['round_robin', 'least_connections'] = (
+        'round_robin'
+    )
+    # segundos em que as leituras de quem escreveu vão para o primário
+    READ_YOUR_WRITES_WINDOW: float = 5
+
+    # threads dedicadas ao hash de senhas (argon2) e limite da fila de espera
+    PWD_HASH_WORKERS: int = 2
+    PWD_HASH_MAX_QUEUE: int = 64
+
+    # cache dos usuários autenticados, em memória ou redis se houver url
+    PRINCIPAL_CACHE_SIZE: int = 10_000
+    PRINCIPAL_CACHE_TTL: int = 60
+    PRINCIPAL_CACHE_URL: str | None = None
+    # rotas de todos autenticadas só pelo token (claims uid e ver), sem
+    # consultar users; as versões em memória são relidas nesse intervalo
+    STATELESS_AUTH: bool = False
+    TOKEN_VERSION_REFRESH_INTERVAL: float = 30
+
+    # máximo de todos por requisição nas rotas /todos/bulk
+    TODO_BULK_MAX_ITEMS: int = 500
+
+    # contagem e tempo das queries por requisição (header Server-Timing)
+    QUERY_INSTRUMENTATION: bool = False
+    QUERY_LOG_REQUESTS: bool = False
+    SLOW_QUERY_THRESHOLD_MS: float = 200
+
+    # diretório compartilhado entre os workers do uvicorn para o /metrics
+    METRICS_MULTIPROC_DIR: str | None = None
+    METRICS_FLUSH_INTERVAL: float = 5
+
+    # segundos que o token de /todos/changes volta no tempo, cobre
+    # transações que começaram antes dele e terminaram depois
+    SYNC_TOKEN_SKEW: int = 5
+    # dias que os tombstones ficam guardados, a limpeza roda a cada
+    # intervalo (segundos); um token mais antigo que a retenção recebe 410
+    # e o cliente sincroniza do zero
+    SYNC_TOMBSTONE_RETENTION_DAYS: int = 30
+    SYNC_TOMBSTONE_PRUNE_INTERVAL: float = 3600
+
+    # linhas validadas e gravadas por vez em /todos/import e o máximo de
+    # erros detalhados no relatório
+    TODO_IMPORT_BATCH_SIZE: int = 1000
+    TODO_IMPORT_MAX_ERRORS: int = 1000
+
+    # partições por hash de user_id da tabela todos (postgres), usado pela
+    # migration e por python -m todo_fastapi.partitioning
+    TODO_PARTITIONS: int = 16
+
+    # diretório dos logs de escrita adiada (Prefer: respond-async), sem ele
+    # todas as escritas são síncronas; não disponível no Windows
+    WRITE_BEHIND_DIR: str | None = None
+    WRITE_BEHIND_LOG_SIZE: int = 16 * 1024 * 1024
+    WRITE_BEHIND_FLUSH_INTERVAL: float = 0.05
+    WRITE_BEHIND_MAX_BATCH: int = 500
+
+    # servidor de produção (python -m todo_fastapi.serve), sem
+    # SERVER_WORKERS sobe um worker por CPU disponível
+    SERVER_HOST: str = '0.0.0.0'
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int | None = None
+    # conexões (pool + overflow) de todos os workers juntos em cada banco,
+    # o serve divide entre os workers; abaixo do max_connections padrão do
+    # postgres (100), com folga para migrations e manutenção
+    SERVER_DATABASE_CONNECTIONS: int = 90
+    SERVER_BACKLOG: int = 4096
+    # maior que o idle timeout do proxy, quem fecha a conexão é o proxy
+    SERVER_KEEP_ALIVE: int = 75
+    SERVER_GRACEFUL_TIMEOUT: int = 30
+    SERVER_FORWARDED_ALLOW_IPS: str = '127.0.0.1'
+
+    @field_validator('WRITE_BEHIND_DIR')
+    @classmethod
+    def check_write_behind_platform(cls, value: str | None) -> str | None:
+        # os logs são travados com fcntl.flock, que não existe no Windows
+        if value is not None and sys.platform == 'win32':
+            raise ValueError('WRITE_BEHIND_DIR is not supported on Windows')
+        return value
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Reads .env and the environment only once per process.
+
+    Used as a dependency, so tests can swap it in app.dependency_overrides.
+    """
+    return Settings()
@@ -0,0 +1,173 @@
+"""Per-user change feed of the todos, for incremental sync.
+
+A deleted todo leaves a tombstone, so the next sync sends the deletion.
+Tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS are pruned by a task
+of each worker. A sync token older than that window could miss deletions,
+so /todos/changes answers 410 Gone and the client has to resync from
+scratch, calling it again without a token.
+"""
+
+import asyncio
+import json
+import logging
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from todo_fastapi.models.models_db import Todo, TodoTombstone
+from todo_fastapi.schema.schemas import TodoPublic
+
+logger = logging.getLogger('todo_fastapi.sync')
+
+# linhas buscadas por vez do cursor do banco durante o stream
+CHANGES_YIELD_PER = 500
+
+
+def encode_sync_token(moment: datetime) -> str:
+    # mesmo formato opaco dos cursores de paginação
+    token = f'ts:{moment.isoformat()}'.encode()
+    return urlsafe_b64encode(token).decode().rstrip('=')
+
+
+def invalid_sync_token() -> HTTPException:
+    return HTTPException(
+        detail='invalid sync token', status_code=HTTPStatus.BAD_REQUEST
+    )
+
+
+def decode_sync_token(token: str) -> datetime:
+    try:
+        padding = '=' * (-len(token) % 4)
+        key, value = urlsafe_b64decode(token + padding).decode().split(':', 1)
+        if key != 'ts':
+            raise ValueError(key)
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise invalid_sync_token()
+
+    # as colunas e o relógio do banco não têm fuso, um token com offset
+    # não é comparável com eles
+    if moment.tzinfo is not None:
+        raise invalid_sync_token()
+    return moment
+
+
+async def database_now(session: AsyncSession) -> datetime:
+    # o relógio do banco é o mesmo que preenche updated_at e deleted_at
+    if session.bind.dialect.name == 'postgresql':
+        # sem fuso, igual às colunas timestamp dos modelos
+        return await session.scalar(select(literal_column('LOCALTIMESTAMP')))
+    return await session.scalar(select(func.now()))
+
+
+def changed_since(column, since: datetime, dialect_name: str):
+    # o sqlite guarda CURRENT_TIMESTAMP como texto sem fração de segundo,
+    # o parâmetro passa pelo mesmo formato para a comparação de texto
+    if dialect_name == 'sqlite':
+        return column >= func.datetime(since)
+    return column >= since
+
+
+def check_sync_token_age(since: datetime, now: datetime, retention: timedelta):
+    # os tombstones anteriores já podem ter sido apagados, o cliente não
+    # veria essas remoções
+    if since < now - retention:
+        raise HTTPException(
+            detail='sync token expired, sync again without a token',
+            status_code=HTTPStatus.GONE,
+        )
+
+
+async def prune_tombstones(session: AsyncSession, retention: timedelta):
+    cutoff = await database_now(session) - retention
+    await session.execute(
+        delete(TodoTombstone).where(
+            ~changed_since(
+                TodoTombstone.deleted_at, cutoff, session.bind.dialect.name
+            )
+        )
+    )
+    await session.commit()
+
+
+async def prune_tombstones_periodically(
+    engine: AsyncEngine, retention: timedelta, interval: float
+):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSession(engine) as session:
+                await prune_tombstones(session, retention)
+        except Exception:
+            # os tombstones só crescem até o próximo ciclo
+            logger.exception('tombstone pruning failed')
+
+
+async def record_tombstones(
+    session: AsyncSession, user_id: int, todo_ids: list[int]
+):
+    # DELETE direto não passa pelos eventos do ORM, ver models_db
+    if todo_ids:
+        await session.execute(
+            insert(TodoTombstone),
+            [{'todo_id': todo_id, 'user_id': user_id} for todo_id in todo_ids],
+        )
+
+
+async def todo_changes(
+    session: AsyncSession,
+    user_id: int,
+    since: datetime | None,
+    next_since: datetime,
+):
+    """_summary_
+
+    Args:
+        session (AsyncSession): session kept open while the response streams
+        user_id (int): owner of the todos
+        since (datetime | None): moment decoded from the client sync token,
+        None sends every todo of the user
+        next_since (datetime): moment of the next token, taken before the
+        reads and moved back by SYNC_TOKEN_SKEW to cover transactions that
+        started before it but committed after
+
+    Yields:
+        str: NDJSON lines, deletes first, then created or updated todos
+        and at last the token for the next call
+    """
+    next_token = encode_sync_token(next_since)
+    dialect_name = session.bind.dialect.name
+
+    if since is not None:
+        deleted = await session.stream_scalars(
+            select(TodoTombstone.todo_id)
+            .where(
+                TodoTombstone.user_id == user_id,
+                changed_since(TodoTombstone.deleted_at, since, dialect_name),
+            )
+            .order_by(TodoTombstone.deleted_at, TodoTombstone.id)
+            .execution_options(yield_per=CHANGES_YIELD_PER)
+        )
+        async for todo_id in deleted:
+            yield json.dumps({'op': 'delete', 'id': todo_id}) + '\n'
+
+    query = select(Todo).where(Todo.user_id == user_id)
+    if since is not None:
+        query = query.where(
+            changed_since(Todo.updated_at, since, dialect_name)
+        )
+
+    todos = await session.stream_scalars(
+        query.order_by(Todo.updated_at, Todo.id).execution_options(
+            yield_per=CHANGES_YIELD_PER
+        )
+    )
+    async for todo in todos:
+        public = TodoPublic.model_validate(todo, from_attributes=True)
+        yield f'{{"op":"upsert","todo":{public.model_dump_json()}}}\n'
+
+    yield json.dumps({'op': 'sync', 'token': next_token}) + '\n'
@@ -2,21 +2,26 @@ import asyncio
 import sys
 from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
 
 import pytest
 import pytest_asyncio
-from database import get_session
 from factory import faker, fuzzy
 from factory.base import Factory
 from factory.declarations import LazyAttribute, Sequence
 from fastapi.testclient import TestClient
-from main.app import app
-from models.models_db import Base, Todo, TodoState, User
-from security import get_pwd_hash
 from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from testcontainers.postgres import PostgresContainer
 
+from todo_fastapi.database import get_session
+from todo_fastapi.main.app import app
+from todo_fastapi.models.models_db import Base, Todo, TodoState, User
+from todo_fastapi.replicas import ReadReplicas
+from todo_fastapi.security import get_pwd_hash
+from todo_fastapi.token_versions import TokenVersions
+from todo_fastapi.write_behind import WriteAheadLog, WriteBehindQueue
+
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
@@ -63,6 +68,44 @@ async def session(engine):
         await eng.run_sync(Base.metadata.drop_all)
 
 
+# fila de escrita adiada no lugar da criada pelo lifespan, sem o flusher em
+# segundo plano, os testes chamam flush() quando precisam
+@pytest.fixture
+def write_behind(client, engine, tmp_path):
+    log = WriteAheadLog(tmp_path / 'test.wal', 64 * 1024)
+    app.state.write_behind = WriteBehindQueue(engine, log)
+
+    yield app.state.write_behind
+
+    app.state.write_behind = None
+    log.close()
+
+
+# réplica de leitura num arquivo sqlite separado, começa só com as tabelas
+@pytest_asyncio.fixture
+async def replica(client, tmp_path):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "r.db"}')
+    async with engine.begin() as eng:
+        await eng.run_sync(Base.metadata.create_all)
+    app.state.replicas = ReadReplicas([engine], sticky_window=60)
+
+    yield engine
+
+    app.state.replicas = None
+    await engine.dispose()
+
+
+# versões de token do STATELESS_AUTH, sem a atualização em segundo plano,
+# os testes chamam refresh() quando precisam
+@pytest.fixture
+def token_versions(client, engine):
+    app.state.token_versions = TokenVersions(engine)
+
+    yield app.state.token_versions
+
+    app.state.token_versions = None
+
+
 # ------------------------------Mock_db_time-----------------------------------
 
 
@@ -90,6 +133,33 @@ def mock_db_time():
     return _mock_db_time
 
 
+# ------------------------------Query_counter----------------------------------
+
+
+# conta os comandos SQL enviados ao banco dentro do bloco "with"
+@contextmanager
+def _count_queries(engine):
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    event.listen(
+        engine.sync_engine, 'before_cursor_execute', before_cursor_execute
+    )
+
+    yield queries
+
+    event.remove(
+        engine.sync_engine, 'before_cursor_execute', before_cursor_execute
+    )
+
+
+@pytest.fixture
+def count_queries(engine):
+    return partial(_count_queries, engine)
+
+
 # ---------------------------------Fixed_time-------------------------------
 
 
@@ -1,19 +1,31 @@
 from http import HTTPStatus
+from time import time
 
+import pytest
+from fastapi import HTTPException
 from freezegun import freeze_time
 from jwt import decode
-from security import (
-    ALGORITHM,
-    SECRET_KEY,
-    TOKEN_EXPIRE_TIME,
+from sqlalchemy import delete, update
+
+from todo_fastapi.cache import MemoryPrincipalCache, RedisPrincipalCache
+from todo_fastapi.models.models_db import User
+from todo_fastapi.schema.schemas import UserPrincipal
+from todo_fastapi.security import (
+    PasswordHashPool,
     create_access_token,
+    get_pwd_hash,
+    verify_pwd,
 )
+from todo_fastapi.settings import get_settings
 
 
 def test_token_creation():
     data = {'test': 'test'}
     token = create_access_token(data)
-    decoded = decode(jwt=token, key=SECRET_KEY, algorithms=ALGORITHM)
+    settings = get_settings()
+    decoded = decode(
+        jwt=token, key=settings.SECRET_KEY, algorithms=settings.ALGORITHM
+    )
 
     assert decoded['test'] == data['test']
     assert 'exp' in decoded.keys()
@@ -89,7 +101,8 @@ def test_expired_token_after_time(client, user):
     assert response.status_code == HTTPStatus.OK
     token = response.json()['access_token']
 
-    with freeze_time(f'2026-01-01 00:{TOKEN_EXPIRE_TIME + 5}:00'):
+    expired_minute = get_settings().TOKEN_EXPIRE_TIME + 5
+    with freeze_time(f'2026-01-01 00:{expired_minute}:00'):
         response = client.get(
             '/users', headers={'Authorization': f'Bearer {token}'}
         )
@@ -107,3 +120,328 @@ def test_refresh_token(client, token):
     assert 'token_type' in response.json()
     assert 'access_token' in response.json()
     assert response.json()['token_type'] == 'Bearer'
+
+
+@pytest.mark.asyncio
+async def test_pwd_hash_pool_hashes_off_the_event_loop():
+    CALLS_AMOUNT = 2
+    pool = PasswordHashPool(max_workers=1, max_queue=1)
+
+    hashed = await pool.run(get_pwd_hash, 'secret')
+
+    assert await pool.run(verify_pwd, 'secret', hashed)
+    assert pool.wait_count == CALLS_AMOUNT
+    assert pool.pending == 0
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pwd_hash_pool_rejects_when_queue_is_full():
+    pool = PasswordHashPool(max_workers=1, max_queue=0)
+    pool.pending = 1
+
+    with pytest.raises(HTTPException) as exc:
+        await pool.run(get_pwd_hash, 'secret')
+
+    assert exc.value.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+
+def test_refresh_token_loads_only_the_principal(client, token, count_queries):
+    with count_queries() as queries:
+        client.post(
+            '/auth/refresh_token',
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    assert len(queries) == 1
+
+
+def test_cached_principal_skips_user_lookup(client, token, count_queries):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.post('/auth/refresh_token', headers=headers)
+
+    with count_queries() as queries:
+        response = client.post('/auth/refresh_token', headers=headers)
+
+    assert response.status_code == HTTPStatus.OK
+    assert queries == []
+
+
+def test_update_user_invalidates_cached_principal(client, user, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/users/', headers=headers)
+
+    client.put(
+        f'/users/{user.id}',
+        json={
+            'username': 'new_test',
+            'email': 'new_email@email.com',
+            'password': 'test123',
+        },
+        headers=headers,
+    )
+    # o token antigo aponta para um email que não existe mais
+    response = client.get('/users/', headers=headers)
+
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_memory_principal_cache_evicts_lru_and_expired():
+    cache = MemoryPrincipalCache(max_size=2, ttl=60)
+    principal = UserPrincipal(id=1, username='test', email='test@email.com')
+    expires_at = time() + 60
+
+    await cache.set('a', principal, expires_at)
+    await cache.set('b', principal, expires_at)
+    await cache.get('a')
+    await cache.set('c', principal, expires_at)
+
+    assert await cache.get('a') == principal
+    assert await cache.get('b') is None
+
+    await cache.set('d', principal, time() - 1)
+
+    assert await cache.get('d') is None
+
+
+class FakeRedis:
+    # mesmos comandos GET, SET ... EX e DEL do redis.asyncio, em memória
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        value, expires_at = self.data.get(key, (None, 0))
+        if expires_at <= time():
+            self.data.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key, value, ex):
+        # o redis devolve bytes
+        self.data[key] = (value.encode(), time() + ex)
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.mark.asyncio
+async def test_redis_principal_cache():
+    client = FakeRedis()
+    cache = RedisPrincipalCache(client, ttl=60)
+    principal = UserPrincipal(
+        id=1, username='test', email='test@email.com', token_version=3
+    )
+
+    with freeze_time('2026-01-01 12:00:00') as frozen:
+        await cache.set('a', principal, time() + 3600)
+        await cache.set('b', principal, time() + 10)
+        # token já expirado não entra no cache
+        await cache.set('c', principal, time() - 1)
+
+        assert await cache.get('a') == principal
+        assert 'principal:a' in client.data
+        assert await cache.get('c') is None
+
+        # o exp do token vale antes do ttl
+        frozen.tick(11)
+        assert await cache.get('b') is None
+        assert await cache.get('a') == principal
+
+        frozen.tick(50)
+        assert await cache.get('a') is None
+
+        await cache.set('a', principal, time() + 3600)
+        await cache.invalidate('a')
+        assert await cache.get('a') is None
+
+
+def test_token_carries_user_id_and_version(user, token):
+    settings = get_settings()
+    decoded = decode(token, settings.SECRET_KEY, settings.ALGORITHM)
+
+    assert decoded['uid'] == user.id
+    assert decoded['ver'] == user.token_version
+
+
+def test_stateless_auth_skips_user_lookup(
+    client, token, token_versions, count_queries
+):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/todos/', headers=headers)
+
+    with count_queries() as queries:
+        response = client.get('/todos/', headers=headers)
+
+    assert response.status_code == HTTPStatus.OK
+    assert not [query for query in queries if 'users' in query]
+
+
+def test_stateless_auth_accepts_tokens_without_claims(
+    client, user, token_versions
+):
+    token = create_access_token({'sub': user.email})
+
+    response = client.get(
+        '/todos/', headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.status_code == HTTPStatus.OK
+
+
+def test_update_user_revokes_stateless_tokens(
+    client, user, token, token_versions
+):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/todos/', headers=headers)
+
+    client.put(
+        f'/users/{user.id}',
+        json={
+            'username': user.username,
+            'email': user.email,
+            'password': 'new_password',
+        },
+        headers=headers,
+    )
+    response = client.get('/todos/', headers=headers)
+
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_revoked_token_rejected_on_user_routes(client, user, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.put(
+        f'/users/{user.id}',
+        json={
+            'username': user.username,
+            'email': user.email,
+            'password': 'new_password',
+        },
+        headers=headers,
+    )
+
+    # o refresh não pode trocar um token revogado por um novo
+    refresh = client.post('/auth/refresh_token', headers=headers)
+    users = client.get('/users/', headers=headers)
+
+    assert refresh.status_code == HTTPStatus.UNAUTHORIZED
+    assert users.status_code == HTTPStatus.UNAUTHORIZED
+
+
+async def bump_token_version(session, user):
+    # update feito por outro worker, que não passa pelo cache deste
+    user_id, email, version = user.id, user.email, user.token_version
+    await session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(token_version=version + 1)
+    )
+    await session.commit()
+    return create_access_token({
+        'sub': email,
+        'uid': user_id,
+        'ver': version + 1,
+    })
+
+
+@pytest.mark.asyncio
+async def test_new_token_accepted_with_stale_cached_principal(
+    session, client, user, token
+):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/users/', headers=headers)
+    new_token = await bump_token_version(session, user)
+
+    response = client.get(
+        '/users/', headers={'Authorization': f'Bearer {new_token}'}
+    )
+    # o principal relido do banco já revoga o token antigo
+    old = client.get('/users/', headers=headers)
+
+    assert response.status_code == HTTPStatus.OK
+    assert old.status_code == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_new_token_accepted_with_stale_token_versions(
+    session, client, user, token, token_versions
+):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/todos/', headers=headers)
+    new_token = await bump_token_version(session, user)
+
+    response = client.get(
+        '/todos/', headers={'Authorization': f'Bearer {new_token}'}
+    )
+    old = client.get('/todos/', headers=headers)
+
+    assert response.status_code == HTTPStatus.OK
+    assert old.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_token_with_other_user_id_rejected(client, user, other_user):
+    token = create_access_token({
+        'sub': user.email,
+        'uid': other_user.id,
+        'ver': user.token_version,
+    })
+
+    response = client.get(
+        '/users/', headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_token_versions_refresh(session, user, token_versions):
+    missing_user_id = user.id + 1
+    token_versions.set(user.id, 1)
+    token_versions.set(missing_user_id, 1)
+    # versão trocada por outro worker e usuário que não existe mais
+    await session.execute(
+        update(User).where(User.id == user.id).values(token_version=2)
+    )
+    await session.commit()
+
+    await token_versions.refresh()
+
+    assert not await token_versions.check(session, user.id, 1)
+    assert await token_versions.check(session, user.id, 2)
+    assert not await token_versions.check(session, missing_user_id, 1)
+
+
+@pytest.mark.asyncio
+async def test_token_versions_refresh_keeps_deleted_users(
+    session, user, token_versions
+):
+    # delete_user deste worker commitou depois do SELECT do refresh, que
+    # ainda encontrou o usuário
+    token_versions.set(user.id, None)
+
+    await token_versions.refresh()
+
+    assert not await token_versions.check(session, user.id, 1)
+
+
+@pytest.mark.asyncio
+async def test_stateless_create_todo_of_deleted_user(
+    session, client, user, token, token_versions
+):
+    # o sqlite não confere a FK de user_id
+    if session.bind.dialect.name != 'postgresql':
+        pytest.skip('foreign keys are only enforced on postgres')
+    user_id = user.id
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/todos/', headers=headers)
+    # apagado por outro worker, este ainda tem a versão do token no mapa
+    await session.execute(delete(User).where(User.id == user_id))
+    await session.commit()
+
+    response = client.post(
+        '/todos/', json={'title': 'a', 'description': 'a'}, headers=headers
+    )
+
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+    assert not await token_versions.check(session, user_id, 1)
@@ -0,0 +1,84 @@
+import json
+import os
+from http import HTTPStatus
+from time import time
+
+from todo_fastapi.metrics import Registry, clear_multiprocess_dir
+
+
+def test_metrics_counts_requests_by_route(client, token, todo):
+    client.delete(
+        f'/todos/{todo.id}',
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    client.get('/todos/', headers={'Authorization': 'Bearer invalid'})
+
+    response = client.get('/metrics')
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'].startswith('text/plain')
+    # a série usa o template da rota, não o id requisitado
+    assert (
+        'http_requests_total{method="DELETE",route="/todos/{todo_id}",'
+        'status="200"}' in response.text
+    )
+    assert 'http_request_duration_seconds_bucket{method="GET",' in (
+        response.text
+    )
+    assert 'jwt_decode_failures_total{reason="invalid"}' in response.text
+    assert '# TYPE pwd_hash_queue_seconds histogram' in response.text
+
+
+def test_metrics_merge_worker_files(tmp_path):
+    registry = Registry()
+    registry.multiprocess_dir = tmp_path
+    requests = registry.counter('requests_total', 'requests', ('route',))
+    latency = registry.histogram('latency_seconds', 'latency', buckets=(1,))
+
+    requests.inc('/todos/')
+    latency.observe(0.5)
+
+    # snapshot de outro worker, gravado com o mesmo formato do dump
+    other = Registry()
+    other.counter('requests_total', 'requests', ('route',)).inc(
+        '/todos/', amount=2
+    )
+    other.histogram('latency_seconds', 'latency', buckets=(1,)).observe(3)
+    (tmp_path / 'metrics_1.json').write_text(json.dumps(other.snapshot()))
+
+    text = registry.render()
+
+    assert 'requests_total{route="/todos/"} 3' in text
+    assert 'latency_seconds_bucket{le="1"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+    assert 'latency_seconds_count 2' in text
+
+
+def test_metrics_ignore_gauges_of_stopped_workers(tmp_path):
+    registry = Registry()
+    registry.multiprocess_dir = tmp_path
+    registry.stale_after = 15
+
+    # arquivo de um worker que caiu sem o dump final, com gauges
+    other = Registry()
+    other.counter('requests_total', 'requests').inc(amount=2)
+    other.gauge('checked_out', 'connections').set(7)
+    path = tmp_path / 'metrics_1.json'
+    path.write_text(json.dumps(other.snapshot()))
+    stale = time() - 60
+    os.utime(path, (stale, stale))
+
+    text = registry.render()
+
+    assert 'requests_total 2' in text
+    assert 'checked_out' not in text
+
+
+def test_clear_multiprocess_dir(tmp_path):
+    (tmp_path / 'metrics_1.json').write_text('{}')
+    (tmp_path / 'metrics_2.tmp').write_text('{}')
+    (tmp_path / 'other.txt').write_text('')
+
+    clear_multiprocess_dir(tmp_path)
+
+    assert [path.name for path in tmp_path.iterdir()] == ['other.txt']
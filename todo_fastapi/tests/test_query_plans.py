@@ -0,0 +1,150 @@
+import re
+
+import pytest
+from sqlalchemy import text
+
+from todo_fastapi.models.models_db import Todo, TodoState
+from todo_fastapi.pagination import encode_cursor, page_query
+from todo_fastapi.partitioning import PARTITION_NAME, partition_todos
+from todo_fastapi.routers.todo import filter_todos, update_state_query
+from todo_fastapi.schema.schemas import FilterTodo
+from todo_fastapi.search import search_todos
+from todo_fastapi.tests.conftest import RandomTodo, RandomUser
+
+USERS_AMOUNT = 20
+TODOS_PER_USER = 100
+
+# linhas do plano que indicam leitura da tabela inteira
+SEQUENTIAL_SCAN = re.compile(r'Seq Scan on todos|^SCAN todos( |$)')
+# user_id como condição de busca no índice, não como filtro das linhas
+POSTGRES_USER_ID_COND = re.compile(r'Index Cond: \(+user_id = ')
+SQLITE_USER_ID_SEARCH = r'USING (COVERING )?INDEX {index} \(user_id=\?'
+
+
+async def _seed(session):
+    users = RandomUser.create_batch(USERS_AMOUNT)
+    session.add_all(users)
+    await session.flush()
+
+    for user in users:
+        session.add_all(
+            RandomTodo.create_batch(TODOS_PER_USER, user_id=user.id)
+        )
+    await session.commit()
+
+    if session.bind.dialect.name == 'postgresql':
+        await session.execute(text('ANALYZE todos'))
+
+    return users
+
+
+async def _explain(session, query):
+    dialect = session.bind.dialect
+    sql = query.compile(
+        dialect=dialect, compile_kwargs={'literal_binds': True}
+    )
+
+    if dialect.name == 'postgresql':
+        # em tabelas pequenas o seq scan é sempre o mais barato, desligando
+        # ele o plano só cai em seq scan se nenhum índice atender a consulta
+        await session.execute(text('SET LOCAL enable_seqscan = off'))
+        plan = await session.execute(text(f'EXPLAIN {sql}'))
+    else:
+        plan = await session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))
+
+    return [row[-1] for row in plan]
+
+
+def _uses_index(plan: list[str], index: str) -> bool:
+    # sem os índices compostos o postgres ainda evita o seq scan pela
+    # todos_pkey, filtrando user_id linha a linha
+    if any(line.startswith('SEARCH') for line in plan):
+        search = re.compile(SQLITE_USER_ID_SEARCH.format(index=index))
+        return any(search.search(line) for line in plan)
+
+    return any(index in line for line in plan) and any(
+        POSTGRES_USER_ID_COND.search(line) for line in plan
+    )
+
+
+def _partitions(plan: list[str]) -> set[str]:
+    return {
+        match.group()
+        for line in plan
+        for match in PARTITION_NAME.finditer(line)
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ('filter_todo', 'index'),
+    [
+        (FilterTodo(), 'ix_todos_user_id_id'),
+        (FilterTodo(offset=50), 'ix_todos_user_id_id'),
+        (FilterTodo(cursor=encode_cursor(50)), 'ix_todos_user_id_id'),
+        (FilterTodo(state=TodoState.done), 'ix_todos_user_id_state_id'),
+        (
+            FilterTodo(state=TodoState.done, cursor=encode_cursor(50)),
+            'ix_todos_user_id_state_id',
+        ),
+        (FilterTodo(title='test'), 'ix_todos_user_id_id'),
+    ],
+)
+async def test_list_todos_query_uses_index(session, filter_todo, index):
+    users = await _seed(session)
+    query = page_query(
+        filter_todos(users[0].id, filter_todo), Todo.id, filter_todo
+    )
+
+    plan = await _explain(session, query)
+
+    assert not [line for line in plan if SEQUENTIAL_SCAN.search(line)], plan
+    assert _uses_index(plan, index), plan
+
+
+@pytest.mark.asyncio
+async def test_search_todos_query_uses_index(session):
+    users = await _seed(session)
+    query = search_todos(
+        filter_todos(users[0].id, FilterTodo()),
+        'test',
+        session.bind.dialect.name,
+    )
+
+    plan = await _explain(session, query.limit(10))
+
+    assert not [line for line in plan if SEQUENTIAL_SCAN.search(line)], plan
+
+
+@pytest.mark.asyncio
+async def test_list_todos_query_reads_one_partition(session):
+    if session.bind.dialect.name != 'postgresql':
+        pytest.skip('hash partitioning only exists on postgres')
+
+    connection = await session.connection()
+    await connection.run_sync(partition_todos, 4, 1_000)
+    await session.commit()
+    users = await _seed(session)
+    query = page_query(
+        filter_todos(users[0].id, FilterTodo()), Todo.id, FilterTodo()
+    )
+
+    plan = await _explain(session, query)
+
+    assert len(_partitions(plan)) == 1, plan
+
+
+@pytest.mark.asyncio
+async def test_patch_todo_state_query_writes_one_partition(session):
+    if session.bind.dialect.name != 'postgresql':
+        pytest.skip('hash partitioning only exists on postgres')
+
+    connection = await session.connection()
+    await connection.run_sync(partition_todos, 4, 1_000)
+    await session.commit()
+    users = await _seed(session)
+    query = update_state_query(1, users[0].id, {'state': TodoState.done})
+
+    plan = await _explain(session, query)
+
+    assert len(_partitions(plan)) == 1, plan
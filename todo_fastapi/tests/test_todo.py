@@ -1,9 +1,28 @@
+import csv
+import json
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
+from io import StringIO
 
 import pytest
 from factory import faker, fuzzy
 from factory.base import Factory
-from models.models_db import Todo, TodoState
+from sqlalchemy import select, update
+
+from todo_fastapi.counters import rebuild_counters
+from todo_fastapi.main.app import app
+from todo_fastapi.models.models_db import Todo, TodoState, TodoTombstone
+from todo_fastapi.settings import get_settings
+from todo_fastapi.sync import (
+    database_now,
+    encode_sync_token,
+    prune_tombstones,
+)
+from todo_fastapi.write_behind import (
+    WriteAheadLog,
+    WriteBehindQueue,
+    replay_logs,
+)
 
 # ---------------------------- testes de create ---------------------------
 
@@ -26,6 +45,21 @@ def test_create_todo(client, token):
     }
 
 
+def test_create_todo_query_count(client, token, count_queries):
+    # principal + INSERT ... RETURNING + versão + contador, sem SELECT de
+    # refresh
+    EXPECTED_QUERIES = 4
+
+    with count_queries() as queries:
+        client.post(
+            '/todos',
+            json={'title': 'test', 'description': 'test', 'state': 'todo'},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+
+
 # ---------------------------- testes de read ---------------------------
 
 
@@ -77,7 +111,8 @@ def test_read_todos_factory(todo, client, token, fixed_time_iso):
                 'created_at': fixed_time_iso,
                 'updated_at': fixed_time_iso,
             }
-        ]
+        ],
+        'next_cursor': None,
     }
 
 
@@ -108,6 +143,111 @@ async def test_read_todos_should_return_10_todos(session, client, token):
     assert len(response.json()['todos']) == TODOS_AMOUNT
 
 
+@pytest.mark.asyncio
+async def test_read_todos_does_not_load_all_user_todos(
+    session, client, token, count_queries
+):
+    # o principal não carrega os todos, então o custo não cresce com a conta
+    # principal + versão do ETag + página
+    EXPECTED_QUERIES = 3
+    session.add_all(RandomTodo.create_batch(50))
+    await session.commit()
+
+    with count_queries() as queries:
+        response = client.get(
+            '/todos/?limit=5', headers={'Authorization': f'Bearer {token}'}
+        )
+
+    assert response.status_code == HTTPStatus.OK
+    assert len(queries) == EXPECTED_QUERIES
+
+
+@pytest.mark.asyncio
+async def test_read_todos_not_modified(session, client, token, count_queries):
+    # principal já está no cache, só a versão é lida, sem buscar a página
+    EXPECTED_QUERIES = 1
+    session.add_all(RandomTodo.create_batch(5))
+    await session.commit()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get('/todos/?limit=2', headers=headers)
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+
+    with count_queries() as queries:
+        response = client.get(
+            '/todos/?limit=2', headers={**headers, 'If-None-Match': etag}
+        )
+
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers['ETag'] == etag
+    assert not response.content
+    assert len(queries) == EXPECTED_QUERIES
+
+    # outra página ou um todo novo mudam a tag
+    response = client.get(
+        '/todos/?limit=3', headers={**headers, 'If-None-Match': etag}
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    client.post(
+        '/todos/', json={'title': 't', 'description': 'd'}, headers=headers
+    )
+    response = client.get(
+        '/todos/?limit=2', headers={**headers, 'If-None-Match': etag}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['ETag'] != etag
+
+
+@pytest.mark.asyncio
+async def test_read_todos_etag_follows_writes_in_the_same_second(
+    session, client, token, todo
+):
+    headers = {'Authorization': f'Bearer {token}'}
+    updated_at = todo.updated_at
+    etag = client.get('/todos/', headers=headers).headers['ETag']
+
+    client.patch(f'/todos/{todo.id}', json={'title': 'b'}, headers=headers)
+    # escrita no mesmo segundo: count e updated_at iguais aos de antes
+    await session.execute(update(Todo).values(updated_at=updated_at))
+    await session.commit()
+    response = client.get(
+        '/todos/', headers={**headers, 'If-None-Match': etag}
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['todos'][0]['title'] == 'b'
+
+
+@pytest.mark.asyncio
+async def test_read_todos_with_cursor(session, client, token):
+    TODOS_AMOUNT = 15
+    LIMIT = 10
+    session.add_all(RandomTodo.create_batch(TODOS_AMOUNT))
+    await session.commit()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    first_page = client.get(f'/todos/?limit={LIMIT}', headers=headers).json()
+    second_page = client.get(
+        f'/todos/?limit={LIMIT}&cursor={first_page["next_cursor"]}',
+        headers=headers,
+    ).json()
+
+    ids = [todo['id'] for todo in first_page['todos'] + second_page['todos']]
+    assert ids == list(range(1, TODOS_AMOUNT + 1))
+    assert second_page['next_cursor'] is None
+
+
+def test_read_todos_with_invalid_cursor(client, token):
+    response = client.get(
+        '/todos/?cursor=invalid', headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json() == {'detail': 'invalid cursor'}
+
+
 # ---------------------------- testes de filtro ---------------------------
 
 
@@ -128,7 +268,8 @@ def test_title_in_todo_filter(client, token, todo, fixed_time_iso):
                 'created_at': fixed_time_iso,
                 'updated_at': fixed_time_iso,
             }
-        ]
+        ],
+        'next_cursor': None,
     }
 
 
@@ -149,7 +290,8 @@ def test_description_in_todo_filter(client, token, todo, fixed_time_iso):
                 'created_at': fixed_time_iso,
                 'updated_at': fixed_time_iso,
             }
-        ]
+        ],
+        'next_cursor': None,
     }
 
 
@@ -169,10 +311,61 @@ def test_state_in_todo_filter(client, token, todo, fixed_time_iso):
                 'created_at': fixed_time_iso,
                 'updated_at': fixed_time_iso,
             }
-        ]
+        ],
+        'next_cursor': None,
     }
 
 
+# ---------------------------- testes de busca ----------------------------
+
+
+@pytest.mark.asyncio
+async def test_search_todos_by_terms(session, client, token):
+    session.add_all([
+        RandomTodo(title='buy milk', description='at the market'),
+        RandomTodo(title='walk the dog', description='around the park'),
+        RandomTodo(title='milk the cow', description='at the farm'),
+    ])
+    await session.commit()
+
+    response = client.get(
+        '/todos/?q=milk', headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert {todo['title'] for todo in response.json()['todos']} == {
+        'buy milk',
+        'milk the cow',
+    }
+
+
+@pytest.mark.asyncio
+async def test_search_todos_with_filters(session, client, token):
+    session.add_all([
+        RandomTodo(title='buy milk', description='market', state='done'),
+        RandomTodo(title='milk the cow', description='farm', state='todo'),
+    ])
+    await session.commit()
+
+    response = client.get(
+        '/todos/?q=milk&state=todo',
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert [todo['title'] for todo in response.json()['todos']] == [
+        'milk the cow'
+    ]
+
+
+def test_search_todos_of_other_user(client, todo, other_token):
+    response = client.get(
+        f'/todos/?q={todo.title.split()[0]}',
+        headers={'Authorization': f'Bearer {other_token}'},
+    )
+
+    assert response.json()['todos'] == []
+
+
 # ---------------------------- testes de delete ---------------------------
 
 
@@ -201,6 +394,19 @@ def test_delete_other_user_todo(client, todo, token, other_token):
     assert response.json() == {'detail': 'not enough permission'}
 
 
+def test_delete_todo_query_count(client, token, todo, count_queries):
+    # principal + DELETE ... WHERE id AND user_id RETURNING + tombstone
+    # + versão + contador
+    EXPECTED_QUERIES = 5
+
+    with count_queries() as queries:
+        client.delete(
+            f'/todos/{todo.id}', headers={'Authorization': f'Bearer {token}'}
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+
+
 # ---------------------------- testes de patch ---------------------------
 
 
@@ -242,3 +448,732 @@ def test_patch_other_user_todo(client, todo, user, other_token):
     )
 
     assert response.json() == {'detail': 'not enough permission'}
+
+
+def test_patch_other_user_todo_keeps_todo(client, todo, token, other_token):
+    response = client.patch(
+        f'/todos/{todo.id}',
+        json={'title': 'stolen'},
+        headers={'Authorization': f'Bearer {other_token}'},
+    )
+
+    assert response.status_code == HTTPStatus.FORBIDDEN
+    assert (
+        client.get(
+            '/todos/', headers={'Authorization': f'Bearer {token}'}
+        ).json()['todos'][0]['title']
+        == todo.title
+    )
+
+
+def test_patch_todo_query_count(engine, client, token, todo, count_queries):
+    # principal + UPDATE com o state antigo no RETURNING + versão +
+    # contadores; o sqlite lê o state antigo num SELECT antes do UPDATE
+    EXPECTED_QUERIES = 4 if engine.dialect.name == 'postgresql' else 5
+    # o state do todo é aleatório, sem mudança de state não há contador
+    state = next(state for state in TodoState if state != todo.state)
+
+    with count_queries() as queries:
+        response = client.patch(
+            f'/todos/{todo.id}',
+            json={'state': state},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+    assert response.json()['state'] == state
+
+
+def test_patch_todo_title_query_count(client, token, todo, count_queries):
+    # principal + UPDATE ... WHERE id AND user_id RETURNING + versão
+    EXPECTED_QUERIES = 3
+
+    with count_queries() as queries:
+        client.patch(
+            f'/todos/{todo.id}',
+            json={'title': 'new_title'},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+
+
+# ---------------------------- testes de bulk -----------------------------
+
+
+def test_create_todos_bulk(client, token):
+    todos = [
+        {'title': f'test{num}', 'description': 'test', 'state': 'todo'}
+        for num in range(3)
+    ]
+
+    response = client.post(
+        '/todos/bulk',
+        json={'todos': todos},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.CREATED
+    assert [todo['title'] for todo in response.json()['todos']] == [
+        'test0',
+        'test1',
+        'test2',
+    ]
+
+
+def test_create_todos_bulk_single_insert(engine, client, token, count_queries):
+    # no sqlite a ordem do RETURNING não é garantida e o SQLAlchemy
+    # insere uma linha por comando para manter a ordem do payload
+    if engine.dialect.name != 'postgresql':
+        pytest.skip('multi-row INSERT ... RETURNING ordering is postgres only')
+    EXPECTED_QUERIES = 4
+    todo = {'title': 'test', 'description': 'test'}
+
+    with count_queries() as queries:
+        client.post(
+            '/todos/bulk',
+            json={'todos': [todo] * 3},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    # principal + um único INSERT para todas as linhas + versão +
+    # contadores
+    assert len(queries) == EXPECTED_QUERIES
+
+
+def test_create_todos_bulk_over_limit(client, token):
+    settings = get_settings().model_copy(update={'TODO_BULK_MAX_ITEMS': 1})
+    app.dependency_overrides[get_settings] = lambda: settings
+    todo = {'title': 'test', 'description': 'test'}
+
+    response = client.post(
+        '/todos/bulk',
+        json={'todos': [todo, todo]},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json() == {'detail': 'batch limited to 1 todos'}
+
+
+@pytest.mark.asyncio
+async def test_update_todos_bulk(session, client, token, todo, other_user):
+    other_todo = RandomTodo(user_id=other_user.id)
+    session.add(other_todo)
+    await session.commit()
+
+    response = client.patch(
+        '/todos/bulk',
+        json={'ids': [todo.id, other_todo.id, 999], 'state': 'done'},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {
+        'results': [
+            {'id': todo.id, 'detail': 'updated'},
+            {'id': other_todo.id, 'detail': 'not enough permission'},
+            {'id': 999, 'detail': 'todo not found'},
+        ]
+    }
+    assert (
+        client.get(
+            '/todos/?state=done', headers={'Authorization': f'Bearer {token}'}
+        ).json()['todos'][0]['id']
+        == todo.id
+    )
+
+
+@pytest.mark.asyncio
+async def test_delete_todos_bulk(session, client, token, todo, other_user):
+    other_todo = RandomTodo(user_id=other_user.id)
+    session.add(other_todo)
+    await session.commit()
+
+    response = client.request(
+        'DELETE',
+        '/todos/bulk',
+        json={'ids': [todo.id, other_todo.id, 999]},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.json() == {
+        'results': [
+            {'id': todo.id, 'detail': 'deleted'},
+            {'id': other_todo.id, 'detail': 'not enough permission'},
+            {'id': 999, 'detail': 'todo not found'},
+        ]
+    }
+    assert (
+        client.get(
+            '/todos/', headers={'Authorization': f'Bearer {token}'}
+        ).json()['todos']
+        == []
+    )
+
+
+def test_update_todos_bulk_query_count(client, token, todo, count_queries):
+    # principal + SELECT FOR UPDATE dos states + UPDATE + versão +
+    # contadores
+    EXPECTED_QUERIES = 5
+    # o state do todo é aleatório, sem mudança de state não há contador
+    state = next(state for state in TodoState if state != todo.state)
+
+    with count_queries() as queries:
+        client.patch(
+            '/todos/bulk',
+            json={'ids': [todo.id], 'state': state},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+
+
+def test_delete_todos_bulk_query_count(client, token, todo, count_queries):
+    # principal + DELETE ... RETURNING + tombstones de todos os ids
+    # + versão + contadores
+    EXPECTED_QUERIES = 5
+
+    with count_queries() as queries:
+        client.request(
+            'DELETE',
+            '/todos/bulk',
+            json={'ids': [todo.id]},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+
+
+# ------------------------- testes de sincronização -------------------------
+
+
+def read_changes(client, token, since=None):
+    response = client.get(
+        '/todos/changes',
+        params={'since': since} if since else None,
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'] == 'application/x-ndjson'
+
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_read_todo_changes_without_token(client, token, todo):
+    changes = read_changes(client, token)
+
+    assert [change['op'] for change in changes] == ['upsert', 'sync']
+    assert changes[0]['todo']['id'] == todo.id
+    assert changes[-1]['token']
+
+
+def test_read_todo_changes_since_token(client, token, todo):
+    EXPECTED_CHANGES = 3
+    settings = get_settings().model_copy(update={'SYNC_TOKEN_SKEW': 0})
+    app.dependency_overrides[get_settings] = lambda: settings
+    headers = {'Authorization': f'Bearer {token}'}
+    since = read_changes(client, token)[-1]['token']
+
+    client.delete(f'/todos/{todo.id}', headers=headers)
+    created = client.post(
+        '/todos/', json={'title': 't', 'description': 'd'}, headers=headers
+    ).json()
+
+    changes = read_changes(client, token, since)
+
+    # remoções primeiro, depois as criações e alterações
+    assert changes[0] == {'op': 'delete', 'id': todo.id}
+    assert changes[1] == {'op': 'upsert', 'todo': created}
+    assert changes[-1]['op'] == 'sync'
+    assert len(changes) == EXPECTED_CHANGES
+
+
+@pytest.mark.asyncio
+async def test_user_cascade_records_tombstones(session, client, user, token):
+    TODOS_AMOUNT = 3
+    session.add_all(RandomTodo.create_batch(TODOS_AMOUNT, user_id=user.id))
+    await session.commit()
+    session.expunge_all()
+
+    client.delete(
+        f'/users/{user.id}', headers={'Authorization': f'Bearer {token}'}
+    )
+
+    tombstones = await session.scalars(
+        select(TodoTombstone.user_id).where(TodoTombstone.user_id == user.id)
+    )
+    assert len(tombstones.all()) == TODOS_AMOUNT
+
+
+@pytest.mark.parametrize(
+    'since',
+    [
+        'invalid',
+        encode_sync_token(datetime(2026, 1, 1, tzinfo=timezone.utc)),
+    ],
+)
+def test_read_todo_changes_invalid_token(client, token, since):
+    response = client.get(
+        '/todos/changes',
+        params={'since': since},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json() == {'detail': 'invalid sync token'}
+
+
+def test_read_todo_changes_expired_token(client, token):
+    # anterior à retenção, os tombstones desse período já podem ter saído
+    since = encode_sync_token(datetime(2000, 1, 1))
+
+    response = client.get(
+        '/todos/changes',
+        params={'since': since},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.GONE
+    assert response.json() == {
+        'detail': 'sync token expired, sync again without a token'
+    }
+
+
+@pytest.mark.asyncio
+async def test_prune_tombstones(session, user):
+    RETENTION = timedelta(days=30)
+    now = await database_now(session)
+    session.add_all([
+        TodoTombstone(
+            todo_id=1, user_id=user.id, deleted_at=now - 2 * RETENTION
+        ),
+        TodoTombstone(todo_id=2, user_id=user.id, deleted_at=now),
+    ])
+    await session.commit()
+
+    await prune_tombstones(session, RETENTION)
+
+    kept = await session.scalars(select(TodoTombstone.todo_id))
+    assert kept.all() == [2]
+
+
+# --------------------------- testes de export ----------------------------
+
+
+@pytest.mark.asyncio
+async def test_export_todos_ndjson(session, client, token, user):
+    session.add_all(RandomTodo.create_batch(3, state=TodoState.done))
+    session.add_all(RandomTodo.create_batch(2, state=TodoState.draft))
+    await session.commit()
+
+    response = client.get(
+        '/todos/export?state=done',
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    todos = [json.loads(line) for line in response.text.splitlines()]
+    assert [todo['state'] for todo in todos] == ['done'] * 3
+    assert todos == sorted(todos, key=lambda todo: todo['id'])
+
+
+def test_export_todos_csv(client, token, todo):
+    response = client.get(
+        '/todos/export?format=csv',
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'].startswith('text/csv')
+    assert 'todos.csv' in response.headers['content-disposition']
+    rows = list(csv.DictReader(StringIO(response.text)))
+    assert rows == [
+        {
+            'id': str(todo.id),
+            'title': todo.title,
+            'description': todo.description,
+            'state': todo.state.value,
+            'created_at': todo.created_at.isoformat(),
+            'updated_at': todo.updated_at.isoformat(),
+        }
+    ]
+
+
+# --------------------------- testes de import ----------------------------
+
+
+@pytest.mark.asyncio
+async def test_import_todos_ndjson(session, client, token, user):
+    IMPORTED = 2
+    content = (
+        '{"title": "a", "description": "a"}\n'
+        'not json\n'
+        '\n'
+        '{"title": "b", "description": "b", "state": "done"}\n'
+        '{"title": "c", "description": "c", "state": "invalid"}\n'
+    )
+
+    response = client.post(
+        '/todos/import',
+        files={'file': ('todos.ndjson', content)},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    report = response.json()
+    assert report['imported'] == IMPORTED
+    assert report['error_count'] == len(report['errors'])
+    assert [error['line'] for error in report['errors']] == [2, 5]
+    assert report['errors'][0]['detail'] == 'invalid json'
+    assert report['errors'][1]['detail'].startswith('state:')
+
+    todos = await session.scalars(
+        select(Todo).where(Todo.user_id == user.id).order_by(Todo.id)
+    )
+    assert [(t.title, t.state) for t in todos] == [
+        ('a', TodoState.todo),
+        ('b', TodoState.done),
+    ]
+
+
+def test_import_todos_csv(client, token):
+    content = 'title,description,state\na,a,\nb,b,doing\nc,,draft\n'
+
+    response = client.post(
+        '/todos/import?format=csv',
+        files={'file': ('todos.csv', content)},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.json()['imported'] == len(['a', 'b'])
+    assert response.json()['errors'] == [
+        {'line': 4, 'detail': 'description: Field required'}
+    ]
+
+
+def test_import_todos_invalid_utf8(client, token):
+    ndjson = (
+        b'{"title": "a", "description": "a"}\n'
+        b'{"title": "\xff\xfe", "description": "b"}\n'
+        b'{"title": "c", "description": "c"}\n'
+    )
+    csv_content = b'title,description\na,a\n"\xff\nb",b\nc,c\n'
+
+    responses = [
+        client.post(
+            f'/todos/import?format={format}',
+            files={'file': (f'todos.{format}', content)},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        for format, content in (('ndjson', ndjson), ('csv', csv_content))
+    ]
+
+    assert [response.status_code for response in responses] == [
+        HTTPStatus.OK,
+        HTTPStatus.OK,
+    ]
+    assert [response.json()['imported'] for response in responses] == [2, 2]
+    assert [response.json()['errors'] for response in responses] == [
+        [{'line': 2, 'detail': 'invalid utf-8'}],
+        [{'line': 4, 'detail': 'invalid utf-8'}],
+    ]
+
+
+def test_import_todos_job(client, token, other_token):
+    TODOS_AMOUNT = 3
+    content = ''.join(
+        f'{{"title": "t{i}", "description": "d"}}\n'
+        for i in range(TODOS_AMOUNT)
+    )
+
+    response = client.post(
+        '/todos/import/jobs',
+        files={'file': ('todos.ndjson', content)},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.ACCEPTED
+    job = response.json()
+    assert job['status'] == 'pending'
+
+    # o TestClient roda as background tasks antes de devolver a resposta
+    response = client.get(
+        f'/todos/import/jobs/{job["id"]}',
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.json() == {
+        'id': job['id'],
+        'status': 'done',
+        'imported': TODOS_AMOUNT,
+        'error_count': 0,
+        'errors': [],
+    }
+
+    response = client.get(
+        f'/todos/import/jobs/{job["id"]}',
+        headers={'Authorization': f'Bearer {other_token}'},
+    )
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.json() == {'detail': 'import job not found'}
+
+
+def test_import_todos_job_failure_hides_exception(client, token, monkeypatch):
+    async def broken_write(*args):
+        raise RuntimeError('connection to 10.0.0.5 lost')
+
+    monkeypatch.setattr('todo_fastapi.importer.write_todos', broken_write)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    job = client.post(
+        '/todos/import/jobs',
+        files={'file': ('todos.ndjson', '{"title": "a", "description": "a"}')},
+        headers=headers,
+    ).json()
+    response = client.get(f'/todos/import/jobs/{job["id"]}', headers=headers)
+
+    assert response.json()['status'] == 'failed'
+    assert response.json()['errors'] == [
+        {'line': 0, 'detail': 'import failed'}
+    ]
+
+
+# ---------------------------- testes de stats ----------------------------
+
+
+def test_todo_stats_follow_writes(client, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    created = client.post(
+        '/todos/bulk',
+        json={
+            'todos': [
+                {'title': 'a', 'description': 'a', 'state': 'draft'},
+                {'title': 'b', 'description': 'b', 'state': 'draft'},
+                {'title': 'c', 'description': 'c', 'state': 'doing'},
+            ]
+        },
+        headers=headers,
+    ).json()['todos']
+    client.post(
+        '/todos/', json={'title': 'd', 'description': 'd'}, headers=headers
+    )
+
+    client.patch(
+        f'/todos/{created[0]["id"]}', json={'state': 'done'}, headers=headers
+    )
+    client.delete(f'/todos/{created[2]["id"]}', headers=headers)
+
+    response = client.get('/todos/stats', headers=headers)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {
+        'draft': 1,
+        'doing': 0,
+        'done': 1,
+        'todo': 1,
+        'trash': 0,
+        'total': 3,
+    }
+
+
+@pytest.mark.asyncio
+async def test_rebuild_counters(session, client, token, user):
+    TODOS_AMOUNT = 4
+    # inseridos direto no banco, sem passar pelos contadores
+    session.add_all(
+        RandomTodo.create_batch(TODOS_AMOUNT, state=TodoState.trash)
+    )
+    await session.commit()
+
+    await rebuild_counters(session, user.id)
+
+    response = client.get(
+        '/todos/stats', headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.json()['trash'] == TODOS_AMOUNT
+    assert response.json()['total'] == TODOS_AMOUNT
+
+
+# ------------------------- testes de escrita adiada -----------------------
+
+
+@pytest.mark.asyncio
+async def test_update_todo_write_behind(session, client, token, write_behind):
+    headers = {'Authorization': f'Bearer {token}'}
+    todo_id = client.post(
+        '/todos/',
+        json={'title': 'a', 'description': 'a', 'state': 'draft'},
+        headers=headers,
+    ).json()['id']
+    etag = client.get('/todos', headers=headers).headers['etag']
+
+    response = client.patch(
+        f'/todos/{todo_id}',
+        json={'state': 'done'},
+        headers={**headers, 'Prefer': 'respond-async'},
+    )
+
+    assert response.status_code == HTTPStatus.ACCEPTED
+    assert response.headers['preference-applied'] == 'respond-async'
+    assert response.json()['state'] == 'done'
+    # ainda só no log, as leituras veem pelo overlay
+    assert await session.scalar(select(Todo.state)) == TodoState.draft
+    listed = client.get('/todos', headers=headers)
+    assert listed.json()['todos'][0]['state'] == 'done'
+    assert listed.headers['etag'] != etag
+
+    await write_behind.flush()
+
+    assert await session.scalar(select(Todo.state)) == TodoState.done
+    assert not write_behind.pending
+    stats = client.get('/todos/stats', headers=headers).json()
+    assert stats['draft'] == 0
+    assert stats['done'] == 1
+
+
+@pytest.mark.asyncio
+async def test_update_todo_write_behind_merges_writes(
+    session, client, token, todo, write_behind
+):
+    headers = {'Authorization': f'Bearer {token}', 'Prefer': 'respond-async'}
+
+    client.patch(f'/todos/{todo.id}', json={'title': 'a'}, headers=headers)
+    client.patch(f'/todos/{todo.id}', json={'state': 'doing'}, headers=headers)
+
+    assert write_behind.pending == {
+        todo.id: {
+            'user_id': todo.user_id,
+            'values': {'title': 'a', 'state': 'doing'},
+        }
+    }
+
+    # a escrita síncrona manda as pendentes antes para o banco
+    response = client.patch(
+        f'/todos/{todo.id}',
+        json={'title': 'b'},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert not write_behind.pending
+    stored = await session.execute(select(Todo.title, Todo.state))
+    assert stored.one() == ('b', TodoState.doing)
+
+
+def test_update_todo_write_behind_other_user(
+    client, todo, other_token, write_behind
+):
+    response = client.patch(
+        f'/todos/{todo.id}',
+        json={'state': 'done'},
+        headers={
+            'Authorization': f'Bearer {other_token}',
+            'Prefer': 'respond-async',
+        },
+    )
+
+    assert response.status_code == HTTPStatus.FORBIDDEN
+    assert not write_behind.pending
+
+
+@pytest.mark.asyncio
+async def test_replay_write_behind_logs(session, engine, todo, tmp_path):
+    size = 64 * 1024
+    # log de um worker que caiu antes do flush
+    log = WriteAheadLog(tmp_path / '1234.wal', size)
+    queue = WriteBehindQueue(engine, log)
+    await queue.submit(todo.id, todo.user_id, {'title': 'old'})
+    await queue.submit(todo.id, todo.user_id, {'title': 'replayed'})
+    log.close()
+
+    await replay_logs(engine, tmp_path, size)
+
+    assert await session.scalar(select(Todo.title)) == 'replayed'
+    assert not list(tmp_path.glob('*.wal'))
+
+
+@pytest.mark.parametrize('field', ['title', 'description', 'state'])
+def test_update_todo_write_behind_rejects_null(
+    client, token, todo, write_behind, field
+):
+    response = client.patch(
+        f'/todos/{todo.id}',
+        json={field: None},
+        headers={
+            'Authorization': f'Bearer {token}',
+            'Prefer': 'respond-async',
+        },
+    )
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert not write_behind.pending
+
+
+@pytest.mark.asyncio
+async def test_update_todo_write_behind_falls_back_when_log_is_full(
+    session, client, token, todo, write_behind
+):
+    # maior que o log inteiro, não cabe nem depois do flush
+    title = 'a' * 70_000
+
+    response = client.patch(
+        f'/todos/{todo.id}',
+        json={'title': title},
+        headers={
+            'Authorization': f'Bearer {token}',
+            'Prefer': 'respond-async',
+        },
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert 'preference-applied' not in response.headers
+    assert not write_behind.pending
+    assert await session.scalar(select(Todo.title)) == title
+
+
+@pytest.mark.asyncio
+async def test_write_behind_dead_letters_invalid_updates(
+    session, user, todo, write_behind
+):
+    other = RandomTodo(user_id=user.id)
+    session.add(other)
+    await session.commit()
+
+    # burlando a validação da rota, como num log gravado antes dela
+    await write_behind.submit(todo.id, user.id, {'title': None})
+    await write_behind.submit(other.id, user.id, {'title': 'flushed'})
+    await write_behind.flush()
+
+    assert not write_behind.pending
+    assert write_behind.log.position == write_behind.log.start
+    stored = await session.scalar(
+        select(Todo.title).where(Todo.id == other.id)
+    )
+    assert stored == 'flushed'
+    dead = write_behind.log.path.with_suffix('.dead').read_text()
+    assert json.loads(dead) == {
+        'todo_id': todo.id,
+        'user_id': user.id,
+        'values': {'title': None},
+    }
+
+
+@pytest.mark.asyncio
+async def test_replay_write_behind_logs_keeps_failed_log(
+    engine, todo, tmp_path, monkeypatch
+):
+    size = 64 * 1024
+    log = WriteAheadLog(tmp_path / '1234.wal', size)
+    queue = WriteBehindQueue(engine, log)
+    await queue.submit(todo.id, todo.user_id, {'title': 'replayed'})
+    log.close()
+
+    async def unreachable(self, batch):
+        raise ConnectionRefusedError
+
+    monkeypatch.setattr(WriteBehindQueue, '_write', unreachable)
+    await replay_logs(engine, tmp_path, size)
+
+    # fica para a próxima subida, sem derrubar o startup
+    assert (tmp_path / '1234.wal').exists()
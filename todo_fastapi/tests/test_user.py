@@ -1,5 +1,10 @@
 from http import HTTPStatus
 
+import pytest
+from sqlalchemy import delete
+
+from todo_fastapi.models.models_db import User
+
 
 def test_create_user(client):
     response = client.post(
@@ -21,6 +26,23 @@ def test_create_user(client):
     assert response.status_code == HTTPStatus.CREATED
 
 
+def test_create_user_query_count(client, count_queries):
+    # checagem de username/email + INSERT ... RETURNING
+    EXPECTED_QUERIES = 2
+
+    with count_queries() as queries:
+        client.post(
+            '/users',
+            json={
+                'username': 'victor',
+                'email': 'victor@email.com',
+                'password': 'senhavictor',
+            },
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+
+
 def test_create_user_integrity_error_username(client, user):
     response = client.post(
         '/users/',
@@ -62,11 +84,26 @@ def test_read_users(client, user, token, fixed_time_iso):
                 'created_at': fixed_time_iso,
                 'updated_at': fixed_time_iso,
             }
-        ]
+        ],
+        'next_cursor': None,
     }
     assert response.status_code == HTTPStatus.OK
 
 
+def test_read_users_with_cursor(client, user, other_user, token):
+    headers = {'Authorization': f'Bearer {token}'}
+
+    first_page = client.get('/users/?limit=1', headers=headers).json()
+    second_page = client.get(
+        f'/users/?limit=1&cursor={first_page["next_cursor"]}',
+        headers=headers,
+    ).json()
+
+    assert first_page['users'][0]['id'] == user.id
+    assert second_page['users'][0]['id'] == other_user.id
+    assert second_page['next_cursor'] is None
+
+
 def test_update_user(client, user, token, fixed_time_iso):
     response = client.put(
         '/users/1',
@@ -164,6 +201,28 @@ def test_delete_user(client, user, token, fixed_time_iso):
     }
 
 
+@pytest.mark.asyncio
+async def test_update_user_deleted_concurrently(client, session, user, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    user_id = user.id
+    # principal no cache, o PUT não relê o usuário antes do UPDATE
+    client.get('/users/', headers=headers)
+    await session.execute(delete(User).where(User.id == user_id))
+    await session.commit()
+
+    response = client.put(
+        f'/users/{user_id}',
+        json={
+            'username': 'new_test',
+            'email': 'new_email@email.com',
+            'password': 'test123',
+        },
+        headers=headers,
+    )
+
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
 def test_update_other_user(client, other_user, token):
     response = client.put(
         f'/users/{other_user.id}',
@@ -186,3 +245,49 @@ def test_delete_other_user(client, other_user, token):
 
     assert response.json() == {'detail': 'not enough permission'}
     assert response.status_code == HTTPStatus.FORBIDDEN
+
+
+def test_update_user_query_count(client, session, user, token, count_queries):
+    EXPECTED_QUERIES = 3
+    # esvazia o identity map para contar as consultas como em produção
+    session.expunge_all()
+
+    with count_queries() as queries:
+        client.put(
+            f'/users/{user.id}',
+            json={
+                'username': 'new_test',
+                'email': 'new_email@email.com',
+                'password': 'test123',
+            },
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+
+
+def test_delete_user_query_count(client, session, user, token, count_queries):
+    # principal, usuário, todos do cascade, o DELETE, os contadores e a
+    # versão dos todos
+    EXPECTED_QUERIES = 6
+    session.expunge_all()
+
+    with count_queries() as queries:
+        client.delete(
+            f'/users/{user.id}', headers={'Authorization': f'Bearer {token}'}
+        )
+
+    assert len(queries) == EXPECTED_QUERIES
+
+
+def test_read_user_not_modified(client, user):
+    response = client.get(f'/users/{user.id}')
+    etag = response.headers['ETag']
+
+    response = client.get(
+        f'/users/{user.id}', headers={'If-None-Match': f'"other", {etag}'}
+    )
+
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers['ETag'] == etag
+    assert not response.content
@@ -0,0 +1,155 @@
+"""Token versions of the users, for the stateless authentication.
+
+With STATELESS_AUTH the todo routes trust the signature of the access
+token and only compare its "ver" claim with the token_version of the user
+id in "uid", kept in memory by each worker. A user update bumps the
+version and a deletion removes the user, revoking the tokens issued
+before, so the routes that only need the user id make no auth queries.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import suppress
+from itertools import batched
+
+from fastapi import Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from todo_fastapi.models.models_db import User
+from todo_fastapi.settings import Settings
+
+logger = logging.getLogger('todo_fastapi.token_versions')
+
+# ids por SELECT ... WHERE id IN (...) na atualização periódica
+REFRESH_CHUNK_SIZE = 1000
+
+
+class TokenVersions:
+    """In-process LRU map of user id to token_version.
+
+    A user missing from the map is read from the database once, deleted
+    users stay in it with the version None for good. Each worker keeps its
+    own map, so a token revoked through another worker is still accepted
+    here until the next refresh (at most `refresh_interval` seconds). A
+    token newer than the map re-reads the version before it is judged.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        max_size: int = 10_000,
+        refresh_interval: float = 30,
+    ):
+        self.engine = engine
+        self.max_size = max_size
+        self.refresh_interval = refresh_interval
+        self._versions: OrderedDict[int, int | None] = OrderedDict()
+        self._task = None
+
+    def __len__(self):
+        return len(self._versions)
+
+    def set(self, user_id: int, version: int | None):
+        self._versions[user_id] = version
+        self._versions.move_to_end(user_id)
+
+        # remove os usuários vistos há mais tempo
+        while len(self._versions) > self.max_size:
+            self._versions.popitem(last=False)
+
+    async def check(
+        self, session: AsyncSession, user_id: int, version: int
+    ) -> bool:
+        """_summary_
+
+        Args:
+            session (AsyncSession): session of the request, only used when
+            the user is not in the map yet
+            user_id (int): "uid" claim of the token
+            version (int): "ver" claim of the token
+
+        Returns:
+            bool: whether the token version is not older than the user
+            token_version
+        """
+        if version is None:
+            return False
+
+        current = self._versions.get(user_id)
+        # ausente do mapa ou token emitido depois de um update feito em
+        # outro worker, que este ainda não viu: lê a versão do banco
+        if user_id not in self._versions or (
+            current is not None and version > current
+        ):
+            current = await session.scalar(
+                select(User.token_version).where(User.id == user_id)
+            )
+            self.set(user_id, current)
+        else:
+            self._versions.move_to_end(user_id)
+
+        # só uma versão menor que a atual foi revogada
+        return current is not None and version >= current
+
+    async def refresh(self):
+        async with AsyncSession(self.engine) as session:
+            for chunk in batched(list(self._versions), REFRESH_CHUNK_SIZE):
+                rows = await session.execute(
+                    select(User.id, User.token_version).where(
+                        User.id.in_(chunk)
+                    )
+                )
+                found = dict(rows.all())
+                for user_id in chunk:
+                    if user_id not in self._versions:
+                        continue
+                    # a versão só sobe e a remoção é definitiva (ids não se
+                    # repetem), uma leitura que começou antes de um update
+                    # ou delete deste worker não traz a versão antiga de volta
+                    current = self._versions[user_id]
+                    if current is None:
+                        continue
+                    version = found.get(user_id)
+                    if version is not None:
+                        version = max(current, version)
+                    self._versions[user_id] = version
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # mantém as versões atuais e tenta no próximo ciclo
+                logger.exception('token versions refresh failed')
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+
+def create_token_versions(
+    engine: AsyncEngine, settings: Settings
+) -> TokenVersions | None:
+    if not settings.STATELESS_AUTH:
+        return None
+
+    token_versions = TokenVersions(
+        engine,
+        settings.PRINCIPAL_CACHE_SIZE,
+        settings.TOKEN_VERSION_REFRESH_INTERVAL,
+    )
+    token_versions.start()
+    return token_versions
+
+
+def get_token_versions(request: Request) -> TokenVersions | None:
+    # None quando STATELESS_AUTH está desligado
+    return request.app.state.token_versions
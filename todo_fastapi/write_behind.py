@@ -0,0 +1,397 @@
+"""Write-behind of todo updates, opted in per request.
+
+PATCH /todos/{id} with the header "Prefer: respond-async" answers 202 as
+soon as the update is in the worker write-ahead log, a memory-mapped file
+synced to disk on every append. A background task merges the pending
+updates by todo id and writes them to the database in batches. Logs left
+by a crashed worker are replayed on the next startup. Updates the
+database rejects are moved to a dead-letter file next to the log, so they
+do not hold back the rest of the queue.
+"""
+
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections import Counter, defaultdict
+from contextlib import suppress
+from pathlib import Path
+
+from fastapi import Request
+from sqlalchemy import select, update
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from todo_fastapi.counters import bump_counters
+from todo_fastapi.models.models_db import Todo, TodoState
+from todo_fastapi.settings import Settings
+
+logger = logging.getLogger('todo_fastapi.write_behind')
+
+# magic, versão, geração e início dos registros ainda não gravados no banco
+HEADER = struct.Struct('<4sIQQ')
+MAGIC = b'TWAL'
+VERSION = 1
+# tamanho, crc32 e geração de cada registro, seguidos do JSON
+RECORD = struct.Struct('<IIQ')
+# erros de uma linha do lote, tentar de novo não adianta
+INVALID_WRITE = (IntegrityError, DataError, ValueError)
+
+
+class WriteAheadLogFull(Exception):
+    pass
+
+
+class WriteAheadLog:
+    """Append-only log in a fixed size memory-mapped file.
+
+    Once every record is in the database the log goes back to the start
+    with a new generation, so the bytes of older records are ignored.
+    """
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self._file = path.open('a+b')
+        self._lock_file()
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        magic, version, generation, start = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            generation, start = 1, HEADER.size
+            self._write_header(generation, start)
+        self.generation, self.start = generation, start
+        self.position = start
+        for _record, end in self._scan():
+            self.position = end
+
+    def _lock_file(self):
+        # só existe em sistemas POSIX, Settings recusa WRITE_BEHIND_DIR no
+        # Windows antes de algum log ser aberto
+        import fcntl  # noqa: PLC0415
+
+        # o lock fica com o processo, um log travado é de um worker vivo
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            raise
+
+    def _write_header(self, generation: int, start: int):
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, generation, start)
+        self._map.flush(0, HEADER.size)
+
+    def _scan(self):
+        # para no primeiro registro incompleto, corrompido ou de uma
+        # geração anterior
+        position = self.start
+        while position + RECORD.size <= len(self._map):
+            length, crc, generation = RECORD.unpack_from(self._map, position)
+            begin = position + RECORD.size
+            payload = self._map[begin : begin + length]
+            if (
+                not length
+                or generation != self.generation
+                or len(payload) != length
+                or zlib.crc32(payload) != crc
+            ):
+                return
+            position = begin + length
+            yield json.loads(payload), position
+
+    def records(self) -> list[dict]:
+        return [record for record, _end in self._scan()]
+
+    def append(self, record: dict) -> tuple[int, int]:
+        payload = json.dumps(record, separators=(',', ':')).encode()
+        end = self.position + RECORD.size + len(payload)
+        if end > len(self._map):
+            raise WriteAheadLogFull(self.path)
+
+        start = self.position
+        RECORD.pack_into(
+            self._map,
+            start,
+            len(payload),
+            zlib.crc32(payload),
+            self.generation,
+        )
+        self._map[start + RECORD.size : end] = payload
+        self.position = end
+        return start, end
+
+    def sync(self, start: int, end: int):
+        # msync só das páginas do registro, o ack espera por ele
+        page = start - start % mmap.PAGESIZE
+        self._map.flush(page, end - page)
+
+    def checkpoint(self, offset: int):
+        """_summary_
+
+        Args:
+            offset (int): end of the records already in the database
+        """
+        if offset >= self.position:
+            # nada pendente, recomeça do início com uma nova geração
+            self.generation += 1
+            self.start = self.position = HEADER.size
+        else:
+            self.start = offset
+        self._write_header(self.generation, self.start)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        log: WriteAheadLog,
+        flush_interval: float = 0.05,
+        max_batch: int = 500,
+    ):
+        self.engine = engine
+        self.log = log
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # todo_id -> user_id e valores, várias escritas viram uma só
+        self.pending: dict[int, dict] = {}
+        # lote sendo gravado, continua visível nas leituras até o commit
+        self.flushing: dict[int, dict] = {}
+        self._versions: dict[int, int] = {}
+        self._sequence = 0
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._task = None
+
+    def _merge(self, todo_id: int, user_id: int, values: dict):
+        entry = self.pending.setdefault(
+            todo_id, {'user_id': user_id, 'values': {}}
+        )
+        entry['values'].update(values)
+        self._sequence += 1
+        self._versions[user_id] = self._sequence
+
+    def load(self, records):
+        for record in records:
+            self._merge(record['todo_id'], record['user_id'], record['values'])
+
+    async def submit(self, todo_id: int, user_id: int, values: dict):
+        """_summary_
+
+        Args:
+            todo_id (int): todo already checked to belong to the user
+            user_id (int): owner of the todo
+            values (dict): changed fields, JSON serializable
+
+        Raises:
+            WriteAheadLogFull: the update is not in the log, it did not fit
+            even after a flush or the flush failed
+        """
+        record = {'todo_id': todo_id, 'user_id': user_id, 'values': values}
+        try:
+            start, end = self.log.append(record)
+        except WriteAheadLogFull:
+            try:
+                await self.flush()
+            except Exception as error:
+                raise WriteAheadLogFull(self.log.path) from error
+            start, end = self.log.append(record)
+
+        # entra no overlay já, o flush só marca o log até o offset que viu
+        self._merge(todo_id, user_id, values)
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+        await run_in_threadpool(self.log.sync, start, end)
+
+    def has_pending(self, todo_ids) -> bool:
+        return any(
+            todo_id in self.pending or todo_id in self.flushing
+            for todo_id in todo_ids
+        )
+
+    def pending_version(self, user_id: int) -> int | None:
+        return self._versions.get(user_id)
+
+    def overlay(self, row: dict) -> dict:
+        # valores pendentes por cima da linha lida do banco
+        for batch in (self.flushing, self.pending):
+            entry = batch.get(row['id'])
+            if entry is not None:
+                row.update(entry['values'])
+        if isinstance(row.get('state'), str):
+            row['state'] = TodoState(row['state'])
+        return row
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            self.flushing = batch
+            offset = self.log.position
+            users = {entry['user_id'] for entry in batch.values()}
+
+            try:
+                await self._write_isolated(batch)
+            except Exception:
+                # devolve o que sobrou do lote, escritas feitas durante o
+                # flush ganham
+                for todo_id, entry in batch.items():
+                    newer = self.pending.get(todo_id)
+                    if newer is not None:
+                        entry['values'].update(newer['values'])
+                    self.pending[todo_id] = entry
+                raise
+            finally:
+                self.flushing = {}
+
+            self.log.checkpoint(offset)
+            waiting = {entry['user_id'] for entry in self.pending.values()}
+            for user_id in users - waiting:
+                self._versions.pop(user_id, None)
+
+    async def _write_isolated(self, batch: dict):
+        try:
+            await self._write(batch)
+        except INVALID_WRITE:
+            # uma linha inválida derruba o lote inteiro, então cada todo vai
+            # sozinho e os que falham de novo saem da fila; erros de conexão
+            # interrompem o laço e o resto do lote volta para pending
+            for todo_id, entry in list(batch.items()):
+                try:
+                    await self._write({todo_id: entry})
+                except INVALID_WRITE:
+                    logger.exception('write-behind update of todo %d', todo_id)
+                    self._dead_letter(todo_id, entry)
+                del batch[todo_id]
+
+    def _dead_letter(self, todo_id: int, entry: dict):
+        record = {'todo_id': todo_id, **entry}
+        with self.log.path.with_suffix('.dead').open('a') as file:
+            file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    async def _write(self, batch: dict):
+        async with AsyncSession(self.engine) as session:
+            # trava as linhas, os states antigos saem dos contadores
+            rows = await session.execute(
+                select(Todo.id, Todo.user_id, Todo.state)
+                .where(Todo.id.in_(batch))
+                .with_for_update()
+            )
+
+            writes, deltas = [], defaultdict(Counter)
+            for row in rows:
+                entry = batch[row.id]
+                # todo apagado ou trocado de dono depois do 202 fica de fora
+                if row.user_id != entry['user_id']:
+                    continue
+                values = entry['values']
+                writes.append({'id': row.id, **values})
+                # todo usuário com escrita entra, a versão dos todos dele
+                # sobe mesmo sem mudança de state
+                user_deltas = deltas[row.user_id]
+                if 'state' in values and values['state'] != row.state:
+                    user_deltas[row.state] -= 1
+                    user_deltas[TodoState(values['state'])] += 1
+
+            if writes:
+                # UPDATE por chave primária, agrupado pelas mesmas colunas
+                writes.sort(key=sorted)
+                await session.execute(update(Todo), writes)
+            for user_id, user_deltas in deltas.items():
+                await bump_counters(session, user_id, user_deltas)
+            await session.commit()
+
+    async def _run(self):
+        while True:
+            with suppress(TimeoutError):
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # o lote volta para pending e é tentado no próximo ciclo
+                logger.exception('write-behind flush failed')
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+        try:
+            await self.flush()
+        finally:
+            self.log.close()
+        self.log.path.unlink()
+
+
+async def replay_logs(engine: AsyncEngine, directory: Path, size: int):
+    # logs sem lock são de workers que caíram antes do flush
+    for path in sorted(directory.glob('*.wal')):
+        try:
+            log = WriteAheadLog(path, size)
+        except BlockingIOError:
+            continue
+
+        queue = WriteBehindQueue(engine, log)
+        queue.load(log.records())
+        logger.info('replaying %d todos from %s', len(queue.pending), path)
+        try:
+            await queue.close()
+        except Exception:
+            # o log fica no diretório para a próxima subida, um banco fora
+            # do ar não pode impedir o worker de iniciar
+            logger.exception('replay of %s failed', path)
+
+
+async def open_write_behind(
+    engine: AsyncEngine, settings: Settings
+) -> WriteBehindQueue:
+    """_summary_
+
+    Args:
+        engine (AsyncEngine): engine of the app, used by the flushes
+        settings (Settings): WRITE_BEHIND_* options
+
+    Returns:
+        WriteBehindQueue: queue of this worker with its flusher running,
+        after the logs of crashed workers went to the database
+    """
+    directory = Path(settings.WRITE_BEHIND_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    await replay_logs(engine, directory, settings.WRITE_BEHIND_LOG_SIZE)
+
+    log = WriteAheadLog(
+        directory / f'{os.getpid()}.wal', settings.WRITE_BEHIND_LOG_SIZE
+    )
+    queue = WriteBehindQueue(
+        engine,
+        log,
+        settings.WRITE_BEHIND_FLUSH_INTERVAL,
+        settings.WRITE_BEHIND_MAX_BATCH,
+    )
+    queue.start()
+    return queue
+
+
+def get_write_behind(request: Request) -> WriteBehindQueue | None:
+    # None quando WRITE_BEHIND_DIR não está configurado
+    return request.app.state.write_behind
+
+
+def prefers_async(request: Request) -> bool:
+    prefer = request.headers.get('prefer', '')
+    return any(
+        token.strip().lower() == 'respond-async' for token in prefer.split(',')
+    )